@@ -1,29 +1,48 @@
 import argparse
+import json
+import os
+import sys
+from contextlib import nullcontext
 from enum import Enum
 
+#RAM address of the stack, variables get the words from 16 up to it
+STACK_BASE = 256
+
 class Command_Type(Enum):
     A_COMMAND = 0
     C_COMMAND = 1
     L_COMMAND = 2
 
 class AsmParser:
-    def __init__(self, input_file):
+    def __init__(self, lines, debug=False):
+        """
+        With debug, locations holds the line number of each command and the
+        fields of the last //@ comment before it
+        """
         self.commands = []
-        with open(input_file) as f:
-            for line in f:
-                command = ''.join(line.split())
-                comment_position = command.find("//")
-                if comment_position != -1:
-                    command = command[0:comment_position]
-                if command != "":
-                    self.commands.append(command)
+        self.locations = []
+        fields = []
+        for number, line in enumerate(lines, 1):
+            if debug and line.lstrip().startswith("//@"):
+                fields = line.split()[1:]
+                continue
+            command = ''.join(line.split())
+            comment_position = command.find("//")
+            if comment_position != -1:
+                command = command[0:comment_position]
+            if command != "":
+                self.commands.append(command)
+                if debug:
+                    self.locations.append((number, fields))
+        self.position = -1
 
     def hasMoreCommands(self):
-        return len(self.commands) > 0
+        return self.position + 1 < len(self.commands)
 
     def advance(self):
         if self.hasMoreCommands():
-            self.current_command = self.commands.pop(0)
+            self.position += 1
+            self.current_command = self.commands[self.position]
             if self.current_command[0] == '@':
                 self.command_type = Command_Type.A_COMMAND
             elif self.current_command[0] == '(' and self.current_command[len(self.current_command)-1] == ')':
@@ -162,6 +181,27 @@ class SymbolTable:
     def GetAddress(self, symbol):
         return self.symbols[symbol]
 
+class HackWriter:
+    def __init__(self, output_file, flush_threshold=4096):
+        """
+        Output words are collected in a buffer and written to output_file
+        in chunks of flush_threshold lines.
+        """
+        self.output_file = output_file
+        self.flush_threshold = flush_threshold
+        self.buffer = []
+
+    def write(self, word):
+        self.buffer.append(word)
+        if len(self.buffer) >= self.flush_threshold:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append("")
+            self.output_file.write('\n'.join(self.buffer))
+            self.buffer = []
+
 def isInt(s):
     try:
         int(s)
@@ -169,57 +209,208 @@ def isInt(s):
     except ValueError:
         return False
 
-parser = argparse.ArgumentParser()
-parser.add_argument("file")
-parser.add_argument("-o", nargs=1, required=False)
-args = parser.parse_args()
-
-try:
-    ext = args.file.split('.')[1]
-    if ext != "asm":
-        raise
-except:
-    print("Invalid file extension, should be .asm")
-    exit()
-
-output_file = ""
-
-if args.o is not None:
-    output_file = ''.join(args.o)
-else:
-    output_file = args.file.split('.')[0] + '.hack'
-
-symbol_table = SymbolTable()
-firstpass = AsmParser(args.file)
-
-command_number = 0
-while firstpass.hasMoreCommands():
-    firstpass.advance()
-    if firstpass.commandType() == Command_Type.A_COMMAND or firstpass.commandType() == Command_Type.C_COMMAND:
-        command_number += 1
-    else:
-        symbol_table.addEntry(firstpass.symbol(), command_number)
-
-secondpass = AsmParser(args.file)
-asm_code = AsmCode()
-variable_number = 16
-
-with open(output_file, "w") as f:
-    while secondpass.hasMoreCommands():
-        secondpass.advance()
-        if secondpass.commandType() == Command_Type.A_COMMAND:
-            s = secondpass.symbol()
-            if isInt(s):
-                f.write('0' + '{0:015b}'.format(int(s)) + '\n')
-            elif symbol_table.contains(s):
-                f.write('0' + '{0:015b}'.format(symbol_table.GetAddress(s)) + '\n')
+class AsmChunk:
+    def __init__(self, lines, debug=False):
+        """
+        Assembles lines on their own. words holds the binary of each
+        instruction, or the symbol name for A-commands that need the symbol
+        table, and labels maps each label to its offset in the chunk. link()
+        puts chunks together, so an unchanged chunk never has to be parsed again.
+        With debug, locations holds the (line, //@ fields) of each word.
+        """
+        self.words = []
+        self.labels = {}
+        self.locations = []
+        parser = AsmParser(lines, debug)
+        asm_code = AsmCode()
+        while parser.hasMoreCommands():
+            parser.advance()
+            if parser.commandType() == Command_Type.A_COMMAND:
+                s = parser.symbol()
+                if isInt(s):
+                    self.words.append('0' + '{0:015b}'.format(int(s)))
+                else:
+                    self.words.append(s)
+            elif parser.commandType() == Command_Type.C_COMMAND:
+                out = '111'
+                out += asm_code.comp(parser.comp())
+                out += asm_code.dest(parser.dest())
+                out += asm_code.jump(parser.jump())
+                self.words.append(out)
             else:
-                symbol_table.addEntry(s, variable_number)
-                variable_number += 1
-                f.write('0' + '{0:015b}'.format(symbol_table.GetAddress(s)) + '\n')
-        elif secondpass.commandType() == Command_Type.C_COMMAND:
-           out = '111' 
-           out += asm_code.comp(secondpass.comp())
-           out += asm_code.dest(secondpass.dest())
-           out += asm_code.jump(secondpass.jump())
-           f.write(out + '\n')
+                self.labels[parser.symbol()] = len(self.words)
+                continue
+            if debug:
+                self.locations.append(parser.locations[parser.position])
+
+def link(chunks, symbol_table=None):
+    """
+    Lays chunks out one after another and returns the binary words of the
+    whole program, with variables allocated from 16 in order of first use.
+    Variables past 255 would overlap the stack and are an error.
+    symbol_table, when given, is filled in for writeSymbols().
+    """
+    if symbol_table is None:
+        symbol_table = SymbolTable()
+    command_number = 0
+    for chunk in chunks:
+        for label, offset in chunk.labels.items():
+            symbol_table.addEntry(label, command_number + offset)
+        command_number += len(chunk.words)
+
+    variable_number = 16
+    words = []
+    for chunk in chunks:
+        for word in chunk.words:
+            #binary words start with a bit, symbols can't start with a digit
+            if word[0] != '0' and word[0] != '1':
+                if not symbol_table.contains(word):
+                    if variable_number == STACK_BASE:
+                        print("Out of variable space: " + word + " would go at RAM[" + str(STACK_BASE) + "], where the stack starts")
+                        exit()
+                    symbol_table.addEntry(word, variable_number)
+                    variable_number += 1
+                word = '0' + '{0:015b}'.format(symbol_table.GetAddress(word))
+            words.append(word)
+    return words
+
+def writeSymbols(symbol_table, output_file):
+    """
+    Writes every label and variable of a linked program with its address,
+    one per line in address order, leaving out the predefined symbols
+    """
+    predefined = SymbolTable().symbols
+    for address, symbol in sorted((address, symbol) for symbol, address in symbol_table.symbols.items() if symbol not in predefined):
+        output_file.write(symbol + " " + str(address) + "\n")
+
+def writeMap(chunks, output_file, names):
+    """
+    Writes the debug map of chunks assembled with debug, laid out the way
+    link() does: one line per ROM word with its address, the file:line of
+    its instruction in names[i] for chunk i, then the //@ fields carried
+    from the earlier stages, e.g. VM line, function and Jack line.
+    """
+    address = 0
+    for chunk, name in zip(chunks, names):
+        for number, fields in chunk.locations:
+            output_file.write(str(address) + " " + name + ":" + str(number) + "".join(" " + field for field in fields) + "\n")
+            address += 1
+
+#bumped whenever writeObject changes, so stale objects are not misread
+OBJECT_FORMAT = 1
+
+def writeObject(chunk, output_file, name):
+    """
+    Writes chunk as a relocatable object: its code with the words that
+    need a symbol's address left null, a relocation entry (offset, symbol)
+    for each of them, the labels it defines as offsets into the code, and
+    the symbols it uses without defining. name is the .asm file the chunk
+    came from, used by the debug map when the chunk has locations.
+    """
+    code = []
+    relocations = []
+    for offset, word in enumerate(chunk.words):
+        if word[0] != '0' and word[0] != '1':
+            relocations.append((offset, word))
+            code.append(None)
+        else:
+            code.append(word)
+    externals = sorted(set(symbol for offset, symbol in relocations if symbol not in chunk.labels))
+    json.dump({"format": OBJECT_FORMAT, "name": name, "code": code, "relocations": relocations,
+            "symbols": chunk.labels, "externals": externals, "locations": chunk.locations}, output_file, separators=(",", ":"))
+
+def readObject(input_file):
+    """
+    Reads an object written by writeObject back into a chunk for link(),
+    returning the chunk and the name it was written with
+    """
+    obj = json.load(input_file)
+    if obj.get("format") != OBJECT_FORMAT:
+        print("Unsupported object format in " + input_file.name)
+        exit()
+    chunk = AsmChunk([])
+    chunk.words = obj["code"]
+    for offset, symbol in obj["relocations"]:
+        chunk.words[offset] = symbol
+    chunk.labels = obj["symbols"]
+    chunk.externals = obj["externals"]
+    chunk.locations = obj["locations"]
+    return chunk, obj["name"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", help=".asm file, or - for stdin")
+    parser.add_argument("-o", nargs=1, required=False, help="output .hack file, or - for stdout")
+    parser.add_argument("--symbols", nargs="?", const="", metavar="FILE", help="write the address of every label and variable, next to the .hack file by default")
+    parser.add_argument("-c", "--object", action="store_true", help="write a relocatable .obj file for linker.py instead of a .hack file")
+    parser.add_argument("--map", nargs="?", const="", metavar="FILE", help="write the debug map of each ROM address back to its .asm line and the //@ locations of vmtranslator2 --debug, next to the .hack file by default; with -c the object keeps them for the linker")
+    parser.add_argument("--profile", nargs="?", const="-", metavar="FILE", help="time each pass and count allocations, printing the report or writing it to FILE as JSON")
+    args = parser.parse_args()
+
+    profiler = None
+    if args.profile is not None:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "13"))
+        from instrument import Profiler
+        profiler = Profiler()
+        profiler.wrap(AsmChunk, "__init__", "first pass", "instructions", lambda result, args: len(args[0].words))
+        profiler.wrap(sys.modules[__name__], "link", "second pass")
+        profiler.wrap(HackWriter, "flush", "write")
+
+    if args.file != "-":
+        try:
+            ext = args.file.split('.')[1]
+            if ext != "asm":
+                raise
+        except:
+            print("Invalid file extension, should be .asm")
+            exit()
+
+    output_file = ""
+
+    if args.o is not None:
+        output_file = ''.join(args.o)
+    elif args.file == "-":
+        output_file = "-"
+    else:
+        output_file = args.file.split('.')[0] + ('.obj' if args.object else '.hack')
+
+    for option, value in (("--symbols", args.symbols), ("--map", args.map)):
+        if value == "" and output_file == "-":
+            print("Give " + option + " a file when writing to stdout")
+            exit()
+
+    if args.file == "-":
+        lines = sys.stdin.readlines()
+    else:
+        with open(args.file) as f:
+            lines = f.readlines()
+
+    chunk = AsmChunk(lines, args.map is not None)
+    if args.object:
+        #the locations go in the object, the linker writes the map
+        with (nullcontext(sys.stdout) if output_file == "-" else open(output_file, "w")) as f:
+            writeObject(chunk, f, "-" if args.file == "-" else os.path.basename(args.file))
+    else:
+        with (nullcontext(sys.stdout) if output_file == "-" else open(output_file, "w")) as f:
+            writer = HackWriter(f)
+            symbol_table = SymbolTable()
+            for word in link([chunk], symbol_table):
+                writer.write(word)
+            writer.flush()
+
+        if args.symbols is not None:
+            symbols_file = args.symbols
+            if symbols_file == "":
+                symbols_file = output_file[:-5] + ".sym"
+            with open(symbols_file, "w") as f:
+                writeSymbols(symbol_table, f)
+
+        if args.map is not None:
+            map_file = args.map
+            if map_file == "":
+                map_file = output_file[:-5] + ".map"
+            with open(map_file, "w") as f:
+                writeMap([chunk], f, [os.path.basename(args.file)])
+
+    if profiler is not None:
+        profiler.write(args.profile)
@@ -0,0 +1,107 @@
+import argparse
+import os
+import sys
+from contextlib import nullcontext
+from assembler import HackWriter, SymbolTable, link, readObject, writeMap, writeSymbols
+
+def layout(object_files):
+    """
+    Orders objects the way vmtranslator2 lays out a directory: the
+    bootstrap first, the classes by name, the runtime routines last
+    """
+    def key(object_file):
+        name = os.path.basename(object_file)[:-4]
+        return (0 if name == "Bootstrap" else 2 if name == "Runtime" else 1, name)
+    return sorted(object_files, key=key)
+
+def readObjects(object_files):
+    """
+    Reads the objects in ROM order, returning their chunks and names.
+    A label defined by two objects is an error.
+    """
+    chunks = []
+    names = []
+    defined = {}
+    for object_file in layout(object_files):
+        with open(object_file) as f:
+            chunk, name = readObject(f)
+        for label in chunk.labels:
+            if label in defined:
+                print("Symbol " + label + " defined in both " + defined[label] + " and " + object_file)
+                exit()
+            defined[label] = object_file
+        chunks.append(chunk)
+        names.append(name)
+    return chunks, names
+
+def unresolved(chunks):
+    """
+    Returns the symbols used but defined by no object that look like
+    functions or labels, not statics. link() makes them variables, which is
+    never what a call or jump meant.
+    """
+    defined = set(label for chunk in chunks for label in chunk.labels)
+    symbols = set()
+    for chunk in chunks:
+        for symbol in chunk.externals:
+            if symbol not in defined and "." in symbol and not symbol.rsplit(".", 1)[1].isdigit():
+                symbols.add(symbol)
+    return sorted(symbols)
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Link relocatable objects from assembler.py -c or vmtranslator2.py -c into a .hack file")
+    arg_parser.add_argument("sources", nargs="+", help=".obj files, or directories of them")
+    arg_parser.add_argument("-o", "--output", help="output .hack file, or - for stdout; named after the directory or object by default")
+    arg_parser.add_argument("--symbols", nargs="?", const="", metavar="FILE", help="write the address of every label and variable, next to the .hack file by default")
+    arg_parser.add_argument("--map", nargs="?", const="", metavar="FILE", help="write the debug map of objects built with --debug/--map, next to the .hack file by default")
+    args = arg_parser.parse_args()
+
+    object_files = []
+    for source in args.sources:
+        if os.path.isdir(source):
+            object_files += [os.path.join(source, f) for f in os.listdir(source) if f.endswith(".obj")]
+        elif source.endswith(".obj"):
+            object_files.append(source)
+        else:
+            print("Wrong File Extension")
+            exit()
+
+    output_file = args.output
+    if output_file is None:
+        if len(args.sources) != 1:
+            print("Give -o when linking more than one source")
+            exit()
+        if os.path.isdir(args.sources[0]):
+            directory = os.path.normpath(args.sources[0])
+            output_file = os.path.join(directory, os.path.basename(os.path.abspath(directory)) + ".hack")
+        else:
+            output_file = args.sources[0][:-4] + ".hack"
+
+    for option, value in (("--symbols", args.symbols), ("--map", args.map)):
+        if value == "" and output_file == "-":
+            print("Give " + option + " a file when writing to stdout")
+            exit()
+
+    chunks, names = readObjects(object_files)
+    for symbol in unresolved(chunks):
+        print("Warning: " + symbol + " is not defined by any object", file=sys.stderr)
+    with (nullcontext(sys.stdout) if output_file == "-" else open(output_file, "w")) as f:
+        writer = HackWriter(f)
+        symbol_table = SymbolTable()
+        for word in link(chunks, symbol_table):
+            writer.write(word)
+        writer.flush()
+
+    if args.symbols is not None:
+        symbols_file = args.symbols
+        if symbols_file == "":
+            symbols_file = output_file[:-5] + ".sym"
+        with open(symbols_file, "w") as f:
+            writeSymbols(symbol_table, f)
+
+    if args.map is not None:
+        map_file = args.map
+        if map_file == "":
+            map_file = output_file[:-5] + ".map"
+        with open(map_file, "w") as f:
+            writeMap(chunks, f, names)
@@ -1,5 +1,6 @@
 import argparse
 import os
+import sys
 from enum import Enum
 
 def isInt(s):
@@ -74,44 +75,65 @@ class VMParser:
                 return ""
 
 class VMCodeWriter:
+    def __init__(self, flush_threshold=4096):
+        """
+        Assembly fragments are collected in a buffer and written to the
+        output file in chunks of flush_threshold fragments.
+        """
+        self.flush_threshold = flush_threshold
+        self.buffer = []
+        self.output_file = None
+
     def setFileName(self, file_name, prog_name):
+        if self.output_file is not None:
+            self.close()
         self.test_jump = 0
         self.output_file = open(file_name, "w")
         self.prog_name = prog_name
 
+    def write(self, text):
+        self.buffer.append(text)
+        if len(self.buffer) >= self.flush_threshold:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.output_file.write(''.join(self.buffer))
+            self.buffer = []
+
     def writeArithmetic(self, command):
-        self.output_file.write("@SP\nM=M-1\nA=M\nD=M\n")
+        self.write("@SP\nM=M-1\nA=M\nD=M\n")
         if command != "neg" and command != "not":
-            self.output_file.write("@SP\nM=M-1\nA=M\n")
+            self.write("@SP\nM=M-1\nA=M\n")
         if command == "add":
-            self.output_file.write("D=D+M\n")
+            self.write("D=D+M\n")
         elif command == "sub":
-            self.output_file.write("D=M-D\n")            
+            self.write("D=M-D\n")            
         elif command == "neg":
-            self.output_file.write("D=-D\n")
+            self.write("D=-D\n")
         elif command == "and":
-            self.output_file.write("D=D&M\n")
+            self.write("D=D&M\n")
         elif command == "or":
-            self.output_file.write("D=D|M\n")
+            self.write("D=D|M\n")
         elif command == "not":
-            self.output_file.write("D=!D\n")
+            self.write("D=!D\n")
         elif command =="eq" or command == "gt" or command == "lt":
-            self.output_file.write("D=M-D\n")
-            self.output_file.write("@TRUE" + str(self.test_jump) +"\n")
+            self.write("D=M-D\n")
+            self.write("@TRUE" + str(self.test_jump) +"\n")
             if command == "eq":
-                self.output_file.write("D;JEQ\n")
+                self.write("D;JEQ\n")
             elif command == "gt":
-                self.output_file.write("D;JGT\n")
+                self.write("D;JGT\n")
             elif command == "lt":
-                self.output_file.write("D;JLT\n")
-            self.output_file.write("D=0\n")
-            self.output_file.write("@ENDTEST"+ str(self.test_jump) + "\n")
-            self.output_file.write("0;JMP\n")
-            self.output_file.write("(TRUE" + str(self.test_jump) + ")\n")
-            self.output_file.write("D=-1\n")
-            self.output_file.write("(ENDTEST" + str(self.test_jump) + ")\n")
+                self.write("D;JLT\n")
+            self.write("D=0\n")
+            self.write("@ENDTEST"+ str(self.test_jump) + "\n")
+            self.write("0;JMP\n")
+            self.write("(TRUE" + str(self.test_jump) + ")\n")
+            self.write("D=-1\n")
+            self.write("(ENDTEST" + str(self.test_jump) + ")\n")
             self.test_jump += 1
-        self.output_file.write("@SP\nA=M\nM=D\n@SP\nM=M+1\n")
+        self.write("@SP\nA=M\nM=D\n@SP\nM=M+1\n")
 
     def writePushPop(self, command, segment, index):
         segments = {
@@ -130,47 +152,60 @@ class VMCodeWriter:
                 if index > 7:
                     print("Error: Push to temp segment out of bounds")
                     exit()
-                self.output_file.write("@" + str(index + 5) + "\nD=M\n")
+                self.write("@" + str(index + 5) + "\nD=M\n")
             elif segment == "constant":
-                self.output_file.write("@" + str(index) + "\nD=A\n")
+                self.write("@" + str(index) + "\nD=A\n")
             elif segment == "pointer":
                 if index > 1:
                     print("Error: Push to pointer segment out of bounds")
                     exit()
-                self.output_file.write("@" + str(index + 3) + "\nD=M\n")
+                self.write("@" + str(index + 3) + "\nD=M\n")
             elif segment == "static":
-                self.output_file.write("@" + self.prog_name + '.' + str(index) + "\nD=M\n")
+                self.write("@" + self.prog_name + '.' + str(index) + "\nD=M\n")
             else:
-                self.output_file.write("@" + str(index) + "\nD=A\n")
-                self.output_file.write("@" + s + "\nA=M\nA=A+D\nD=M\n")
-            self.output_file.write("@SP\nA=M\nM=D\n@SP\nM=M+1\n")
+                self.write("@" + str(index) + "\nD=A\n")
+                self.write("@" + s + "\nA=M\nA=D+A\nD=M\n")
+            self.write("@SP\nA=M\nM=D\n@SP\nM=M+1\n")
         elif command == CommandType.C_POP:
-            self.output_file.write("@SP\nM=M-1\nA=M\nD=M\n")
+            self.write("@SP\nM=M-1\nA=M\nD=M\n")
             if segment == "temp":
                 if index > 7:
                     print("Error: Pop to temp segment out of bounds")
                     exit()
-                self.output_file.write("@" + str(index + 5) + "\nM=D\n")
+                self.write("@" + str(index + 5) + "\nM=D\n")
             elif segment == "constant":
                 return
             elif segment == "pointer":
                 if index > 1:
                     print("Error: Pop to pointer segment out of bounds")
                     exit()
-                self.output_file.write("@" + str(index + 3) + "\nM=D\n")
+                self.write("@" + str(index + 3) + "\nM=D\n")
             elif segment == "static":
-                self.output_file.write("@" + self.prog_name + '.' + str(index) + "\nM=D\n")
+                self.write("@" + self.prog_name + '.' + str(index) + "\nM=D\n")
             else:
-                self.output_file.write("@13\nM=D\n@" + str(index)  + "\nD=A\n@" + s + "\nA=M\nA=A+D\nD=A\n@14\nM=D\n@13\nD=M\n@14\nA=M\nM=D\n")
+                self.write("@13\nM=D\n@" + str(index)  + "\nD=A\n@" + s + "\nA=M\nA=D+A\nD=A\n@14\nM=D\n@13\nD=M\n@14\nA=M\nM=D\n")
 
     def close(self):
+        self.flush()
         self.output_file.close()
+        self.output_file = None
 
 
 arg_parser = argparse.ArgumentParser()
 arg_parser.add_argument("source")
+arg_parser.add_argument("--profile", nargs="?", const="-", metavar="FILE", help="time each phase and count allocations, printing the report or writing it to FILE as JSON")
 args = arg_parser.parse_args()
 
+profiler = None
+if args.profile is not None:
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "13"))
+    from instrument import Profiler
+    profiler = Profiler()
+    profiler.wrap(VMParser, "__init__", "parse", "VM commands", lambda result, args: len(args[0].commands))
+    profiler.wrap(VMCodeWriter, "writeArithmetic", "code generation")
+    profiler.wrap(VMCodeWriter, "writePushPop", "code generation")
+    profiler.wrap(VMCodeWriter, "flush", "write")
+
 sources = []
 if os.path.isdir(args.source):
     sources = [os.path.join(args.source, f) for f in os.listdir(args.source) if os.path.isfile(os.path.join(args.source, f)) and f.endswith('.vm')]
@@ -193,3 +228,6 @@ for s in sources:
             code_writer.writePushPop(parser.commandType(), parser.arg1(), parser.arg2())
 
 code_writer.close()
+
+if profiler is not None:
+    profiler.write(args.profile)
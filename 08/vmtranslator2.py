@@ -1,6 +1,36 @@
 import argparse
+import io
 import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from enum import Enum
+from itertools import repeat
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "06"))
+import assembler
+
+ROM_SIZE = 32768
+# Share of runs on which a comparison jumps over its false branch.
+BRANCH_TAKEN = 0.5
+# Assumed iterations of each loop when estimating the cost of a call.
+LOOP_WEIGHT = 10
+
+SEGMENTS = {"local": "LCL", "argument": "ARG", "this": "THIS", "that": "THAT"}
+# Largest index reached with an A=A+1 chain while D is in use.
+INDEX_CHAIN = 8
+# Placeholder for a label local to one generated code sequence.
+LOCAL_LABEL = "{local}"
+
+# Comp suffixes for D op (A, M or 1), and for x op y with y in D, x in M.
+BINARY_OPS = {"add": "+", "sub": "-", "and": "&", "or": "|", "eq": "-", "gt": "-", "lt": "-"}
+STACK_OPS = {"add": "D+M", "sub": "M-D", "and": "D&M", "or": "D|M", "eq": "M-D", "gt": "M-D", "lt": "M-D"}
+IN_PLACE_OPS = {"add": "D+M", "sub": "M-D", "and": "D&M", "or": "D|M"}
+UNARY_OPS = {"neg": "-", "not": "!"}
+COMPARISONS = {"eq": "JEQ", "gt": "JGT", "lt": "JLT"}
+# Jumps into the Runtime routines, whose cost the report adds to the site.
+ROUTINES = frozenset(["@Runtime$call", "@Runtime$return", "@Runtime$tailcall"])
+INVERTED_JUMPS = {"JEQ": "JNE", "JGT": "JLE", "JLT": "JGE", "JNE": "JEQ", "JLE": "JGT", "JGE": "JLT"}
 
 def isInt(s):
     try:
@@ -20,17 +50,37 @@ class CommandType(Enum):
     C_RETURN = 7
     C_CALL = 8
 
+TILED_COMMANDS = [CommandType.C_PUSH, CommandType.C_POP, CommandType.C_ARITHMETIC, CommandType.C_IF]
+
 class VMParser:
-    def __init__(self, source_file):
+    def __init__(self, source_file, debug=False):
+        """
+        With debug, locations holds the debug fields of each command: its
+        file:line and function, then the fields of the last //@ comment
+        jackcompiler --debug wrote before it.
+        """
         self.commands = []
-        with open(source_file) as f:
-            for line in f:
+        self.locations = []
+        self.current_location = None
+        name = os.path.basename(source_file)
+        function_name = ""
+        source_fields = []
+        with (sys.stdin if source_file == "-" else open(source_file)) as f:
+            for number, line in enumerate(f, 1):
                 command = ' '.join(line.split())
+                if debug and command.startswith("//@"):
+                    source_fields = command.split()[1:]
+                    continue
+                if debug and command.startswith("function "):
+                    function_name = command.split()[1]
                 comment_position = command.find("//")
                 if comment_position != -1:
                     command = command[0:comment_position]
                 if command != "":
                     self.commands.append(command)
+                    if debug:
+                        #the Jack function is the same as the VM one, so only its line is kept
+                        self.locations.append([name + ":" + str(number), function_name] + [field for field in source_fields if ":" in field])
 
     def hasMoreCommands(self):
         return len(self.commands) > 0
@@ -38,6 +88,12 @@ class VMParser:
     def advance(self):
         if self.hasMoreCommands():
             self.current_command = self.commands.pop(0)
+            if self.locations:
+                self.current_location = self.locations.pop(0)
+
+    def peek(self):
+        if self.hasMoreCommands():
+            return self.commands[0]
 
     def commandType(self):
         if self.current_command[0:8] == "function":
@@ -74,19 +130,49 @@ class VMParser:
                 return ""
 
 class VMCodeWriter:
-    def __init__(self, file_name, bootstrap):
-        self.test_jump = 0
-        self.ret_addr = 0
-        self.output_file = open(file_name, "w")
+    def __init__(self, output_file, flush_threshold=4096, shared_calls=False):
+        """
+        Output lines are collected in a buffer and written to output_file
+        in chunks of flush_threshold lines. With shared_calls, call and
+        return sites jump to the Runtime routines instead of carrying their
+        own copy of the frame code, trading cycles for ROM.
+        """
+        self.output_file = output_file
+        self.flush_threshold = flush_threshold
+        self.shared_calls = shared_calls
+        self.buffer = []
         self.function_name = ""
-        if bootstrap:
-            self.writeInit()
+        self.report = None
+        self.uses_runtime = False
 
     def setProgName(self, prog_name):
+        """
+        Generated labels are namespaced by the program name, so each file
+        can be translated on its own and the chunks concatenated afterwards.
+        """
         self.prog_name = prog_name
+        self.test_jump = 0
+        self.ret_addr = 0
 
     def write(self, command):
-        self.output_file.write(command + '\n')
+        self.buffer.append(command)
+        if len(self.buffer) >= self.flush_threshold:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            if self.report is not None:
+                self.report.scan(self.buffer)
+            self.buffer.append("")
+            self.output_file.write('\n'.join(self.buffer))
+            self.buffer = []
+
+    def writeLocation(self, fields):
+        """
+        Writes a //@ comment of debug fields, which the assembler's --map
+        gives the instructions after it
+        """
+        self.write("//@ " + " ".join(fields))
 
     def writeInit(self):
         self.write("@256")
@@ -106,242 +192,780 @@ class VMCodeWriter:
         self.write("0;JMP")
 
     def writeIf(self, label):
-        self.writePopD()
-        self.write("@" + self.function_name + "$" + label)
-        self.write("D;JNE")
+        self.writeCode(self.popD() + self.jumpCode("JNE", label))
 
     def writeCall(self, functionName, numArgs):
-        self.write("@retaddr" + str(self.ret_addr))
+        """
+        Shared call sites pass the argument count in R13, the callee in R14
+        and the return address in D to the Runtime$call routine.
+        """
+        ret_label = self.prog_name + "$ret." + str(self.ret_addr)
+        if not self.shared_calls:
+            self.writeCode(["@" + ret_label, "D=A", "@SP", "A=M", "M=D"])
+            for s in ["@LCL", "@ARG", "@THIS", "@THAT"]:
+                self.writeCode([s, "D=M", "@SP", "AM=M+1", "M=D"])
+            self.writeCode(["@SP", "MD=M+1", "@LCL", "M=D"])
+            self.writeCode(["@" + str(numArgs + 5), "D=D-A", "@ARG", "M=D"])
+            self.writeCode(["@" + functionName, "0;JMP", "(" + ret_label + ")"])
+            self.ret_addr += 1
+            return
+        if numArgs <= 1:
+            self.write("@R13")
+            self.write("M=" + str(numArgs))
+        else:
+            self.write("@" + str(numArgs))
+            self.write("D=A")
+            self.write("@R13")
+            self.write("M=D")
+        self.write("@" + functionName)
         self.write("D=A")
-        self.writePushD()
-        for s in ["@LCL", "@ARG", "@THIS", "@THAT"]:
-            self.write(s)
-            self.write("D=M")
-            self.writePushD()
-        self.write("@SP")
-        self.write("D=M")
-        self.write("@LCL")
-        self.write("M=D")
-        self.write("@" + str(numArgs + 5))
-        self.write("D=D-A")
-        self.write("@ARG")
+        self.write("@R14")
         self.write("M=D")
-        self.write("@" + functionName)
+        self.write("@" + ret_label)
+        self.write("D=A")
+        self.write("@Runtime$call")
         self.write("0;JMP")
-        self.write("(retaddr" + str(self.ret_addr) + ")")
+        self.write("(" + ret_label + ")")
         self.ret_addr += 1
+        self.uses_runtime = True
 
     def writeReturn(self):
-        #R13 = FRAME, R14 = RET
-        self.write("@LCL")
-        self.write("D=M")
-        self.write("@R13")
-        self.write("M=D")
-        self.write("@R13")
-        self.write("D=M")
-        self.write("@5")
-        self.write("A=D-A")
-        self.write("D=M")
-        self.write("@R14")
-        self.write("M=D")
-        self.writePopD()
-        self.write("@ARG")
-        self.write("A=M")
-        self.write("M=D")
-        self.write("@ARG")
-        self.write("D=M")
-        self.write("@SP")
-        self.write("M=D+1")
-        for i, s in enumerate(["@THAT", "@THIS", "@ARG", "@LCL"], start = 1):
+        if not self.shared_calls:
+            self.writeCode(self.returnCode())
+            return
+        self.write("@Runtime$return")
+        self.write("0;JMP")
+        self.uses_runtime = True
+
+    def returnCode(self):
+        #R14 = RET, LCL walks down the saved frame
+        return (["@5", "D=A", "@LCL", "A=M-D", "D=M", "@R14", "M=D"]
+            + self.popD() + ["@ARG", "A=M", "M=D", "D=A+1", "@SP", "M=D"]
+            + ["@LCL", "AM=M-1", "D=M", "@THAT", "M=D"]
+            + ["@LCL", "AM=M-1", "D=M", "@THIS", "M=D"]
+            + ["@LCL", "AM=M-1", "D=M", "@ARG", "M=D"]
+            + ["@LCL", "A=M-1", "D=M", "@LCL", "M=D"]
+            + ["@R14", "A=M", "0;JMP"])
+
+    def writeTailCall(self, functionName, numArgs):
+        """
+        call followed directly by return: Runtime$tailcall reuses the
+        current frame, so the callee returns straight to our caller.
+        """
+        if numArgs <= 1:
+            self.write("@R13")
+            self.write("M=" + str(numArgs))
+        else:
+            self.write("@" + str(numArgs))
+            self.write("D=A")
             self.write("@R13")
-            self.write("D=M")
-            self.write("@" + str(i))
-            self.write("A=D-A")
-            self.write("D=M")
-            self.write(s)
             self.write("M=D")
+        self.write("@" + functionName)
+        self.write("D=A")
         self.write("@R14")
-        self.write("A=M")
+        self.write("M=D")
+        self.write("@Runtime$tailcall")
         self.write("0;JMP")
+        self.uses_runtime = True
+
+    def writeRuntime(self):
+        """
+        Writes the routines shared by every tail call site, and by every
+        call and return site with shared_calls.
+        """
+        self.write("(Runtime$call)")
+        self.writeCode(self.callRoutine())
+        self.write("(Runtime$return)")
+        self.writeCode(self.returnCode())
+        setup, copy, finish = self.tailCallRoutine()
+        self.write("(Runtime$tailcall)")
+        self.writeCode(setup)
+        self.write("(Runtime$tailcall.copy)")
+        self.writeCode(copy)
+        self.writeCode(finish)
+
+    def callRoutine(self):
+        return (["@SP", "A=M", "M=D"]
+            + ["@LCL", "D=M", "@SP", "AM=M+1", "M=D"]
+            + ["@ARG", "D=M", "@SP", "AM=M+1", "M=D"]
+            + ["@THIS", "D=M", "@SP", "AM=M+1", "M=D"]
+            + ["@THAT", "D=M", "@SP", "AM=M+1", "M=D"]
+            + ["@SP", "MD=M+1", "@LCL", "M=D"]
+            + ["@R13", "D=D-M", "@5", "D=D-A", "@ARG", "M=D"]
+            + ["@R14", "A=M", "0;JMP"])
+
+    def tailCallRoutine(self):
+        """
+        Returns the code of Runtime$tailcall before its copy loop, the loop,
+        which runs once per argument and saved frame word, and after it.
+        Pushes a copy of the saved frame above the new arguments, then moves
+        arguments and frame down to ARG; LCL walks the destination.
+        """
+        setup = []
+        for i in range(5, 1, -1):
+            setup += ["@" + str(i), "D=A", "@LCL", "A=M-D", "D=M"] + self.pushD()
+        setup += ["@LCL", "A=M-1", "D=M"] + self.pushD()
+        setup += ["@5", "D=A", "@R13", "MD=D+M", "@SP", "D=M-D", "@R15", "M=D", "@ARG", "D=M", "@LCL", "M=D"]
+        copy = ["@R15", "AM=M+1", "A=A-1", "D=M", "@LCL", "AM=M+1", "A=A-1", "M=D"]
+        copy += ["@R13", "MD=M-1", "@Runtime$tailcall.copy", "D;JGT"]
+        finish = ["@LCL", "D=M", "@SP", "M=D", "@R14", "A=M", "0;JMP"]
+        return setup, copy, finish
  
     def writeFunction(self, functionName, numLocals):
         self.function_name = functionName
         self.write("(" + functionName + ")")
-        for i in range(0, numLocals):
-            self.write("D=0")
-            self.writePushD()
+        if numLocals == 1:
+            self.writeCode(["@SP", "M=M+1", "A=M-1", "M=0"])
+        elif numLocals > 1:
+            self.writeCode(["@SP", "A=M", "M=0"])
+            for i in range(1, numLocals):
+                self.writeCode(["A=A+1", "M=0"])
+            self.writeCode(["D=A+1", "@SP", "M=D"])
 
     def writeArithmetic(self, command):
-        self.writePopD()
-        if command != "neg" and command != "not":
-            self.write("@SP")
-            self.write("M=M-1")
-            self.write("A=M")
-        if command == "add":
-            self.write("D=D+M")
-        elif command == "sub":
-            self.write("D=M-D")            
-        elif command == "neg":
-            self.write("D=-D")
-        elif command == "and":
-            self.write("D=D&M")
-        elif command == "or":
-            self.write("D=D|M")
-        elif command == "not":
-            self.write("D=!D")
-        elif command =="eq" or command == "gt" or command == "lt":
-            self.write("D=M-D")
-            self.write("@TRUE" + str(self.test_jump))
-            if command == "eq":
-                self.write("D;JEQ")
-            elif command == "gt":
-                self.write("D;JGT")
-            elif command == "lt":
-                self.write("D;JLT")
-            self.write("D=0")
-            self.write("@ENDTEST"+ str(self.test_jump))
-            self.write("0;JMP")
-            self.write("(TRUE" + str(self.test_jump) + ")")
-            self.write("D=-1")
-            self.write("(ENDTEST" + str(self.test_jump) + ")")
-            self.test_jump += 1
-        self.writePushD()
-
-    def writePushD(self):
-        self.write("@SP")
-        self.write("A=M")
-        self.write("M=D")
-        self.write("@SP")
-        self.write("M=M+1")
-
-    def writePopD(self):
-        self.write("@SP")
-        self.write("AM=M-1")
-        self.write("D=M")
+        self.writeCode(self.arithmeticCode(command))
 
     def writePushPop(self, command, segment, index):
-        segments = {
-                "local": "LCL",
-                "argument": "ARG",
-                "this": "THIS",
-                "that": "THAT",
-                "temp": "temp",
-                "constant": "constant",
-                "pointer": "pointer",
-                "static": "static",
-                }
-        s = segments[segment]
-        if command == CommandType.C_PUSH:
-            if segment == "temp":
-                if index > 7:
-                    print("Error: Push to temp segment out of bounds")
-                    exit()
-                self.write("@" + str(index + 5))
-                self.write("D=M")
-            elif segment == "constant":
-                self.write("@" + str(index))
-                self.write("D=A")
-            elif segment == "pointer":
-                if index > 1:
-                    print("Error: Push to pointer segment out of bounds")
-                    exit()
-                self.write("@" + str(index + 3))
-                self.write("D=M")
-            elif segment == "static":
-                self.write("@" + self.prog_name + '.' + str(index))
-                self.write("D=M")
+        self.writeCode(self.pushPopCode(command, segment, index))
+
+    def writeCode(self, lines):
+        """
+        Writes generated code, giving its LOCAL_LABEL a unique name.
+        """
+        label = None
+        for line in lines:
+            if LOCAL_LABEL in line:
+                if label is None:
+                    label = self.prog_name + "$TRUE." + str(self.test_jump)
+                    self.test_jump += 1
+                line = line.replace(LOCAL_LABEL, label)
+            self.write(line)
+
+    def writeCommands(self, commands):
+        """
+        Covers a run of push, pop, arithmetic and if-goto commands with the
+        cheapest sequence of tiles. best[i] is the number of instructions
+        needed for commands[i:] and choice[i] the tile starting there.
+        """
+        n = len(commands)
+        best = [0] * (n + 1)
+        choice = [None] * n
+        for i in range(n - 1, -1, -1):
+            for length, lines in self.tiles(commands, i):
+                cost = instructionCount(lines) + best[i + length]
+                if choice[i] is None or cost < best[i]:
+                    best[i] = cost
+                    choice[i] = (length, lines)
+        i = 0
+        while i < n:
+            length, lines = choice[i]
+            if commands[i][4] is not None:
+                self.writeLocation(commands[i][4])
+            for command in commands[i:i + length]:
+                self.write("//" + command[3])
+            self.writeCode(lines)
+            i += length
+
+    def tiles(self, commands, i):
+        """
+        Yields (commands covered, code) for every tile matching at i.
+        """
+        c = commands[i]
+        yield 1, self.singleCode(c)
+        if c[0] == CommandType.C_PUSH and i + 1 < len(commands):
+            # in place on the stack top: push y; add
+            n = commands[i + 1]
+            if n[0] == CommandType.C_ARITHMETIC and n[1] in IN_PLACE_OPS:
+                y = self.inPlaceOperand(c[1], c[2], n[1])
+                if y is not None:
+                    yield 2, y[0] + ["@SP", "A=M-1", "M=" + y[1]]
+        if i + 3 < len(commands):
+            # in place in memory: push x; push y; add; pop x
+            x, y, op, z = commands[i:i + 4]
+            if (x[0] == CommandType.C_PUSH and y[0] == CommandType.C_PUSH and op[0] == CommandType.C_ARITHMETIC
+                    and op[1] in IN_PLACE_OPS and z[0] == CommandType.C_POP and (x[1], x[2]) == (z[1], z[2])):
+                operand = self.inPlaceOperand(y[1], y[2], op[1])
+                address = self.address(z[1], z[2])
+                if operand is not None and address is not None:
+                    yield 4, operand[0] + address + ["M=" + operand[1]]
+        for length, lines, jump in self.producers(commands, i):
+            if jump is None:
+                yield length, lines + self.pushD()
             else:
-                self.write("@" + s)
-                self.write("D=M")
-                self.write("@" + str(index))
-                self.write("A=A+D")
-                self.write("D=M")
-            self.writePushD()
-        elif command == CommandType.C_POP:
-            if segment == "temp":
-                if index > 7:
-                    print("Error: Pop to temp segment out of bounds")
-                    exit()
-                self.writePopD()
-                self.write("@" + str(index + 5))
-                self.write("M=D")
-            elif segment == "constant":
-                return
-            elif segment == "pointer":
-                if index > 1:
-                    print("Error: Pop to pointer segment out of bounds")
-                    exit()
-                self.writePopD()
-                self.write("@" + str(index + 3))
-                self.write("M=D")
-            elif segment == "static":
-                self.writePopD()
-                self.write("@" + self.prog_name + '.' + str(index))
-                self.write("M=D")
+                yield length, lines + ["@SP", "M=M+1", "A=M-1", "M=-1", "@" + LOCAL_LABEL, "D;" + jump, "@SP", "A=M-1", "M=0", "(" + LOCAL_LABEL + ")"]
+            if i + length < len(commands):
+                sink = commands[i + length]
+                if sink[0] == CommandType.C_IF:
+                    yield length + 1, lines + self.jumpCode("JNE" if jump is None else jump, sink[1])
+                elif sink[0] == CommandType.C_POP and jump is None:
+                    yield length + 1, lines + self.storeD(sink[1], sink[2])
+
+    def producers(self, commands, i):
+        """
+        Yields (commands covered, code, jump) for tiles that leave their
+        result in D instead of on the stack. Comparisons leave x - y in D
+        with the jump condition that makes them true, so a following not
+        just inverts the jump.
+        """
+        for length, lines, jump in self.valueProducers(commands, i):
+            yield length, lines, jump
+            j = i + length
+            if j < len(commands) and commands[j][0] == CommandType.C_ARITHMETIC and commands[j][1] == "not":
+                if jump is None:
+                    yield length + 1, lines + ["D=!D"], None
+                else:
+                    yield length + 1, lines, INVERTED_JUMPS[jump]
+
+    def valueProducers(self, commands, i):
+        c = commands[i]
+        rest = commands[i + 1:i + 3]
+        if c[0] == CommandType.C_PUSH:
+            x = self.loadD(c[1], c[2])
+            yield 1, x, None
+            if len(rest) >= 1 and rest[0][0] == CommandType.C_ARITHMETIC and rest[0][1] == "neg":
+                yield 2, x + ["D=-D"], None
+            if len(rest) == 2 and rest[0][0] == CommandType.C_PUSH and rest[1][0] == CommandType.C_ARITHMETIC and rest[1][1] in BINARY_OPS:
+                y = self.operand(rest[0][1], rest[0][2])
+                op = rest[1][1]
+                if y is not None:
+                    if y[1] == "A" and rest[0][2] == 1 and op in ("add", "sub"):
+                        yield 3, x + ["D=D" + BINARY_OPS[op] + "1"], None
+                    elif y[1] == "A" and rest[0][2] == 0 and op in COMPARISONS:
+                        #x - 0 is x, so x; push constant 0; eq; if-goto is one D;JEQ
+                        yield 3, x, COMPARISONS[op]
+                    else:
+                        yield 3, x + y[0] + ["D=D" + BINARY_OPS[op] + y[1]], COMPARISONS.get(op)
+            if len(rest) >= 1 and rest[0][0] == CommandType.C_ARITHMETIC and rest[0][1] in BINARY_OPS:
+                # push y; op with x on the stack
+                op = rest[0][1]
+                yield 2, x + ["@SP", "AM=M-1", "D=" + STACK_OPS[op]], COMPARISONS.get(op)
+        elif c[0] == CommandType.C_ARITHMETIC:
+            if c[1] in UNARY_OPS:
+                yield 1, ["@SP", "AM=M-1", "D=" + UNARY_OPS[c[1]] + "M"], None
             else:
-                self.write("@" + s)
-                self.write("D=M")
-                self.write("@" + str(index))
-                self.write("A=D+A")
-                self.write("D=A")
-                self.write("@R15")
-                self.write("M=D")
-                self.writePopD()
-                self.write("@R15")
-                self.write("A=M")
-                self.write("M=D")
-                
-    def close(self):
-        self.output_file.close()
-
-
-arg_parser = argparse.ArgumentParser()
-arg_parser.add_argument("source")
-args = arg_parser.parse_args()
-
-output_file = ""
-
-sources = []
-if os.path.isdir(args.source):
-    sources = [os.path.join(args.source, f) for f in os.listdir(args.source) if os.path.isfile(os.path.join(args.source, f)) and f.endswith('.vm')]
-    output_file = args.source
-    if not args.source.endswith('/'):
-        output_file += '/'
-    output_file = args.source
-    output_file += output_file.split('/')[-2] + ".asm"
-else:
-    if args.source.endswith('.vm'):
-        sources.append(args.source)
-        output_file = args.source[0:-3] + ".asm"
-    else:
-        print("Wrong File Extension")
-        exit()
-
-code_writer = VMCodeWriter(output_file, len(sources) > 1)
-for s in sources:
-    parser = VMParser(s)
-    if "/" in s:
-        code_writer.setProgName(s.split('/')[-1][0:-3])
-    else:
-        code_writer.setProgName(s[0:-3])
+                yield 1, ["@SP", "M=M-1", "AM=M-1", "D=M", "A=A+1", "D=D" + BINARY_OPS[c[1]] + "M"], COMPARISONS.get(c[1])
+
+    def singleCode(self, command):
+        if command[0] == CommandType.C_ARITHMETIC:
+            return self.arithmeticCode(command[1])
+        elif command[0] == CommandType.C_IF:
+            return self.popD() + self.jumpCode("JNE", command[1])
+        return self.pushPopCode(command[0], command[1], command[2])
+
+    def arithmeticCode(self, command):
+        if command in UNARY_OPS:
+            return ["@SP", "A=M-1", "M=" + UNARY_OPS[command] + "M"]
+        elif command in COMPARISONS:
+            return self.popD() + ["A=A-1", "D=M-D", "M=-1", "@" + LOCAL_LABEL, "D;" + COMPARISONS[command], "@SP", "A=M-1", "M=0", "(" + LOCAL_LABEL + ")"]
+        return self.popD() + ["A=A-1", "M=" + STACK_OPS[command]]
+
+    def jumpCode(self, jump, label):
+        return ["@" + self.function_name + "$" + label, "D;" + jump]
+
+    def pushD(self):
+        return ["@SP", "M=M+1", "A=M-1", "M=D"]
+
+    def popD(self):
+        return ["@SP", "AM=M-1", "D=M"]
+
+    def checkBounds(self, command, segment, index):
+        if segment == "temp" and index > 7:
+            print("Error: " + command + " to temp segment out of bounds")
+            exit()
+        if segment == "pointer" and index > 1:
+            print("Error: " + command + " to pointer segment out of bounds")
+            exit()
+
+    def directAddress(self, segment, index):
+        if segment == "temp":
+            return "@" + str(index + 5)
+        elif segment == "pointer":
+            return "@" + str(index + 3)
+        elif segment == "static":
+            return "@" + self.prog_name + '.' + str(index)
+
+    def address(self, segment, index):
+        """
+        Code leaving the address of segment[index] in A without touching D,
+        or None when that would need D.
+        """
+        if segment == "constant":
+            return None
+        elif segment in SEGMENTS:
+            if index > INDEX_CHAIN:
+                return None
+            elif index == 0:
+                return ["@" + SEGMENTS[segment], "A=M"]
+            return ["@" + SEGMENTS[segment], "A=M+1"] + ["A=A+1"] * (index - 1)
+        return [self.directAddress(segment, index)]
+
+    def loadD(self, segment, index):
+        self.checkBounds("Push", segment, index)
+        if segment == "constant":
+            if index <= 1:
+                return ["D=" + str(index)]
+            return ["@" + str(index), "D=A"]
+        elif segment in SEGMENTS and index > 2:
+            return ["@" + str(index), "D=A", "@" + SEGMENTS[segment], "A=D+M", "D=M"]
+        return self.address(segment, index) + ["D=M"]
+
+    def storeD(self, segment, index):
+        self.checkBounds("Pop", segment, index)
+        address = self.address(segment, index)
+        if address is None:
+            return ["@R13", "M=D", "@" + SEGMENTS[segment], "D=M", "@" + str(index), "D=D+A", "@R14", "M=D", "@R13", "D=M", "@R14", "A=M", "M=D"]
+        return address + ["M=D"]
+
+    def operand(self, segment, index):
+        """
+        Code making segment[index] available as A or M while D is in use,
+        as (code, register), or None.
+        """
+        if segment == "constant":
+            return ["@" + str(index)], "A"
+        address = self.address(segment, index)
+        if address is None:
+            return None
+        return address, "M"
+
+    def inPlaceOperand(self, segment, index, command):
+        """
+        Code and comp for applying command to M with segment[index] as its
+        second operand, or None.
+        """
+        if segment == "constant" and index == 1 and (command == "add" or command == "sub"):
+            return [], "M" + BINARY_OPS[command] + "1"
+        load = self.loadD(segment, index)
+        if load is None:
+            return None
+        return load, IN_PLACE_OPS[command]
+
+    def pushPopCode(self, command, segment, index):
+        if command == CommandType.C_PUSH:
+            return self.loadD(segment, index) + self.pushD()
+        elif segment == "constant":
+            return []
+        address = self.address(segment, index)
+        if address is None:
+            return ["@" + SEGMENTS[segment], "D=M", "@" + str(index), "D=D+A", "@R13", "M=D"] + self.popD() + ["@R13", "A=M", "M=D"]
+        return self.popD() + self.storeD(segment, index)
+
+
+class CostReport:
+    """
+    Static size and cost model built from the assembly as it is written.
+    Every VM command costs the Hack instructions emitted under its //
+    comment, less BRANCH_TAKEN of those between a comparison's jump and its
+    local label, and commands inside a loop (between a label and a later
+    jump back to it) are weighted by LOOP_WEIGHT per level. A tile's code
+    comes after the comments of all the commands it covers, and is shared
+    out between them in proportion to what each would cost on its own.
+    Call, return and tail call sites that jump to a Runtime routine also
+    pay for the routine.
+    """
+    def __init__(self):
+        self.functions = {}
+        self.commands = None
+        #commands whose comments came one after another, and whether more can join
+        self.tile = []
+        self.open = False
+        #local label of the comparison jump being scanned, and its false branch
+        self.target = None
+        self.skipping = None
+
+    def scan(self, lines):
+        for line in lines:
+            if self.skipping is not None and line == "(" + self.skipping + ")":
+                self.skipping = None
+            if line.startswith("//@"):
+                continue
+            elif line.startswith("//"):
+                command = line[2:]
+                if command == "return" and self.open and len(self.tile) == 1 and self.tile[0][0].startswith("call "):
+                    #call then return is one tail call
+                    self.tile[0][0] = "tailcall" + self.tile[0][0][4:]
+                    continue
+                if not self.open:
+                    self.settle()
+                if command.startswith("function "):
+                    self.commands = self.functions.setdefault(command.split(' ')[1], [])
+                elif self.commands is None:
+                    self.commands = self.functions.setdefault("(bootstrap)", [])
+                self.commands.append([command, 0, 0, None])
+                self.tile.append(self.commands[-1])
+                self.open = True
+            elif line.startswith("(Runtime$") and "." not in line:
+                self.settle()
+                self.commands = self.functions.setdefault(line[1:-1], [])
+                self.commands.append(["runtime", 0, 0, None])
+                self.open = False
+            elif line[0] == '(':
+                self.open = False
+            else:
+                self.open = False
+                if self.commands is None:
+                    self.commands = self.functions.setdefault("(bootstrap)", [])
+                if len(self.commands) == 0:
+                    self.commands.append(["bootstrap", 0, 0, None])
+                self.commands[-1][1] += 1
+                if self.skipping is not None:
+                    self.commands[-1][2] += 1
+                if line in ROUTINES:
+                    self.commands[-1][3] = line[1:]
+                if self.target is not None and line.startswith("D;J"):
+                    self.skipping = self.target
+                self.target = line[1:] if line.startswith("@") and "$TRUE." in line else None
+
+    def settle(self):
+        """
+        Shares the code scanned under the last run of comments out between
+        its commands; it was all counted against the last one.
+        """
+        if len(self.tile) > 1:
+            weights = [standaloneCost(command) for command, _, _, _ in self.tile]
+            last = self.tile[-1]
+            for field in (1, 2):
+                total = last[field]
+                for command, weight in zip(self.tile[:-1], weights):
+                    command[field] = total * weight // sum(weights)
+                    last[field] -= command[field]
+        self.tile = []
+        self.open = False
+
+    def merge(self, other):
+        other.settle()
+        self.functions.update(other.functions)
+
+    def size(self):
+        return sum(n for commands in self.functions.values() for _, n, _, _ in commands)
+
+    def cost(self, command, n, skip, routine):
+        """
+        Cycles one run of a command takes
+        """
+        cost = n - BRANCH_TAKEN * skip
+        if routine is not None:
+            cost += routineCost(routine, command)
+        return cost
+
+    def functionCosts(self):
+        """
+        Returns (name, instructions, estimated cycles per call) for every function.
+        """
+        costs = []
+        for name, commands in self.functions.items():
+            labels = {}
+            loops = []
+            for i, (command, _, _, _) in enumerate(commands):
+                words = command.split(' ')
+                if words[0] == "label":
+                    labels[words[1]] = i
+                elif (words[0] == "goto" or words[0] == "if-goto") and words[1] in labels:
+                    loops.append((labels[words[1]], i))
+            size = 0
+            cost = 0
+            for i, (command, n, skip, routine) in enumerate(commands):
+                depth = sum(1 for start, end in loops if start <= i <= end)
+                size += n
+                cost += self.cost(command, n, skip, routine) * LOOP_WEIGHT ** depth
+            costs.append((name, size, cost))
+        return costs
+
+    def commandCosts(self):
+        """
+        Returns (command kind, occurrences, instructions each) for the cost
+        model, where push and pop are keyed by segment.
+        """
+        kinds = {}
+        for commands in self.functions.values():
+            for command, n, skip, routine in commands:
+                words = command.split(' ')
+                kind = ' '.join(words[0:2]) if words[0] == "push" or words[0] == "pop" else words[0]
+                entry = kinds.setdefault(kind, [0, 0])
+                entry[0] += 1
+                entry[1] += self.cost(command, n, skip, routine)
+        return [(kind, count, total / count) for kind, (count, total) in kinds.items()]
+
+    def write(self, output):
+        self.settle()
+        costs = self.functionCosts()
+        size = self.size()
+        output.write("ROM: %d of %d instructions (%.1f%%)\n" % (size, ROM_SIZE, 100.0 * size / ROM_SIZE))
+        output.write("\nFunctions by size\n")
+        output.write("%8s %12s  %s\n" % ("size", "cycles/call", "function"))
+        for name, size, cost in sorted(costs, key=lambda c: (-c[1], c[0])):
+            output.write("%8d %12d  %s\n" % (size, cost, name))
+        output.write("\nFunctions by estimated cost per call (loops weighted x%d)\n" % LOOP_WEIGHT)
+        output.write("%8s %12s  %s\n" % ("size", "cycles/call", "function"))
+        for name, size, cost in sorted(costs, key=lambda c: (-c[2], c[0])):
+            output.write("%8d %12d  %s\n" % (size, cost, name))
+        output.write("\nCommand cost model\n")
+        output.write("%8s %12s  %s\n" % ("count", "cycles", "command"))
+        for kind, count, cycles in sorted(self.commandCosts(), key=lambda c: (-c[1], c[0])):
+            output.write("%8d %12.1f  %s\n" % (count, cycles, kind))
+
+def standaloneCost(command):
+    """
+    Instructions a push, pop, arithmetic or if-goto command takes when it
+    is not tiled with its neighbours
+    """
+    words = command.split(' ')
+    code_writer = VMCodeWriter(None)
+    code_writer.setProgName("Report")
+    if words[0] == "push" or words[0] == "pop":
+        command_type = CommandType.C_PUSH if words[0] == "push" else CommandType.C_POP
+        return instructionCount(code_writer.pushPopCode(command_type, words[1], int(words[2])))
+    elif words[0] == "if-goto":
+        return instructionCount(code_writer.singleCode((CommandType.C_IF, words[1], None)))
+    elif words[0] in STACK_OPS or words[0] in UNARY_OPS:
+        return instructionCount(code_writer.arithmeticCode(words[0]))
+    return 1
+
+def routineCost(routine, command):
+    """
+    Cycles the Runtime routine a call, return or tail call site jumps to
+    takes; the tail call copy loop runs once per argument and frame word.
+    """
+    code_writer = VMCodeWriter(None)
+    if routine == "Runtime$call":
+        return instructionCount(code_writer.callRoutine())
+    elif routine == "Runtime$return":
+        return instructionCount(code_writer.returnCode())
+    setup, copy, finish = code_writer.tailCallRoutine()
+    return instructionCount(setup) + (int(command.split(' ')[2]) + 5) * instructionCount(copy) + instructionCount(finish)
+
+def progName(source):
+    return os.path.basename(source)[0:-3]
+
+def instructionCount(lines):
+    return sum(1 for line in lines if line[0] != '(')
+
+def translate(parser, code_writer, follow_classes=False):
+    """
+    Translates every command of parser. Runs of push, pop, arithmetic and
+    if-goto commands go through the instruction selector together. With
+    follow_classes the program name is taken from the class of each
+    function, which is how statics and labels are namespaced when classes
+    arrive concatenated on stdin.
+    """
+    run = []
     while parser.hasMoreCommands():
         parser.advance()
+        command_type = parser.commandType()
+        if command_type in TILED_COMMANDS:
+            run.append((command_type, parser.arg1(), parser.arg2(), parser.current_command, parser.current_location))
+            continue
+        code_writer.writeCommands(run)
+        run = []
+        if follow_classes and command_type == CommandType.C_FUNCTION:
+            class_name = parser.arg1().split('.')[0]
+            if class_name != code_writer.prog_name:
+                code_writer.setProgName(class_name)
+        if parser.current_location is not None:
+            code_writer.writeLocation(parser.current_location)
         code_writer.write("//" + parser.current_command)
-        if parser.commandType() == CommandType.C_ARITHMETIC:
-            code_writer.writeArithmetic(parser.arg1()) 
-        elif parser.commandType() == CommandType.C_PUSH or parser.commandType() == CommandType.C_POP:
-            code_writer.writePushPop(parser.commandType(), parser.arg1(), parser.arg2())
-        elif parser.commandType() == CommandType.C_LABEL:
+        if command_type == CommandType.C_LABEL:
             code_writer.writeLabel(parser.arg1())
-        elif parser.commandType() == CommandType.C_GOTO:
+        elif command_type == CommandType.C_GOTO:
             code_writer.writeGoto(parser.arg1())
-        elif parser.commandType() == CommandType.C_IF:
-            code_writer.writeIf(parser.arg1())
-        elif parser.commandType() == CommandType.C_FUNCTION:
+        elif command_type == CommandType.C_FUNCTION:
             code_writer.writeFunction(parser.arg1(), parser.arg2())
-        elif parser.commandType() == CommandType.C_RETURN:
+        elif command_type == CommandType.C_RETURN:
             code_writer.writeReturn()
-        elif parser.commandType() == CommandType.C_CALL:
-            code_writer.writeCall(parser.arg1(), parser.arg2())
+        elif command_type == CommandType.C_CALL:
+            if parser.peek() == "return":
+                function_name, num_args = parser.arg1(), parser.arg2()
+                parser.advance()
+                code_writer.write("//" + parser.current_command)
+                code_writer.writeTailCall(function_name, num_args)
+            else:
+                code_writer.writeCall(parser.arg1(), parser.arg2())
+    code_writer.writeCommands(run)
+
+def translateFile(source, report=False, debug=False, shared_calls=False):
+    """
+    Translates a single .vm file into a chunk of Hack assembly, returning
+    the chunk, its CostReport (None unless report is set) and whether it
+    needs the runtime routines. With debug the code of each command is
+    preceded by its location.
+    """
+    output = io.StringIO()
+    code_writer = VMCodeWriter(output, shared_calls=shared_calls)
+    if report:
+        code_writer.report = CostReport()
+    code_writer.setProgName(progName(source))
+    translate(VMParser(source, debug), code_writer)
+    code_writer.flush()
+    return output.getvalue(), code_writer.report, code_writer.uses_runtime
+
+def bootstrapCode(report=None, debug=False, shared_calls=False):
+    """
+    Returns the bootstrap that sets up SP and calls Sys.init
+    """
+    output = io.StringIO()
+    code_writer = VMCodeWriter(output, shared_calls=shared_calls)
+    code_writer.report = report
+    code_writer.setProgName("Bootstrap")
+    if debug:
+        code_writer.writeLocation(["Bootstrap"])
+    code_writer.writeInit()
+    code_writer.flush()
+    return output.getvalue()
+
+def runtimeCode(report=None, debug=False):
+    """
+    Returns the shared call/return routines the chunks jump into
+    """
+    output = io.StringIO()
+    code_writer = VMCodeWriter(output)
+    code_writer.report = report
+    code_writer.setProgName("Runtime")
+    if debug:
+        code_writer.writeLocation(["Runtime"])
+    code_writer.writeRuntime()
+    code_writer.flush()
+    return output.getvalue()
+
+def translateAll(sources, jobs, report=False, debug=False, shared_calls=False):
+    if jobs > 1 and len(sources) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(translateFile, sources, repeat(report), repeat(debug), repeat(shared_calls)))
+    return [translateFile(s, report, debug, shared_calls) for s in sources]
+
+def writeObject(asm, object_file, debug=False):
+    """
+    Assembles a chunk into a relocatable object for linker.py
+    """
+    with open(object_file, "w") as f:
+        assembler.writeObject(assembler.AsmChunk(asm.split('\n'), debug), f, os.path.basename(object_file)[:-4] + ".asm")
+
+def translateObject(source, debug=False, shared_calls=False):
+    """
+    Translates and assembles one .vm file into the .obj next to it
+    """
+    writeObject(translateFile(source, False, debug, shared_calls)[0], source[:-3] + ".obj", debug)
+
+def isStale(target, newest):
+    return not os.path.exists(target) or os.path.getmtime(target) < newest
+
+def translateObjects(sources, directory, jobs, debug=False, shared_calls=False):
+    """
+    Brings the .obj of each source up to date, plus Bootstrap.obj and
+    Runtime.obj in directory. Objects are only rebuilt when older than
+    their source or the tools, so after changing one class linking is
+    all that is left. Shared and inline call sites build the same frame,
+    so objects from either mode link together. Returns the sources that
+    were retranslated.
+    """
+    tools = max(os.path.getmtime(__file__), os.path.getmtime(assembler.__file__))
+    stale = [s for s in sources if isStale(s[:-3] + ".obj", max(tools, os.path.getmtime(s)))]
+    if jobs > 1 and len(stale) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(translateObject, stale, repeat(debug), repeat(shared_calls)))
+    else:
+        for s in stale:
+            translateObject(s, debug, shared_calls)
+    object_file = os.path.join(directory, "Bootstrap.obj")
+    if isStale(object_file, tools):
+        writeObject(bootstrapCode(None, debug, shared_calls), object_file, debug)
+    object_file = os.path.join(directory, "Runtime.obj")
+    if isStale(object_file, tools):
+        writeObject(runtimeCode(None, debug), object_file, debug)
+    return stale
+
+def translateStream(output, report=None, debug=False, shared_calls=False):
+    """
+    Translates VM code read from stdin, e.g. piped from jackcompiler.
+    Classes must arrive contiguously; the bootstrap is written when the
+    stream defines Sys.init.
+    """
+    parser = VMParser("-", debug)
+    code_writer = VMCodeWriter(output, shared_calls=shared_calls)
+    code_writer.report = report
+    if any(c.startswith("function Sys.init ") for c in parser.commands):
+        code_writer.setProgName("Bootstrap")
+        if debug:
+            code_writer.writeLocation(["Bootstrap"])
+        code_writer.writeInit()
+    code_writer.setProgName("Stdin")
+    translate(parser, code_writer, follow_classes=True)
+    if code_writer.uses_runtime:
+        if debug:
+            code_writer.writeLocation(["Runtime"])
+        code_writer.writeRuntime()
+    code_writer.flush()
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("source", help=".vm file, directory, or - for stdin")
+    arg_parser.add_argument("-o", "--output", help="output .asm file, or - for stdout")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    arg_parser.add_argument("-g", "--debug", action="store_true", help="mark the code of each command with its VM and Jack lines, for the assembler's --map")
+    arg_parser.add_argument("-c", "--object", action="store_true", help="write a relocatable .obj per .vm file, plus Bootstrap.obj and Runtime.obj, for linker.py; only stale ones are rebuilt")
+    arg_parser.add_argument("--shared-calls", action="store_true", help="jump to one shared copy of the call and return code instead of inlining it at every site: a few cycles more per call, for programs that would not fit the ROM otherwise")
+    arg_parser.add_argument("--report", action="store_true", help="print instruction counts and estimated cost per function")
+    arg_parser.add_argument("--profile", nargs="?", const="-", metavar="FILE", help="time each phase and count allocations, printing the report or writing it to FILE as JSON; translates in this process")
+    args = arg_parser.parse_args()
+
+    profiler = None
+    if args.profile is not None:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "13"))
+        from instrument import Profiler
+        profiler = Profiler()
+        profiler.wrap(VMParser, "__init__", "parse", "VM commands", lambda result, args: len(args[0].commands))
+        profiler.wrap(sys.modules[__name__], "translate", "translate")
+        profiler.wrap(sys.modules[__name__], "translateFile", "translateFile", "instructions", lambda result, args: instructionCount([l for l in result[0].split('\n') if l and not l.startswith("//")]))
+        profiler.wrap(VMCodeWriter, "writeCommands", "instruction selection")
+        profiler.wrap(VMCodeWriter, "flush", "write")
+        #worker processes would be timed by nobody
+        args.jobs = 1
+
+    output_file = ""
+
+    sources = []
+    if args.source == "-":
+        output_file = "-"
+    elif os.path.isdir(args.source):
+        sources = sorted(os.path.join(args.source, f) for f in os.listdir(args.source) if os.path.isfile(os.path.join(args.source, f)) and f.endswith('.vm'))
+        directory = os.path.normpath(args.source)
+        output_file = os.path.join(directory, os.path.basename(os.path.abspath(directory)) + ".asm")
+    else:
+        if args.source.endswith('.vm'):
+            sources.append(args.source)
+            output_file = args.source[0:-3] + ".asm"
+        else:
+            print("Wrong File Extension")
+            exit()
+    if args.output is not None:
+        output_file = args.output
+
+    report = None
+    if args.object:
+        if args.source == "-":
+            print("-c needs .vm files, not stdin")
+            exit()
+        translateObjects(sources, os.path.dirname(sources[0]) if sources else args.source, args.jobs, args.debug, args.shared_calls)
+    else:
+        report = CostReport() if args.report else None
+        with (nullcontext(sys.stdout) if output_file == "-" else open(output_file, "w")) as f:
+            if args.source == "-":
+                translateStream(f, report, args.debug, args.shared_calls)
+            else:
+                chunks = translateAll(sources, args.jobs, args.report, args.debug, args.shared_calls)
+                if len(sources) > 1:
+                    f.write(bootstrapCode(report, args.debug, args.shared_calls))
+                for chunk, chunk_report, uses_runtime in chunks:
+                    f.write(chunk)
+                    if report is not None:
+                        report.merge(chunk_report)
+                if (len(sources) > 1 and args.shared_calls) or any(uses_runtime for _, _, uses_runtime in chunks):
+                    f.write(runtimeCode(report, args.debug))
+                size = sum(instructionCount([l for l in chunk.split('\n') if l and not l.startswith("//")]) for chunk, _, _ in chunks)
+                if size > ROM_SIZE and not args.shared_calls:
+                    print("Warning: %d instructions do not fit the %d word ROM, try --shared-calls" % (size, ROM_SIZE), file=sys.stderr)
+
+    if report is not None:
+        report.write(sys.stderr if output_file == "-" else sys.stdout)
 
-code_writer.close()
+    if profiler is not None:
+        profiler.write(args.profile)
@@ -0,0 +1,350 @@
+from jacktokenizer import JackTokenizer, KEYWORD, SYMBOL, IDENTIFIER, INT_CONST, STRING_CONST
+
+OPERATORS = frozenset(["+", "-", "*", "/", "&", "|", "<", ">", "="])
+UNARY_OPERATORS = frozenset(["-", "~"])
+TYPE_KEYWORDS = frozenset(["int", "char", "boolean", "void"])
+KEYWORD_CONSTANTS = frozenset(["true", "false", "null", "this"])
+
+class Node:
+    """
+    Base of the tree nodes. Each subclass names its fields in __slots__
+    and takes them positionally in the same order.
+    """
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return self.__class__.__name__ + "(" + ", ".join(repr(getattr(self, name)) for name in self.__slots__) + ")"
+
+class Class(Node):
+    __slots__ = ("name", "class_vars", "subroutines")
+
+class ClassVarDec(Node):
+    __slots__ = ("kind", "type", "names")
+
+class Subroutine(Node):
+    __slots__ = ("kind", "return_type", "name", "parameters", "var_decs", "statements", "line")
+
+class VarDec(Node):
+    __slots__ = ("type", "names")
+
+class Let(Node):
+    __slots__ = ("name", "index", "value", "line")
+
+class If(Node):
+    __slots__ = ("condition", "then_statements", "else_statements", "line")
+
+class While(Node):
+    __slots__ = ("condition", "statements", "line")
+
+class Do(Node):
+    __slots__ = ("call", "line")
+
+class Return(Node):
+    __slots__ = ("value", "line")
+
+class BinaryOp(Node):
+    """
+    Jack has no precedence, so a op b op c is BinaryOp(op, BinaryOp(op, a, b), c)
+    and right is always a term
+    """
+    __slots__ = ("op", "left", "right")
+
+class UnaryOp(Node):
+    __slots__ = ("op", "operand")
+
+class Group(Node):
+    __slots__ = ("expression",)
+
+class IntConstant(Node):
+    __slots__ = ("value",)
+
+class StringConstant(Node):
+    __slots__ = ("value",)
+
+class KeywordConstant(Node):
+    __slots__ = ("value",)
+
+class Variable(Node):
+    __slots__ = ("name", "index")
+
+class Call(Node):
+    __slots__ = ("receiver", "name", "args")
+
+class TreeCompiler:
+    """
+    Base for back ends and passes over the tree, compile(node) dispatches
+    to compile<NodeClass>(node)
+    """
+    def compile(self, node):
+        return getattr(self, "compile" + node.__class__.__name__)(node)
+
+class JackParser:
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        #set once the parser wants a token past the last one
+        self.ended = False
+
+    def next(self):
+        if not self.tokenizer.hasMoreTokens():
+            self.ended = True
+        self.tokenizer.advance()
+
+    def value(self):
+        return self.tokenizer.current_token.value
+
+    def line(self):
+        """
+        Source line of the current token, kept on statements for debug info
+        """
+        return self.tokenizer.current_token.line
+
+    def keyword(self):
+        token = self.tokenizer.current_token
+        if token.type is KEYWORD:
+            return token.value
+
+    def symbol(self):
+        token = self.tokenizer.current_token
+        if token.type is SYMBOL:
+            return token.value
+
+    def fail(self, expected):
+        token = self.tokenizer.current_token
+        got = "the end of the file" if self.ended else repr(token.value)
+        print("Expected " + expected + ", got " + got + " (line " + str(token.line) + ")")
+        exit()
+
+    def expect(self, symbol):
+        if self.symbol() != symbol:
+            self.fail(repr(symbol))
+        self.next()
+
+    def name(self):
+        token = self.tokenizer.current_token
+        if token.type is not IDENTIFIER:
+            self.fail("a name")
+        self.next()
+        return token.value
+
+    def typeName(self):
+        token = self.tokenizer.current_token
+        if token.type is not IDENTIFIER and not (token.type is KEYWORD and token.value in TYPE_KEYWORDS):
+            self.fail("a type")
+        self.next()
+        return token.value
+
+    def parseClass(self):
+        self.next()
+        if self.keyword() != "class":
+            self.fail("'class'")
+        self.next()
+        name = self.name()
+        self.expect("{")
+        class_vars = []
+        while self.keyword() == "field" or self.keyword() == "static":
+            class_vars.append(self.parseClassVarDec())
+        subroutines = []
+        while self.keyword() == "function" or self.keyword() == "method" or self.keyword() == "constructor":
+            subroutines.append(self.parseSubroutine())
+        if self.ended or self.symbol() != "}":
+            self.fail("a subroutine or '}'")
+        return Class(name, class_vars, subroutines)
+
+    def parseNames(self):
+        names = [self.name()]
+        while self.symbol() == ",":
+            self.next()
+            names.append(self.name())
+        self.expect(";")
+        return names
+
+    def parseClassVarDec(self):
+        kind = self.keyword()
+        self.next()
+        t = self.typeName()
+        return ClassVarDec(kind, t, self.parseNames())
+
+    def parseSubroutine(self):
+        line = self.line()
+        kind = self.keyword()
+        self.next()
+        return_type = self.typeName()
+        name = self.name()
+        self.expect("(")
+        parameters = self.parseParameterList()
+        self.expect(")")
+        self.expect("{")
+        var_decs = []
+        while self.keyword() == "var":
+            var_decs.append(self.parseVarDec())
+        statements = self.parseStatements()
+        self.next()
+        return Subroutine(kind, return_type, name, parameters, var_decs, statements, line)
+
+    def parseParameterList(self):
+        """
+        Returns a list of (type, name) pairs
+        """
+        parameters = []
+        if self.symbol() == ")":
+            return parameters
+        t = self.typeName()
+        parameters.append((t, self.name()))
+        while self.symbol() == ",":
+            self.next()
+            t = self.typeName()
+            parameters.append((t, self.name()))
+        return parameters
+
+    def parseVarDec(self):
+        self.next()
+        t = self.typeName()
+        return VarDec(t, self.parseNames())
+
+    def parseStatements(self):
+        statements = []
+        while self.symbol() != "}":
+            keyword = self.keyword()
+            if keyword == "do":
+                statements.append(self.parseDo())
+            elif keyword == "let":
+                statements.append(self.parseLet())
+            elif keyword == "while":
+                statements.append(self.parseWhile())
+            elif keyword == "return":
+                statements.append(self.parseReturn())
+            elif keyword == "if":
+                statements.append(self.parseIf())
+            else:
+                self.fail("a statement")
+        return statements
+
+    def parseDo(self):
+        line = self.line()
+        self.next()
+        call = self.parseCall()
+        self.expect(";")
+        return Do(call, line)
+
+    def parseLet(self):
+        line = self.line()
+        self.next()
+        name = self.name()
+        index = None
+        if self.symbol() == "[":
+            self.next()
+            index = self.parseExpression()
+            self.expect("]")
+        self.expect("=")
+        value = self.parseExpression()
+        self.expect(";")
+        return Let(name, index, value, line)
+
+    def parseWhile(self):
+        line = self.line()
+        self.next()
+        self.expect("(")
+        condition = self.parseExpression()
+        self.expect(")")
+        self.expect("{")
+        statements = self.parseStatements()
+        self.next()
+        return While(condition, statements, line)
+
+    def parseReturn(self):
+        line = self.line()
+        self.next()
+        value = None
+        if self.symbol() != ";":
+            value = self.parseExpression()
+        self.expect(";")
+        return Return(value, line)
+
+    def parseIf(self):
+        line = self.line()
+        self.next()
+        self.expect("(")
+        condition = self.parseExpression()
+        self.expect(")")
+        self.expect("{")
+        then_statements = self.parseStatements()
+        self.next()
+        else_statements = None
+        if self.keyword() == "else":
+            self.next()
+            self.expect("{")
+            else_statements = self.parseStatements()
+            self.next()
+        return If(condition, then_statements, else_statements, line)
+
+    def parseExpressionList(self):
+        expressions = []
+        if self.symbol() != ")":
+            expressions.append(self.parseExpression())
+        while self.symbol() == ",":
+            self.next()
+            expressions.append(self.parseExpression())
+        return expressions
+
+    def parseExpression(self):
+        expression = self.parseTerm()
+        while self.symbol() in OPERATORS:
+            op = self.symbol()
+            self.next()
+            expression = BinaryOp(op, expression, self.parseTerm())
+        return expression
+
+    def parseTerm(self):
+        token = self.tokenizer.current_token
+        token_type = token.type
+        if token_type is SYMBOL and token.value in UNARY_OPERATORS:
+            self.next()
+            return UnaryOp(token.value, self.parseTerm())
+        elif token_type is SYMBOL and token.value == "(":
+            self.next()
+            expression = self.parseExpression()
+            self.expect(")")
+            return Group(expression)
+        elif token_type is INT_CONST:
+            self.next()
+            return IntConstant(token.value)
+        elif token_type is STRING_CONST:
+            self.next()
+            return StringConstant(token.value)
+        elif token_type is KEYWORD and token.value in KEYWORD_CONSTANTS:
+            self.next()
+            return KeywordConstant(token.value)
+        elif token_type is not IDENTIFIER:
+            self.fail("a term")
+        following = self.tokenizer.peek()
+        if following is not None and following.value in ("(", "."):
+            return self.parseCall()
+        self.next()
+        index = None
+        if self.symbol() == "[":
+            self.next()
+            index = self.parseExpression()
+            self.expect("]")
+        return Variable(token.value, index)
+
+    def parseCall(self):
+        name = self.name()
+        receiver = None
+        if self.symbol() == ".":
+            receiver = name
+            self.next()
+            name = self.name()
+        self.expect("(")
+        args = self.parseExpressionList()
+        self.expect(")")
+        return Call(receiver, name, args)
+
+def parseFile(source_file):
+    """
+    Tokenizes and parses one .jack file into a Class tree
+    """
+    return JackParser(JackTokenizer(source_file)).parseClass()
@@ -1,217 +1,33 @@
 import argparse
 import tempfile
 import os
-from enum import Enum
-
-def isInt(s):
-    try:
-        int(s)
-        return True
-    except ValueError:
-        return False
-
-class TokenType(Enum):
-    KEYWORD = 0
-    SYMBOL = 1
-    IDENTIFIER = 2
-    INT_CONST = 3
-    STRING_CONST = 4
-
-class JackTokenizer:
-    SYMBOLS = ['{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', '<', '>', '=', '~']
-    KEYWORDS = ['class',
-            'constructor',
-            'function',
-            'method',
-            'field',
-            'static',
-            'var',
-            'int',
-            'char',
-            'boolean',
-            'void',
-            'true',
-            'false',
-            'null',
-            'this',
-            'let',
-            'do',
-            'if',
-            'else',
-            'while',
-            'return']
-
-    def __init__(self, source_file):
-        self.tokens = []
-        lines = []
-        with open(source_file) as f:
-            in_comment = False
-            for line in f:
-                l = ' '.join(line.split())
-                comment_position = l.find("//")
-                if comment_position != -1:
-                    l = l[0:comment_position]
-                if in_comment == False:
-                    start_comment_position = l.find("/*")
-                    if start_comment_position != -1:
-                        in_comment = True
-                if in_comment:
-                    end_comment_position = l.find("*/")
-                    if end_comment_position != -1:
-                        l = l[end_comment_position+2:]
-                        in_comment = False
-                    else:
-                        start_comment_position = l.find("/*")
-                        if start_comment_position != -1:
-                            l = l[0:start_comment_position]
-                        else:
-                            l = ""
-                lines.append(l)
-        lines = filter(None, lines)
-        self.tokenizeLines('\n'.join(lines))
-
-    def addToken(self, token):
-        if token.strip() != "":
-            self.tokens.append(token)
-
-    def tokenizeLines(self, lines):
-        """
-        0 = searching
-        1 = in string
-        2 = in int
-        3 = identifier/keyword
-        """
-        state = 0
-        current_token = ""
-        for c in lines:
-            if state == 1:
-                if c == '"':
-                    state = 0
-                    self.addToken(current_token + c)
-                    current_token = ""
-                elif c == '\n':
-                    print("Your string has a newline in it")
-                    exit()
-                else:
-                    current_token += c
-                continue;
-            if c == ' ' or c == '\n':
-                state = 0
-                self.addToken(current_token)
-                current_token = ""
-                continue;
-            if c in self.SYMBOLS:
-                state = 0
-                self.addToken(current_token)
-                self.addToken(c)
-                current_token = ""
-                continue;
-            if state == 3:
-                current_token += c
-                continue;
-            if c == "\"":
-                if state != 0:
-                    print("Your int is touching the string")
-                    exit()
-                state = 1
-                self.addToken(current_token)
-                current_token = c
-                continue;
-            if state == 2:
-                if not c.isdigit():
-                    print("Your int isn't an int")
-                    exit()
-                current_token += c
-                continue;
-            if c.isdigit():
-                state = 2
-                self.addToken(current_token)
-                current_token = ""
-            state = 3
-            current_token += c
-
-    def hasMoreTokens(self):
-        return len(self.tokens) > 0
-
-    def advance(self):
-        if self.hasMoreTokens():
-            self.current_token = self.tokens.pop(0)
-
-    def tokenType(self):
-        if self.current_token[0] == '"' and self.current_token[-1] == '"':
-            return TokenType.STRING_CONST
-        if self.current_token in self.SYMBOLS:
-            return TokenType.SYMBOL
-        if isInt(self.current_token):
-            return TokenType.INT_CONST
-        if self.current_token in self.KEYWORDS:
-            return TokenType.KEYWORD
-        return TokenType.IDENTIFIER
-
-    def keyword(self):
-        if self.tokenType() != TokenType.KEYWORD:
-            return
-        return self.current_token
-
-    def symbol(self):
-        if self.tokenType() != TokenType.SYMBOL:
-            return
-        if self.current_token  == ">":
-            return "&gt;"
-        elif self.current_token == "<":
-            return "&lt;"
-        elif self.current_token == "&":
-            return "&amp;"
-
-        return self.current_token
-
-    def identifier(self):
-        if self.tokenType() != TokenType.IDENTIFIER:
-            return
-        return self.current_token
-
-    def intVal(self):
-        if self.tokenType() != TokenType.INT_CONST:
-            return
-        return int(self.current_token)
-
-    def stringVal(self):
-        if self.tokenType() != TokenType.STRING_CONST:
-            return
-        t = self.current_token[self.current_token.find('"')+1:]
-        return t[:-1]
-
-    def writeTokens(self, output_file):
-        with open(output_file, "w") as f:
-            f.write("<tokens>\n")
-            while self.hasMoreTokens():
-                self.advance()
-                token_type = self.tokenType()
-                if token_type == TokenType.KEYWORD:
-                    f.write("<keyword> " + self.keyword() + " </keyword>\n")
-                elif token_type == TokenType.SYMBOL:
-                    f.write("<symbol> " + self.symbol() + " </symbol>\n")
-                elif token_type == TokenType.IDENTIFIER:
-                    f.write("<identifier> " + self.identifier() + " </identifier>\n")
-                elif token_type == TokenType.INT_CONST:
-                    f.write("<integerConstant> " + str(self.intVal()) + " </integerConstant>\n")
-                elif token_type == TokenType.STRING_CONST:
-                    f.write("<stringConstant> " + self.stringVal() + " </stringConstant>\n")
-            f.write("</tokens>")
-        return f
-
-class CompilationEngine:
-    OPERATORS = ["+", "-", "*", "/", "&amp;", "|", "&lt;", "&gt;", "=",]
-
-    def __init__(self, tokenizer, output_file_name):
+import sys
+from jacktokenizer import KEYWORDS, XML_ESCAPES
+from jackparser import TreeCompiler, BinaryOp, parseFile
+
+class CompilationEngine(TreeCompiler):
+    """
+    XML back end, writes the parse tree of a class in the course's format
+    """
+    def __init__(self, class_node, output_file_name, flush_threshold=4096):
         self.output_file = open(output_file_name, "w")
-        self.tokenizer = tokenizer
+        self.flush_threshold = flush_threshold
+        self.buffer = []
         self.indentation = 0
-        self.compileClass()
+        self.compileClass(class_node)
+        self.flush()
         self.output_file.close()
 
     def write(self, line):
-        self.output_file.write("  "*self.indentation + line + '\n')
+        self.buffer.append("  "*self.indentation + line)
+        if len(self.buffer) >= self.flush_threshold:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append("")
+            self.output_file.write('\n'.join(self.buffer))
+            self.buffer = []
 
     def indent(self):
         self.indentation += 1
@@ -220,327 +36,244 @@ class CompilationEngine:
         if self.indentation != 0:
             self.indentation -= 1
 
-    def write_token(self):
-        token_type = self.tokenizer.tokenType()
-        if token_type == TokenType.KEYWORD:
-            self.write("<keyword> " + self.tokenizer.keyword() + " </keyword>")
-        elif token_type == TokenType.IDENTIFIER:
-            self.write("<identifier> " + self.tokenizer.identifier() + " </identifier>")
-        elif token_type == TokenType.SYMBOL:
-            self.write("<symbol> " + self.tokenizer.symbol() + " </symbol>")
-        elif token_type == TokenType.INT_CONST:
-            self.write("<integerConstant> " + str(self.tokenizer.intVal()) + " </integerConstant>")
-        elif token_type == TokenType.STRING_CONST:
-            self.write("<stringConstant> " + self.tokenizer.stringVal() + " </stringConstant>")
-
-    def next(self):
-        self.tokenizer.advance()
-
-    def compileClass(self):
-        self.write("<class>")
-        self.indent()
-        self.next()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        
-        while self.tokenizer.keyword() == "field" or self.tokenizer.keyword() == "static":
-            self.compileClassVarDec()
-
-        while self.tokenizer.keyword() == "function" or self.tokenizer.keyword() == "method" or self.tokenizer.keyword() == "constructor":
-            self.compileSubroutine()
-
-        self.write_token()
-        self.unindent()
-        self.write("</class>")
-
-    def compileClassVarDec(self):
-        self.write("<classVarDec>")
-        self.indent()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        while self.tokenizer.symbol() != ";":
-            self.write_token()
-            self.next()
-        self.write_token()
-        self.next()
-        self.unindent()
-        self.write("</classVarDec>")
-
-    def compileSubroutine(self):
-        self.write("<subroutineDec>")
-        self.indent()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        self.compileParameterList()
-        self.write_token()
-        self.next()
-        self.write("<subroutineBody>")
-        self.indent()
-        self.write_token()
-        self.next()
-        while self.tokenizer.keyword() == "var":
-            self.compileVarDec()
-        self.compileStatements()  
-        self.write_token()
-        self.next()
-        self.unindent()
-        self.write("</subroutineBody>")
-        self.unindent()
-        self.write("</subroutineDec>")
-
-    def compileParameterList(self):
-        self.write("<parameterList>")
-        self.indent()
-        if self.tokenizer.symbol() == ")":
-            self.unindent()
-            self.write("</parameterList>")
-            return;
-        else:
-            self.write_token()
-            self.next()
-            self.write_token()
-            self.next()
-
-        while self.tokenizer.symbol() != ")":
-            self.write_token()
-            self.next()
-            self.write_token()
-            self.next()
-            self.write_token()
-            self.next()
-
-        self.unindent()
-        self.write("</parameterList>")
-
-    def compileVarDec(self):
-        self.write("<varDec>")
-        self.indent()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        while self.tokenizer.symbol() != ";":
-            self.write_token()
-            self.next()
-        self.write_token()
-        self.next()
-        self.unindent()
-        self.write("</varDec>")
-
-    def compileStatements(self):
-        self.write("<statements>")
-        self.indent()
-        while self.tokenizer.symbol() != "}":
-            if self.tokenizer.keyword() == "do":
-                self.compileDo()
-            elif self.tokenizer.keyword() == "let":
-                self.compileLet()
-            elif self.tokenizer.keyword() == "while":
-                self.compileWhile()
-            elif self.tokenizer.keyword() == "return":
-                self.compileReturn()
-            elif self.tokenizer.keyword() == "if":
-                self.compileIf()
-        self.unindent()
-        self.write("</statements>")
-
-    def compileDo(self):
-        self.write("<doStatement>")
-        self.indent()
-        self.write_token()
-        self.next()
-
-        while self.tokenizer.symbol() != "(":
-            self.write_token()
-            self.next()
-
-        self.write_token()
-        self.next()
-        self.compileExpressionList()
-        self.write_token()
-        self.next()
-
-        self.write_token()
-        self.next()
-        self.unindent()
-        self.write("</doStatement>")
-
-    def compileLet(self):
-        self.write("<letStatement>")
+    def openTag(self, tag):
+        self.write("<" + tag + ">")
         self.indent()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        if self.tokenizer.symbol() == "[":
-            self.write_token()
-            self.next()
-            self.compileExpression()
-            self.write_token()
-            self.next()
-        self.write_token()
-        self.next()
-        self.compileExpression()
-        self.write_token()
-        self.next()
-        self.unindent()
-        self.write("</letStatement>")
 
-    def compileWhile(self):
-        self.write("<whileStatement>")
-        self.indent()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        self.compileExpression()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        self.compileStatements()
-        self.write_token()
-        self.next()
+    def closeTag(self, tag):
         self.unindent()
-        self.write("</whileStatement>")
+        self.write("</" + tag + ">")
 
-    def compileReturn(self):
-        self.write("<returnStatement>")
-        self.indent()
-        self.write_token()
-        self.next()
-        if self.tokenizer.symbol() != ";":
-            self.compileExpression()
-        self.write_token()
-        self.next()
-        self.unindent()
-        self.write("</returnStatement>")
-    
-    def compileIf(self):
-        self.write("<ifStatement>")
-        self.indent()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        self.compileExpression()
-        self.write_token()
-        self.next()
-        self.write_token()
-        self.next()
-        self.compileStatements()
-        self.write_token()
-        self.next()
-        if self.tokenizer.keyword() == "else":
-            self.write_token()
-            self.next()
-            self.write_token()
-            self.next()
-            self.compileStatements()
-            self.write_token()
-            self.next()
-        self.unindent()
-        self.write("</ifStatement>")
-
-    def compileExpressionList(self):
-        self.write("<expressionList>")
-        self.indent()
+    def writeKeyword(self, keyword):
+        self.write("<keyword> " + keyword + " </keyword>")
 
-        if self.tokenizer.symbol() != ")":
-            self.compileExpression()
-        
-        while self.tokenizer.symbol() == ",":
-            self.write_token()
-            self.next()
-            self.compileExpression()
-        self.unindent()
-        self.write("</expressionList>")
-        
-    def compileExpression(self):
-        self.write("<expression>")
-        self.indent()
-        self.compileTerm()
-        while self.tokenizer.symbol() in self.OPERATORS:
-            self.write_token()
-            self.next()
-            self.compileTerm()
-        self.unindent()
-        self.write("</expression>")
+    def writeSymbol(self, symbol):
+        self.write("<symbol> " + XML_ESCAPES.get(symbol, symbol) + " </symbol>")
 
-    def compileTerm(self):
-        self.write("<term>")
-        self.indent()
+    def writeIdentifier(self, identifier):
+        self.write("<identifier> " + identifier + " </identifier>")
 
-        if self.tokenizer.symbol() == "-" or self.tokenizer.symbol() == "~":
-            self.write_token()
-            self.next()
-            self.compileTerm()
-        elif self.tokenizer.symbol() == "(":
-            self.write_token()
-            self.next()
-            self.compileExpression()
-            self.write_token()
-            self.next()
+    def writeType(self, t):
+        if t in KEYWORDS:
+            self.writeKeyword(t)
         else:
-            self.write_token()
-            self.next()
-            if self.tokenizer.symbol() == "(":
-                self.write_token()
-                self.next()
-                self.compileExpressionList()
-                self.write_token()
-                self.next()
-            elif self.tokenizer.symbol() == ".":
-                self.write_token()
-                self.next()
-                self.write_token()
-                self.next()
-                self.write_token()
-                self.next()
-                self.compileExpressionList()
-                self.write_token()
-                self.next()
-            elif self.tokenizer.symbol() == "[":
-                self.write_token()
-                self.next()
-                self.compileExpression()
-                self.write_token()
-                self.next()
-        self.unindent()
-        self.write("</term>")
-
-arg_parser = argparse.ArgumentParser()
-arg_parser.add_argument("source")
-args = arg_parser.parse_args()
-
-output_file = ""
-
-sources = []
-if os.path.isdir(args.source):
-    sources = [os.path.join(args.source, f) for f in os.listdir(args.source) if os.path.isfile(os.path.join(args.source, f)) and f.endswith('.jack')]
-else:
-    if args.source.endswith('.jack'):
-        sources.append(args.source)
+            self.writeIdentifier(t)
+
+    def writeNames(self, names):
+        self.writeIdentifier(names[0])
+        for name in names[1:]:
+            self.writeSymbol(",")
+            self.writeIdentifier(name)
+        self.writeSymbol(";")
+
+    def compileClass(self, node):
+        self.openTag("class")
+        self.writeKeyword("class")
+        self.writeIdentifier(node.name)
+        self.writeSymbol("{")
+        for class_var in node.class_vars:
+            self.compileClassVarDec(class_var)
+        for subroutine in node.subroutines:
+            self.compileSubroutine(subroutine)
+        self.writeSymbol("}")
+        self.closeTag("class")
+
+    def compileClassVarDec(self, node):
+        self.openTag("classVarDec")
+        self.writeKeyword(node.kind)
+        self.writeType(node.type)
+        self.writeNames(node.names)
+        self.closeTag("classVarDec")
+
+    def compileSubroutine(self, node):
+        self.openTag("subroutineDec")
+        self.writeKeyword(node.kind)
+        self.writeType(node.return_type)
+        self.writeIdentifier(node.name)
+        self.writeSymbol("(")
+        self.compileParameterList(node.parameters)
+        self.writeSymbol(")")
+        self.openTag("subroutineBody")
+        self.writeSymbol("{")
+        for var_dec in node.var_decs:
+            self.compileVarDec(var_dec)
+        self.compileStatements(node.statements)
+        self.writeSymbol("}")
+        self.closeTag("subroutineBody")
+        self.closeTag("subroutineDec")
+
+    def compileParameterList(self, parameters):
+        self.openTag("parameterList")
+        for i, (t, name) in enumerate(parameters):
+            if i > 0:
+                self.writeSymbol(",")
+            self.writeType(t)
+            self.writeIdentifier(name)
+        self.closeTag("parameterList")
+
+    def compileVarDec(self, node):
+        self.openTag("varDec")
+        self.writeKeyword("var")
+        self.writeType(node.type)
+        self.writeNames(node.names)
+        self.closeTag("varDec")
+
+    def compileStatements(self, statements):
+        self.openTag("statements")
+        for statement in statements:
+            self.compile(statement)
+        self.closeTag("statements")
+
+    def compileDo(self, node):
+        self.openTag("doStatement")
+        self.writeKeyword("do")
+        self.compileCall(node.call)
+        self.writeSymbol(";")
+        self.closeTag("doStatement")
+
+    def compileLet(self, node):
+        self.openTag("letStatement")
+        self.writeKeyword("let")
+        self.writeIdentifier(node.name)
+        if node.index is not None:
+            self.writeSymbol("[")
+            self.compileExpression(node.index)
+            self.writeSymbol("]")
+        self.writeSymbol("=")
+        self.compileExpression(node.value)
+        self.writeSymbol(";")
+        self.closeTag("letStatement")
+
+    def compileWhile(self, node):
+        self.openTag("whileStatement")
+        self.writeKeyword("while")
+        self.writeSymbol("(")
+        self.compileExpression(node.condition)
+        self.writeSymbol(")")
+        self.writeSymbol("{")
+        self.compileStatements(node.statements)
+        self.writeSymbol("}")
+        self.closeTag("whileStatement")
+
+    def compileReturn(self, node):
+        self.openTag("returnStatement")
+        self.writeKeyword("return")
+        if node.value is not None:
+            self.compileExpression(node.value)
+        self.writeSymbol(";")
+        self.closeTag("returnStatement")
+
+    def compileIf(self, node):
+        self.openTag("ifStatement")
+        self.writeKeyword("if")
+        self.writeSymbol("(")
+        self.compileExpression(node.condition)
+        self.writeSymbol(")")
+        self.writeSymbol("{")
+        self.compileStatements(node.then_statements)
+        self.writeSymbol("}")
+        if node.else_statements is not None:
+            self.writeKeyword("else")
+            self.writeSymbol("{")
+            self.compileStatements(node.else_statements)
+            self.writeSymbol("}")
+        self.closeTag("ifStatement")
+
+    def compileExpressionList(self, expressions):
+        self.openTag("expressionList")
+        for i, expression in enumerate(expressions):
+            if i > 0:
+                self.writeSymbol(",")
+            self.compileExpression(expression)
+        self.closeTag("expressionList")
+
+    def compileExpression(self, node):
+        self.openTag("expression")
+        self.compileOperands(node)
+        self.closeTag("expression")
+
+    def compileOperands(self, node):
+        """
+        Writes the flat term (op term)* sequence of a left-leaning BinaryOp chain
+        """
+        if node.__class__ is BinaryOp:
+            self.compileOperands(node.left)
+            self.writeSymbol(node.op)
+            self.compileTerm(node.right)
+        else:
+            self.compileTerm(node)
+
+    def compileTerm(self, node):
+        self.openTag("term")
+        self.compile(node)
+        self.closeTag("term")
+
+    def compileUnaryOp(self, node):
+        self.writeSymbol(node.op)
+        self.compileTerm(node.operand)
+
+    def compileGroup(self, node):
+        self.writeSymbol("(")
+        self.compileExpression(node.expression)
+        self.writeSymbol(")")
+
+    def compileIntConstant(self, node):
+        self.write("<integerConstant> " + str(node.value) + " </integerConstant>")
+
+    def compileStringConstant(self, node):
+        self.write("<stringConstant> " + node.value + " </stringConstant>")
+
+    def compileKeywordConstant(self, node):
+        self.writeKeyword(node.value)
+
+    def compileVariable(self, node):
+        self.writeIdentifier(node.name)
+        if node.index is not None:
+            self.writeSymbol("[")
+            self.compileExpression(node.index)
+            self.writeSymbol("]")
+
+    def compileCall(self, node):
+        if node.receiver is not None:
+            self.writeIdentifier(node.receiver)
+            self.writeSymbol(".")
+        self.writeIdentifier(node.name)
+        self.writeSymbol("(")
+        self.compileExpressionList(node.args)
+        self.writeSymbol(")")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("source")
+    arg_parser.add_argument("--profile", nargs="?", const="-", metavar="FILE", help="time each phase and count allocations, printing the report or writing it to FILE as JSON")
+    args = arg_parser.parse_args()
+
+    profiler = None
+    if args.profile is not None:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "13"))
+        from instrument import Profiler
+        import jacktokenizer
+        import jackparser
+        profiler = Profiler()
+        profiler.wrap(jacktokenizer, "tokenize", "tokenize", "tokens", lambda result, args: len(result))
+        profiler.wrap(jackparser.JackParser, "parseClass", "parse")
+        profiler.wrap(CompilationEngine, "compileClass", "XML generation")
+        profiler.wrap(CompilationEngine, "flush", "write")
+
+    output_file = ""
+
+    sources = []
+    if os.path.isdir(args.source):
+        sources = [os.path.join(args.source, f) for f in os.listdir(args.source) if os.path.isfile(os.path.join(args.source, f)) and f.endswith('.jack')]
     else:
-        print("Wrong File Extension")
-        exit()
+        if args.source.endswith('.jack'):
+            sources.append(args.source)
+        else:
+            print("Wrong File Extension")
+            exit()
+
+    for s in sources:
+        compilation_engine = CompilationEngine(parseFile(s), s[:-5] + "C.xml")
 
-for s in sources:
-    tokenizer = JackTokenizer(s)
-    compilation_engine = CompilationEngine(tokenizer, s[:-5] + "C.xml")
+    if profiler is not None:
+        profiler.write(args.profile)
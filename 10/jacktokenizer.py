@@ -0,0 +1,188 @@
+import re
+from bisect import bisect_right
+from enum import Enum
+
+class TokenType(Enum):
+    KEYWORD = 0
+    SYMBOL = 1
+    IDENTIFIER = 2
+    INT_CONST = 3
+    STRING_CONST = 4
+
+#plain names for the members, looking them up through the enum class is slow in the accessors
+KEYWORD, SYMBOL, IDENTIFIER, INT_CONST, STRING_CONST = TokenType
+
+SYMBOLS = frozenset(['{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', '<', '>', '=', '~'])
+KEYWORDS = frozenset(['class',
+        'constructor',
+        'function',
+        'method',
+        'field',
+        'static',
+        'var',
+        'int',
+        'char',
+        'boolean',
+        'void',
+        'true',
+        'false',
+        'null',
+        'this',
+        'let',
+        'do',
+        'if',
+        'else',
+        'while',
+        'return'])
+XML_ESCAPES = {'<': "&lt;", '>': "&gt;", '&': "&amp;"}
+
+#one finditer pass over the whole text: whitespace and comments match without
+#a group, a token in one of the groups, anything else in the last group
+TOKEN_PATTERN = re.compile(r"""\s+|//[^\n]*|/\*.*?\*/
+  | (\d+)(?!\w)
+  | "([^"\n]*)"
+  | ([A-Za-z_]\w*)
+  | ([{}()\[\].,;+\-*&|<>=~]|/(?!\*))
+  | (.)
+""", re.VERBOSE | re.DOTALL)
+INT_GROUP = 1
+WORD_GROUP = 3
+ERROR_GROUP = 5
+GROUP_TYPES = (None, INT_CONST, STRING_CONST, IDENTIFIER, SYMBOL)
+NEWLINE = re.compile("\n")
+
+class Token:
+    """
+    A token and where it starts in the text. Line and column are worked
+    out from the offsets of the newlines only when asked for, which the
+    parser does once per statement rather than once per token.
+    """
+    __slots__ = ("type", "value", "position", "newlines")
+
+    def __init__(self, token_type, value, position, newlines):
+        self.type = token_type
+        self.value = value
+        self.position = position
+        self.newlines = newlines
+
+    @property
+    def line(self):
+        return bisect_right(self.newlines, self.position) + 1
+
+    @property
+    def column(self):
+        i = bisect_right(self.newlines, self.position)
+        return self.position - (self.newlines[i - 1] + 1 if i else 0) + 1
+
+    def __repr__(self):
+        return "Token(%s, %r, %d:%d)" % (self.type.name, self.value, self.line, self.column)
+
+def tokenize(text):
+    """
+    Returns the Tokens in text from a single finditer over TOKEN_PATTERN.
+    Lines and columns start at 1.
+    """
+    newlines = [m.start() for m in NEWLINE.finditer(text)]
+    tokens = []
+    append = tokens.append
+    for m in TOKEN_PATTERN.finditer(text):
+        group = m.lastindex
+        if group is None:
+            continue
+        value = m.group(group)
+        if group == WORD_GROUP:
+            append(Token(KEYWORD if value in KEYWORDS else IDENTIFIER, value, m.start(group), newlines))
+        elif group == INT_GROUP:
+            append(Token(INT_CONST, int(value), m.start(group), newlines))
+        elif group == ERROR_GROUP:
+            tokenError(text, m.start())
+        else:
+            append(Token(GROUP_TYPES[group], value, m.start(group), newlines))
+    return tokens
+
+def tokenError(text, pos):
+    line = str(text.count('\n', 0, pos) + 1)
+    if text[pos] == '"':
+        print("Your string has a newline in it (line " + line + ")")
+    elif text.startswith("/*", pos):
+        print("Your comment never ends (line " + line + ")")
+    elif text[pos].isdigit():
+        print("Your int isn't an int (line " + line + ")")
+    else:
+        print("Unexpected character " + repr(text[pos]) + " (line " + line + ")")
+    exit()
+
+class JackTokenizer:
+    def __init__(self, source_file):
+        with open(source_file) as f:
+            self.tokens = tokenize(f.read())
+        self.position = -1
+        self.current_token = None
+
+    def hasMoreTokens(self):
+        return self.position + 1 < len(self.tokens)
+
+    def advance(self):
+        if self.hasMoreTokens():
+            self.position += 1
+            self.current_token = self.tokens[self.position]
+
+    def peek(self, k=1):
+        """
+        Returns the token k places after the current one without consuming
+        anything, or None past the end of the file
+        """
+        position = self.position + k
+        if position < len(self.tokens):
+            return self.tokens[position]
+
+    def tokenType(self):
+        return self.current_token.type
+
+    def keyword(self):
+        if self.current_token.type is not KEYWORD:
+            return
+        return self.current_token.value
+
+    def symbol(self):
+        if self.current_token.type is not SYMBOL:
+            return
+        return XML_ESCAPES.get(self.current_token.value, self.current_token.value)
+
+    def identifier(self):
+        if self.current_token.type is not IDENTIFIER:
+            return
+        return self.current_token.value
+
+    def intVal(self):
+        if self.current_token.type is not INT_CONST:
+            return
+        return self.current_token.value
+
+    def stringVal(self):
+        if self.current_token.type is not STRING_CONST:
+            return
+        return self.current_token.value
+
+    def token(self):
+        if self.current_token.type is SYMBOL:
+            return self.symbol()
+        return self.current_token.value
+
+    def writeTokens(self, output_file):
+        with open(output_file, "w") as f:
+            f.write("<tokens>\n")
+            while self.hasMoreTokens():
+                self.advance()
+                token_type = self.tokenType()
+                if token_type == TokenType.KEYWORD:
+                    f.write("<keyword> " + self.keyword() + " </keyword>\n")
+                elif token_type == TokenType.SYMBOL:
+                    f.write("<symbol> " + self.symbol() + " </symbol>\n")
+                elif token_type == TokenType.IDENTIFIER:
+                    f.write("<identifier> " + self.identifier() + " </identifier>\n")
+                elif token_type == TokenType.INT_CONST:
+                    f.write("<integerConstant> " + str(self.intVal()) + " </integerConstant>\n")
+                elif token_type == TokenType.STRING_CONST:
+                    f.write("<stringConstant> " + self.stringVal() + " </stringConstant>\n")
+            f.write("</tokens>")
@@ -0,0 +1,512 @@
+import argparse
+import io
+import os
+import sys
+from contextlib import nullcontext
+
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for tool in ("08", "10"):
+    sys.path.insert(0, os.path.join(TOOLS, tool))
+from jackparser import TreeCompiler, BinaryOp, UnaryOp, Group, IntConstant, StringConstant, Variable, Call, parseFile
+from jackcompiler import Kind, SymbolTable, ConstantFolder, STRING_SLOTS, constantValue, isBoolean
+from vmtranslator2 import VMCodeWriter, INDEX_CHAIN, translateFile, bootstrapCode, runtimeCode
+
+#the temp segment, free between calls
+REGISTERS = ["R" + str(i) for i in range(5, 13)]
+
+#D = D op operand, and D = operand op D with the operand in M or A
+OPERAND_OPS = {"+": "D+{0}", "-": "D-{0}", "&": "D&{0}", "|": "D|{0}", "<": "D-{0}", ">": "D-{0}", "=": "D-{0}"}
+SAVED_OPS = {"+": "D+{0}", "-": "{0}-D", "&": "D&{0}", "|": "D|{0}", "<": "{0}-D", ">": "{0}-D", "=": "{0}-D"}
+
+#jumps taken when a comparison of the difference left - right is true
+COMPARISONS = {"<": "JLT", ">": "JGT", "=": "JEQ"}
+INVERTED_JUMPS = {"JLT": "JGE", "JGT": "JLE", "JEQ": "JNE", "JNE": "JEQ"}
+
+def makesCalls(node):
+    """
+    True if evaluating node may call a function, which clobbers the
+    temp registers. Multiplies by a constant are done inline.
+    """
+    if node.__class__ is Call or node.__class__ is StringConstant:
+        return True
+    elif node.__class__ is BinaryOp:
+        if node.op == "/" or (node.op == "*" and constantValue(node.left) is None and constantValue(node.right) is None):
+            return True
+        return makesCalls(node.left) or makesCalls(node.right)
+    elif node.__class__ is UnaryOp:
+        return makesCalls(node.operand)
+    elif node.__class__ is Group:
+        return makesCalls(node.expression)
+    elif node.__class__ is Variable and node.index is not None:
+        return makesCalls(node.index)
+    return False
+
+class AsmCompilationEngine(TreeCompiler):
+    """
+    Hack assembly back end. Expressions are evaluated in D with the temp
+    registers holding intermediate values, so the stack is only used to
+    pass arguments. Frames, calls and returns go through the same
+    VMCodeWriter code as translated VM files, so the two link together.
+    """
+    SEGMENTS = ["static", "this", "argument", "local"]
+
+    def __init__(self, class_node, code_writer, symbol_table, debug=False, pool_strings=False):
+        self.code_writer = code_writer
+        self.symbol_table = symbol_table
+        self.debug = debug
+        self.pool_strings = pool_strings
+        self.name = ""
+        self.loops = 0
+        self.ifs = 0
+        self.compares = 0
+        #string literal -> static slot holding it once built
+        self.strings = {}
+        self.string_uses = 0
+        #number of REGISTERS in use
+        self.registers = 0
+        self.compileClass(class_node)
+
+    def write(self, lines):
+        self.code_writer.writeCode(lines)
+
+    def label(self, label):
+        return "@" + self.code_writer.function_name + "$" + label
+
+    def compileClass(self, node):
+        self.name = node.name
+        for class_var in node.class_vars:
+            self.compileClassVarDec(class_var)
+        for subroutine in node.subroutines:
+            self.compileSubroutine(subroutine)
+        self.code_writer.flush()
+
+    def compileClassVarDec(self, node):
+        kind = Kind.STATIC if node.kind == "static" else Kind.FIELD
+        for name in node.names:
+            self.symbol_table.define(name, node.type, kind)
+
+    def compileSubroutine(self, node):
+        self.symbol_table.startSubroutine()
+        if node.kind == "method":
+            self.symbol_table.define("instance", self.name, Kind.ARG)
+        for t, name in node.parameters:
+            self.symbol_table.define(name, t, Kind.ARG)
+        for var_dec in node.var_decs:
+            for name in var_dec.names:
+                self.symbol_table.define(name, var_dec.type, Kind.VAR)
+
+        if self.debug:
+            self.code_writer.writeLocation([self.name + ".jack:" + str(node.line), self.name + "." + node.name])
+        self.code_writer.writeFunction(self.name + "." + node.name, self.symbol_table.varCount(Kind.VAR))
+        if node.kind == "constructor":
+            self.write(["@" + str(self.symbol_table.varCount(Kind.FIELD)), "D=A"] + self.code_writer.pushD())
+            self.code_writer.writeCall("Memory.alloc", 1)
+            self.write(self.code_writer.popD() + ["@THIS", "M=D"])
+        elif node.kind == "method":
+            self.write(["@ARG", "A=M", "D=M", "@THIS", "M=D"])
+        self.compileStatements(node.statements)
+
+    def variable(self, name):
+        """
+        Returns the segment and index of a declared variable
+        """
+        kind = self.symbol_table.kindOf(name)
+        if kind is None:
+            print("Undefined variable " + name + " in " + self.name)
+            exit()
+        return self.SEGMENTS[kind], self.symbol_table.indexOf(name)
+
+    def save(self, keep_registers):
+        """
+        Puts D aside while the next expression is evaluated, in a register
+        if keep_registers is set and one is free, otherwise on the stack.
+        Returns the register, or None for the stack.
+        """
+        if keep_registers and self.registers < len(REGISTERS):
+            register = REGISTERS[self.registers]
+            self.registers += 1
+            self.write(["@" + register, "M=D"])
+            return register
+        self.write(self.code_writer.pushD())
+        return None
+
+    def restore(self, register):
+        """
+        Points A at a value put aside by save, for use as M
+        """
+        if register is None:
+            self.write(["@SP", "AM=M-1"])
+        else:
+            self.registers -= 1
+            self.write(["@" + register])
+
+    def release(self, register):
+        """
+        Drops a value put aside by save without reading it
+        """
+        if register is None:
+            self.write(["@SP", "M=M-1"])
+        else:
+            self.registers -= 1
+
+    def operand(self, node):
+        """
+        Code making a term available as A or M without touching D, as
+        (code, register), or None
+        """
+        v = constantValue(node)
+        if v is not None:
+            if v == 0 or v == 1 or v == -1:
+                return ["A=" + str(v)], "A"
+            elif v > 0:
+                return ["@" + str(v)], "A"
+            return None
+        elif node.__class__ is Variable and node.index is None:
+            return self.code_writer.operand(*self.variable(node.name))
+        elif node.__class__ is Group:
+            return self.operand(node.expression)
+
+    def addBase(self, var_segment, var_index):
+        """
+        Adds the array pointer in a variable to D
+        """
+        base = self.code_writer.operand(var_segment, var_index)
+        if base is not None:
+            self.write(base[0] + ["D=D+M"])
+        else:
+            self.write(["@R13", "M=D"] + self.code_writer.loadD(var_segment, var_index) + ["@R13", "D=D+M"])
+
+    def compileStatements(self, statements):
+        for statement in statements:
+            if self.debug:
+                self.code_writer.writeLocation([self.name + ".jack:" + str(statement.line), self.code_writer.function_name])
+            self.compile(statement)
+
+    def compileDo(self, node):
+        self.compileCall(node.call, False)
+        #return value is being ignored
+        self.write(["@SP", "M=M-1"])
+
+    def compileLet(self, node):
+        var_segment, var_index = self.variable(node.name)
+        if node.index is None:
+            self.compile(node.value)
+            self.write(self.code_writer.storeD(var_segment, var_index))
+        #the base is read after the value here, which only matters if a call in the value can change it
+        elif (node.index.__class__ is IntConstant and node.index.value <= INDEX_CHAIN and self.code_writer.address(var_segment, var_index) is not None
+                and not (makesCalls(node.value) and var_segment in ("static", "this"))):
+            self.compile(node.value)
+            self.write(self.code_writer.address(var_segment, var_index) + ["A=M"] + ["A=A+1"] * node.index.value + ["M=D"])
+        else:
+            self.compile(node.index)
+            self.addBase(var_segment, var_index)
+            register = self.save(not makesCalls(node.value))
+            self.compile(node.value)
+            self.restore(register)
+            self.write(["A=M", "M=D"])
+
+    def compileWhile(self, node):
+        myloops = self.loops
+        self.loops += 1
+        self.code_writer.writeLabel("WHILE_EXP" + str(myloops))
+        self.compileBranch(node.condition, "WHILE_END" + str(myloops), False, False)
+        self.compileStatements(node.statements)
+        self.code_writer.writeGoto("WHILE_EXP" + str(myloops))
+        self.code_writer.writeLabel("WHILE_END" + str(myloops))
+
+    def compileReturn(self, node):
+        if node.value is None:
+            self.write(["@SP", "M=M+1", "A=M-1", "M=0"])
+        elif node.value.__class__ is Call:
+            #the callee's return value is already where ours goes
+            self.compileCall(node.value, False, True)
+            return
+        else:
+            self.compile(node.value)
+            self.write(self.code_writer.pushD())
+        self.code_writer.writeReturn()
+
+    def compileIf(self, node):
+        myifs = self.ifs
+        self.ifs += 1
+        self.compileBranch(node.condition, "IF_FALSE" + str(myifs), False, True)
+        self.compileStatements(node.then_statements)
+        if node.else_statements is not None:
+            self.code_writer.writeGoto("IF_END" + str(myifs))
+            self.code_writer.writeLabel("IF_FALSE" + str(myifs))
+            self.compileStatements(node.else_statements)
+            self.code_writer.writeLabel("IF_END" + str(myifs))
+        else:
+            self.code_writer.writeLabel("IF_FALSE" + str(myifs))
+
+    def compileBranch(self, node, label, when, nonzero):
+        """
+        Jumps to label if the condition's truth is when, without making a
+        boolean of it first. With nonzero any value but 0 is true, as for
+        the VM code of an if; without, only -1 is, as for the not and
+        if-goto of a while.
+        """
+        while node.__class__ is Group:
+            node = node.expression
+        v = constantValue(node)
+        if v is not None:
+            if (v != 0 if nonzero else v == -1) == when:
+                self.code_writer.writeGoto(label)
+        elif node.__class__ is BinaryOp and node.op in COMPARISONS:
+            self.compileDifference(node)
+            jump = COMPARISONS[node.op]
+            self.write([self.label(label), "D;" + (jump if when else INVERTED_JUMPS[jump])])
+        elif node.__class__ is UnaryOp and node.op == "~" and isBoolean(node.operand):
+            self.compileBranch(node.operand, label, not when, nonzero)
+        elif nonzero:
+            self.compile(node)
+            self.write([self.label(label), "D;" + ("JNE" if when else "JEQ")])
+        else:
+            self.compile(node)
+            self.write(["D=D+1", self.label(label), "D;" + ("JEQ" if when else "JNE")])
+
+    def compileDifference(self, node):
+        """
+        Leaves left op right in D, or left - right for a comparison
+        """
+        right = self.operand(node.right)
+        v = constantValue(node.right)
+        if v == 1 and node.op != "&" and node.op != "|":
+            self.compile(node.left)
+            self.write(["D=D+1" if node.op == "+" else "D=D-1"])
+        elif right is None and v is not None and v != -32768 and (node.op == "+" or node.op == "-"):
+            #adding a negative constant is subtracting a positive one
+            self.compile(node.left)
+            self.write(["@" + str(-v), "D=D-A" if node.op == "+" else "D=D+A"])
+        elif right is not None:
+            self.compile(node.left)
+            code, register = right
+            self.write(code + ["D=" + OPERAND_OPS[node.op].format(register)])
+        elif not makesCalls(node.right) and self.operand(node.left) is not None:
+            #nothing in the right side can change a plain left side, so it can go first
+            self.compile(node.right)
+            code, register = self.operand(node.left)
+            self.write(code + ["D=" + SAVED_OPS[node.op].format(register)])
+        else:
+            self.compile(node.left)
+            register = self.save(not makesCalls(node.right))
+            self.compile(node.right)
+            self.restore(register)
+            self.write(["D=" + SAVED_OPS[node.op].format("M")])
+
+    def compileBinaryOp(self, node):
+        if node.op == "*":
+            if not self.multiplyByConstant(node.left, node.right) and not self.multiplyByConstant(node.right, node.left):
+                self.callMath("Math.multiply", node)
+        elif node.op == "/":
+            #not strength reduced, see jackcompiler
+            self.callMath("Math.divide", node)
+        elif node.op in COMPARISONS:
+            mycompares = self.compares
+            self.compares += 1
+            self.compileDifference(node)
+            self.write([self.label("COMPARE_TRUE" + str(mycompares)), "D;" + COMPARISONS[node.op], "D=0", self.label("COMPARE_END" + str(mycompares)), "0;JMP"])
+            self.code_writer.writeLabel("COMPARE_TRUE" + str(mycompares))
+            self.write(["D=-1"])
+            self.code_writer.writeLabel("COMPARE_END" + str(mycompares))
+        else:
+            self.compileDifference(node)
+
+    def callMath(self, function_name, node):
+        self.compile(node.left)
+        self.write(self.code_writer.pushD())
+        self.compile(node.right)
+        self.write(self.code_writer.pushD())
+        self.code_writer.writeCall(function_name, 2)
+        self.write(self.code_writer.popD())
+
+    def multiplyByConstant(self, node, factor_node):
+        """
+        Multiplies by a constant factor without calling Math.multiply.
+        Hack can't add D to itself, so the product is kept in R13 as well
+        and doubled with MD=D+M, adding the operand back for each set bit.
+        """
+        factor = constantValue(factor_node)
+        if factor is None:
+            return False
+        negate = factor < 0 and factor != -32768
+        bits = bin(-factor if negate else factor & 0xFFFF)[2:]
+        self.compile(node)
+        if factor == 0:
+            self.write(["D=0"])
+            return True
+        register = None
+        if bits.count("1") > 1:
+            register = self.save(True)
+            operand = ["@" + register] if register is not None else ["@SP", "A=M-1"]
+        if len(bits) > 1:
+            self.write(["@R13", "M=D"])
+        for bit in bits[1:]:
+            self.write(["MD=D+M"])
+            if bit == "1":
+                self.write(operand + ["D=D+M", "@R13", "M=D"])
+        if bits.count("1") > 1:
+            self.release(register)
+        if negate:
+            self.write(["D=-D"])
+        return True
+
+    def compileUnaryOp(self, node):
+        self.compile(node.operand)
+        self.write(["D=-D" if node.op == "-" else "D=!D"])
+
+    def compileGroup(self, node):
+        self.compile(node.expression)
+
+    def compileIntConstant(self, node):
+        if node.value <= 1:
+            self.write(["D=" + str(node.value)])
+        else:
+            self.write(["@" + str(node.value), "D=A"])
+
+    def compileStringConstant(self, node):
+        """
+        With pool_strings each literal is built the first time it runs and
+        kept in a static slot after the class's own statics, up to
+        STRING_SLOTS of them; the rest are built every time
+        """
+        if not self.pool_strings or (node.value not in self.strings and len(self.strings) >= STRING_SLOTS):
+            self.buildString(node.value)
+            self.write(self.code_writer.popD())
+            return
+        if node.value not in self.strings:
+            self.strings[node.value] = self.symbol_table.varCount(Kind.STATIC) + len(self.strings)
+        index = self.strings[node.value]
+        label = "STRING_READY" + str(self.string_uses)
+        self.string_uses += 1
+        self.write(self.code_writer.loadD("static", index) + [self.label(label), "D;JNE"])
+        self.buildString(node.value)
+        self.write(self.code_writer.popD() + self.code_writer.storeD("static", index))
+        self.code_writer.writeLabel(label)
+
+    def buildString(self, value):
+        """
+        Leaves a new string holding value on the stack
+        """
+        self.write(["@" + str(len(value)), "D=A"] + self.code_writer.pushD())
+        self.code_writer.writeCall("String.new", 1)
+        for c in value:
+            self.write(["@" + str(ord(c)), "D=A"] + self.code_writer.pushD())
+            self.code_writer.writeCall("String.appendChar", 2)
+
+    def compileKeywordConstant(self, node):
+        if node.value == "this":
+            self.write(["@THIS", "D=M"])
+        elif node.value == "true":
+            self.write(["D=-1"])
+        else:
+            self.write(["D=0"])
+
+    def compileVariable(self, node):
+        var_segment, var_index = self.variable(node.name)
+        if node.index is None:
+            self.write(self.code_writer.loadD(var_segment, var_index))
+        elif node.index.__class__ is IntConstant:
+            offset = node.index.value
+            self.write(self.code_writer.loadD(var_segment, var_index))
+            if offset == 0:
+                self.write(["A=D", "D=M"])
+            elif offset == 1:
+                self.write(["A=D+1", "D=M"])
+            else:
+                self.write(["@" + str(offset), "A=D+A", "D=M"])
+        else:
+            self.compile(node.index)
+            self.addBase(var_segment, var_index)
+            self.write(["A=D", "D=M"])
+
+    def compileCall(self, node, value=True, tail=False):
+        """
+        Calls leave their result on the stack, value pops it into D and
+        tail returns it straight to our caller
+        """
+        args = 0
+        if node.receiver is None:
+            func_name = self.name + "." + node.name
+            self.write(["@THIS", "D=M"] + self.code_writer.pushD())
+            args += 1
+        elif self.symbol_table.inTable(node.receiver):
+            self.write(self.code_writer.loadD(*self.variable(node.receiver)) + self.code_writer.pushD())
+            func_name = self.symbol_table.typeOf(node.receiver) + "." + node.name
+            args += 1
+        else:
+            func_name = node.receiver + "." + node.name
+        for arg in node.args:
+            self.compile(arg)
+            self.write(self.code_writer.pushD())
+        args += len(node.args)
+
+        if tail:
+            self.code_writer.writeTailCall(func_name, args)
+            return
+        self.code_writer.writeCall(func_name, args)
+        if value:
+            self.write(self.code_writer.popD())
+
+def compileFile(source, output_file, debug=False, shared_calls=False, pool_strings=False):
+    """
+    Compiles one .jack file to a chunk of Hack assembly. Returns the class
+    and whether the chunk needs the runtime routines. With debug the code
+    of each statement is preceded by its Jack line.
+    """
+    class_node = parseFile(source)
+    ConstantFolder().compile(class_node)
+    code_writer = VMCodeWriter(output_file, shared_calls=shared_calls)
+    code_writer.setProgName(os.path.basename(source)[:-5])
+    AsmCompilationEngine(class_node, code_writer, SymbolTable(), debug, pool_strings)
+    return class_node, code_writer.uses_runtime
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Compile Jack straight to Hack assembly, linking in the translated .vm files of the same directory")
+    arg_parser.add_argument("source", help=".jack file or directory")
+    arg_parser.add_argument("-l", "--lib", action="append", default=[], help="directory of extra .vm files to link in, e.g. the OS")
+    arg_parser.add_argument("-o", "--output", help="output .asm file, or - for stdout")
+    arg_parser.add_argument("-g", "--debug", action="store_true", help="mark the code with Jack and VM lines, for the assembler's --map")
+    arg_parser.add_argument("--pool-strings", action="store_true", help="keep string literals in static slots once built, as jackcompiler --pool-strings")
+    arg_parser.add_argument("--shared-calls", action="store_true", help="jump to one shared copy of the call and return code, as vmtranslator2 --shared-calls")
+    args = arg_parser.parse_args()
+
+    #class name -> source, a .jack file wins over a .vm file of the same class
+    classes = {}
+    if os.path.isdir(args.source):
+        directory = os.path.normpath(args.source)
+        output_file = os.path.join(directory, os.path.basename(os.path.abspath(directory)) + ".asm")
+        for library in args.lib + [directory]:
+            for f in os.listdir(library):
+                if os.path.isfile(os.path.join(library, f)) and (f.endswith(".vm") or f.endswith(".jack")):
+                    name = f[:f.rindex(".")]
+                    if not classes.get(name, "").endswith(".jack"):
+                        classes[name] = os.path.join(library, f)
+    elif args.source.endswith(".jack"):
+        output_file = args.source[:-5] + ".asm"
+        classes[os.path.basename(args.source)[:-5]] = args.source
+    else:
+        print("Wrong File Extension")
+        exit()
+    if args.output is not None:
+        output_file = args.output
+
+    chunks = []
+    uses_runtime = False
+    for name in sorted(classes):
+        source = classes[name]
+        if source.endswith(".jack"):
+            chunk = io.StringIO()
+            chunk_uses_runtime = compileFile(source, chunk, args.debug, args.shared_calls, args.pool_strings)[1]
+            chunk = chunk.getvalue()
+        else:
+            chunk, report, chunk_uses_runtime = translateFile(source, False, args.debug, args.shared_calls)
+        chunks.append(chunk)
+        uses_runtime = uses_runtime or chunk_uses_runtime
+    with (nullcontext(sys.stdout) if output_file == "-" else open(output_file, "w")) as f:
+        if len(chunks) > 1:
+            f.write(bootstrapCode(None, args.debug, args.shared_calls))
+        for chunk in chunks:
+            f.write(chunk)
+        if (len(chunks) > 1 and args.shared_calls) or uses_runtime:
+            f.write(runtimeCode(None, args.debug))
@@ -1,22 +1,17 @@
 import argparse
 import tempfile
+import io
 import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext, redirect_stdout
 from enum import IntEnum
-from enum import Enum
+from itertools import repeat
 
-def isInt(s):
-    try:
-        int(s)
-        return True
-    except ValueError:
-        return False
-
-class TokenType(Enum):
-    KEYWORD = 0
-    SYMBOL = 1
-    IDENTIFIER = 2
-    INT_CONST = 3
-    STRING_CONST = 4
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "10"))
+from jackparser import TreeCompiler, BinaryOp, UnaryOp, Group, IntConstant, KeywordConstant, Variable, Call, parseFile
+import jacksyntax
 
 class Kind(IntEnum):
     STATIC = 0
@@ -24,520 +19,559 @@ class Kind(IntEnum):
     ARG = 2
     VAR = 3
 
-class JackTokenizer:
-    SYMBOLS = ['{', '}', '(', ')', '[', ']', '.', ',', ';', '+', '-', '*', '/', '&', '|', '<', '>', '=', '~']
-    KEYWORDS = ['class',
-            'constructor',
-            'function',
-            'method',
-            'field',
-            'static',
-            'var',
-            'int',
-            'char',
-            'boolean',
-            'void',
-            'true',
-            'false',
-            'null',
-            'this',
-            'let',
-            'do',
-            'if',
-            'else',
-            'while',
-            'return']
-
-    def __init__(self, source_file):
-        self.tokens = []
-        lines = []
-        with open(source_file) as f:
-            in_comment = False
-            for line in f:
-                l = ' '.join(line.split())
-                comment_position = l.find("//")
-                if comment_position != -1:
-                    l = l[0:comment_position]
-                if in_comment == False:
-                    start_comment_position = l.find("/*")
-                    if start_comment_position != -1:
-                        in_comment = True
-                if in_comment:
-                    end_comment_position = l.find("*/")
-                    if end_comment_position != -1:
-                        l = l[end_comment_position+2:]
-                        in_comment = False
-                    else:
-                        start_comment_position = l.find("/*")
-                        if start_comment_position != -1:
-                            l = l[0:start_comment_position]
-                        else:
-                            l = ""
-                lines.append(l)
-        lines = filter(None, lines)
-        self.tokenizeLines('\n'.join(lines))
-
-    def addToken(self, token):
-        if token.strip() != "":
-            self.tokens.append(token)
-
-    def tokenizeLines(self, lines):
-        """
-        0 = searching
-        1 = in string
-        2 = in int
-        3 = identifier/keyword
-        """
-        state = 0
-        current_token = ""
-        for c in lines:
-            if state == 1:
-                if c == '"':
-                    state = 0
-                    self.addToken(current_token + c)
-                    current_token = ""
-                elif c == '\n':
-                    print("Your string has a newline in it")
-                    exit()
-                else:
-                    current_token += c
-                continue;
-            if c == ' ' or c == '\n':
-                state = 0
-                self.addToken(current_token)
-                current_token = ""
-                continue;
-            if c in self.SYMBOLS:
-                state = 0
-                self.addToken(current_token)
-                self.addToken(c)
-                current_token = ""
-                continue;
-            if state == 3:
-                current_token += c
-                continue;
-            if c == "\"":
-                if state != 0:
-                    print("Your int is touching the string")
-                    exit()
-                state = 1
-                self.addToken(current_token)
-                current_token = c
-                continue;
-            if state == 2:
-                if not c.isdigit():
-                    print("Your int isn't an int")
-                    exit()
-                current_token += c
-                continue;
-            if c.isdigit():
-                state = 2
-                self.addToken(current_token)
-                current_token = ""
-            state = 3
-            current_token += c
-
-    def hasMoreTokens(self):
-        return len(self.tokens) > 0
-
-    def advance(self):
-        if self.hasMoreTokens():
-            self.current_token = self.tokens.pop(0)
-
-    def tokenType(self):
-        if self.current_token[0] == '"' and self.current_token[-1] == '"':
-            return TokenType.STRING_CONST
-        if self.current_token in self.SYMBOLS:
-            return TokenType.SYMBOL
-        if isInt(self.current_token):
-            return TokenType.INT_CONST
-        if self.current_token in self.KEYWORDS:
-            return TokenType.KEYWORD
-        return TokenType.IDENTIFIER
-
-    def keyword(self):
-        if self.tokenType() != TokenType.KEYWORD:
-            return
-        return self.current_token
-
-    def symbol(self):
-        if self.tokenType() != TokenType.SYMBOL:
-            return
-        if self.current_token  == ">":
-            return "&gt;"
-        elif self.current_token == "<":
-            return "&lt;"
-        elif self.current_token == "&":
-            return "&amp;"
-
-        return self.current_token
-
-    def identifier(self):
-        if self.tokenType() != TokenType.IDENTIFIER:
-            return
-        return self.current_token
-
-    def intVal(self):
-        if self.tokenType() != TokenType.INT_CONST:
-            return
-        return int(self.current_token)
-
-    def stringVal(self):
-        if self.tokenType() != TokenType.STRING_CONST:
-            return
-        t = self.current_token[self.current_token.find('"')+1:]
-        return t[:-1]
-
-    def token(self):
-        if self.tokenType() == TokenType.KEYWORD:
-            return self.keyword()
-        elif self.tokenType() == TokenType.SYMBOL:
-            return self.symbol()
-        elif self.tokenType() == TokenType.IDENTIFIER:
-            return self.identifier()
-        elif self.tokenType() == TokenType.INT_CONST:
-            return self.intVal()
-        elif self.tokenType() == TokenType.STRING_CONST:
-            return self.stringVal()
-
-    def writeTokens(self, output_file):
-        with open(output_file, "w") as f:
-            f.write("<tokens>\n")
-            while self.hasMoreTokens():
-                self.advance()
-                token_type = self.tokenType()
-                if token_type == TokenType.KEYWORD:
-                    f.write("<keyword> " + self.keyword() + " </keyword>\n")
-                elif token_type == TokenType.SYMBOL:
-                    f.write("<symbol> " + self.symbol() + " </symbol>\n")
-                elif token_type == TokenType.IDENTIFIER:
-                    f.write("<identifier> " + self.identifier() + " </identifier>\n")
-                elif token_type == TokenType.INT_CONST:
-                    f.write("<integerConstant> " + str(self.intVal()) + " </integerConstant>\n")
-                elif token_type == TokenType.STRING_CONST:
-                    f.write("<stringConstant> " + self.stringVal() + " </stringConstant>\n")
-            f.write("</tokens>")
-        return f
-
-class CompilationEngine:
+#largest factor multiplied out inline when it isn't a power of two
+SHORT_MULTIPLY = 16
+#most string literals a class keeps in static slots; the rest are built each
+#time they run, so the pool can't take much of the 240 words statics share
+STRING_SLOTS = 8
+
+def wordValue(v):
+    """
+    Wraps v to a signed 16 bit Hack word
+    """
+    v &= 0xFFFF
+    return v - 0x10000 if v & 0x8000 else v
+
+def constantValue(node):
+    """
+    Returns the value of a constant expression as a signed word, or None
+    """
+    if node.__class__ is IntConstant:
+        return node.value
+    elif node.__class__ is KeywordConstant:
+        if node.value == "true":
+            return -1
+        elif node.value == "false" or node.value == "null":
+            return 0
+    elif node.__class__ is UnaryOp:
+        v = constantValue(node.operand)
+        if v is not None:
+            return wordValue(-v) if node.op == "-" else wordValue(~v)
+    elif node.__class__ is Group:
+        return constantValue(node.expression)
+
+def constantNode(v):
+    """
+    Builds the cheapest expression for the signed word v, push constant only takes 0..32767
+    """
+    if v >= 0:
+        return IntConstant(v)
+    elif v == -32768:
+        return UnaryOp("~", IntConstant(32767))
+    return UnaryOp("-", IntConstant(-v))
+
+def isBoolean(node):
+    """
+    True if node can only be true (-1) or false (0). Only these may be
+    negated with not to branch on them, any other nonzero value is true
+    too and its not is nonzero as well.
+    """
+    if constantValue(node) in (0, -1):
+        return True
+    elif node.__class__ is BinaryOp:
+        if node.op in ("<", ">", "="):
+            return True
+        return node.op in ("&", "|") and isBoolean(node.left) and isBoolean(node.right)
+    elif node.__class__ is UnaryOp:
+        return node.op == "~" and isBoolean(node.operand)
+    elif node.__class__ is Group:
+        return isBoolean(node.expression)
+    return False
+
+def negatedBoolean(node):
+    """
+    Returns b when node is ~b for a boolean b, so branching on its negation
+    can test b directly, else None
+    """
+    while node.__class__ is Group:
+        node = node.expression
+    if node.__class__ is UnaryOp and node.op == "~" and isBoolean(node.operand):
+        return node.operand
+    return None
+
+def makesCalls(node):
+    if node.__class__ is Call:
+        return True
+    elif node.__class__ is BinaryOp:
+        return makesCalls(node.left) or makesCalls(node.right)
+    elif node.__class__ is UnaryOp:
+        return makesCalls(node.operand)
+    elif node.__class__ is Group:
+        return makesCalls(node.expression)
+    elif node.__class__ is Variable and node.index is not None:
+        return makesCalls(node.index)
+    return False
+
+def readsArrays(node):
+    """
+    True if evaluating node indexes an array, which moves pointer 1
+    """
+    if node.__class__ is Variable:
+        return node.index is not None
+    elif node.__class__ is Call:
+        return any(readsArrays(arg) for arg in node.args)
+    elif node.__class__ is BinaryOp:
+        return readsArrays(node.left) or readsArrays(node.right)
+    elif node.__class__ is UnaryOp:
+        return readsArrays(node.operand)
+    elif node.__class__ is Group:
+        return readsArrays(node.expression)
+    return False
+
+def foldOperator(op, a, b):
+    """
+    Evaluates a op b the way the Hack code does, or returns None when the
+    result is better left to run time
+    """
+    if op == "+":
+        return wordValue(a + b)
+    elif op == "-":
+        return wordValue(a - b)
+    elif op == "*":
+        return wordValue(a * b)
+    elif op == "/":
+        #only where every sign convention agrees, and never fold away a divide by zero
+        if a >= 0 and b > 0:
+            return a // b
+    elif op == "&":
+        return a & b
+    elif op == "|":
+        return a | b
+    #comparisons look at the sign of the wrapped difference, like the translated code
+    elif op == "<":
+        return -1 if wordValue(a - b) < 0 else 0
+    elif op == ">":
+        return -1 if wordValue(a - b) > 0 else 0
+    elif op == "=":
+        return -1 if a == b else 0
+
+class ConstantFolder(TreeCompiler):
+    """
+    Optimizing pass that folds operators on constants and drops operations
+    that leave the other operand unchanged. Statements are rewritten in
+    place, expressions are returned.
+    """
+    def compileClass(self, node):
+        for subroutine in node.subroutines:
+            self.compileStatements(subroutine.statements)
+        return node
+
+    def compileStatements(self, statements):
+        for statement in statements:
+            self.compile(statement)
+
+    def compileLet(self, node):
+        if node.index is not None:
+            node.index = self.compile(node.index)
+        node.value = self.compile(node.value)
+
+    def compileIf(self, node):
+        node.condition = self.compile(node.condition)
+        self.compileStatements(node.then_statements)
+        if node.else_statements is not None:
+            self.compileStatements(node.else_statements)
+
+    def compileWhile(self, node):
+        node.condition = self.compile(node.condition)
+        self.compileStatements(node.statements)
+
+    def compileDo(self, node):
+        self.compile(node.call)
+
+    def compileReturn(self, node):
+        if node.value is not None:
+            node.value = self.compile(node.value)
+
+    def compileBinaryOp(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        a = constantValue(left)
+        b = constantValue(right)
+        if a is not None and b is not None:
+            v = foldOperator(node.op, a, b)
+            if v is not None:
+                return constantNode(v)
+        if b == 0 and (node.op == "+" or node.op == "-" or node.op == "|"):
+            return left
+        if a == 0 and (node.op == "+" or node.op == "|"):
+            return right
+        if b == 1 and (node.op == "*" or node.op == "/"):
+            return left
+        if a == 1 and node.op == "*":
+            return right
+        if node.op == "*" and ((a == 0 and not makesCalls(right)) or (b == 0 and not makesCalls(left))):
+            return IntConstant(0)
+        return BinaryOp(node.op, left, right)
+
+    def compileUnaryOp(self, node):
+        operand = self.compile(node.operand)
+        v = constantValue(operand)
+        if v is not None:
+            return constantNode(wordValue(-v) if node.op == "-" else wordValue(~v))
+        return UnaryOp(node.op, operand)
+
+    def compileGroup(self, node):
+        #parentheses only matter to the XML, the tree already fixes the order
+        return self.compile(node.expression)
+
+    def compileIntConstant(self, node):
+        return node
+
+    def compileStringConstant(self, node):
+        return node
+
+    def compileKeywordConstant(self, node):
+        return node
+
+    def compileVariable(self, node):
+        if node.index is not None:
+            node.index = self.compile(node.index)
+        return node
+
+    def compileCall(self, node):
+        node.args = [self.compile(arg) for arg in node.args]
+        return node
+
+class CompilationEngine(TreeCompiler):
+    """
+    VM back end, generates code for a parsed class
+    """
     OPERATORS = {"+": "add",
             "-": "sub",
             "*": "",
             "/": "",
-            "&amp;": "and",
+            "&": "and",
             "|": "or",
-            "&lt;": "lt",
-            "&gt;": "gt",
+            "<": "lt",
+            ">": "gt",
             "=": "eq"}
 
     UNARY_OPERATORS = {"-": "neg", "~": "not"}
     SEGMENTS = ["static", "this", "argument", "local"]
 
-    def __init__(self, tokenizer, vm_writer, symbol_table):
-        self.tokenizer = tokenizer
+    def __init__(self, class_node, vm_writer, symbol_table, optimize=True, debug=False, pool_strings=False):
         self.vm_writer = vm_writer
         self.symbol_table = symbol_table
+        self.optimize = optimize
+        self.pool_strings = pool_strings
+        self.debug = debug
         self.name = ""
+        self.function_name = ""
         self.loops = 0
         self.ifs = 0
-        self.compileClass()
-
-    def next(self):
-        self.tokenizer.advance()
-
-    def compileClass(self):
-        self.next()
-        self.next()
-        self.name = self.tokenizer.token()
-        self.next()
-        self.next()
-        
-        while self.tokenizer.keyword() == "field" or self.tokenizer.keyword() == "static":
-            self.compileClassVarDec()
-
-        while self.tokenizer.keyword() == "function" or self.tokenizer.keyword() == "method" or self.tokenizer.keyword() == "constructor":
-            self.compileSubroutine()
-
-        self.vm_writer.close()
-
-    def compileClassVarDec(self):
-        category = self.tokenizer.keyword()
-        self.next()
-        t = self.tokenizer.token()
-        self.next()
-        kind = 0 
-        if category == "static":
+        #string literal -> static slot holding it once built
+        self.strings = {}
+        self.string_uses = 0
+        #(segment, index) of the variable whose value pointer 1 holds, None when unknown
+        self.that = None
+        self.compileClass(class_node)
+
+    def compileClass(self, node):
+        self.name = node.name
+        for class_var in node.class_vars:
+            self.compileClassVarDec(class_var)
+        for subroutine in node.subroutines:
+            self.compileSubroutine(subroutine)
+        self.vm_writer.flush()
+
+    def compileClassVarDec(self, node):
+        kind = 0
+        if node.kind == "static":
             kind = Kind.STATIC
-        elif category == "field":
+        elif node.kind == "field":
             kind = Kind.FIELD
-        self.symbol_table.define(self.tokenizer.identifier(), t, kind)
-        self.next()
-        while self.tokenizer.symbol() != ";":
-            if self.tokenizer.symbol() != ",":
-                self.symbol_table.define(self.tokenizer.identifier(), t, kind)
-            self.next()
-        self.next()
-
-    def compileSubroutine(self):
-        function_kind = self.tokenizer.keyword()
-        self.next()
-        self.next()
+        for name in node.names:
+            self.symbol_table.define(name, node.type, kind)
+
+    def compileSubroutine(self, node):
         self.symbol_table.startSubroutine()
-        function_name = self.name + "." + self.tokenizer.identifier()
-        if function_kind == "method":
+        function_name = self.name + "." + node.name
+        self.function_name = function_name
+        if node.kind == "method":
             self.symbol_table.define("instance", self.name, Kind.ARG)
-        self.next()
-        self.next()
-        self.compileParameterList()
-        self.next()
-        self.next()
-        while self.tokenizer.keyword() == "var":
-            self.compileVarDec()
-
+        for t, name in node.parameters:
+            self.symbol_table.define(name, t, Kind.ARG)
+        for var_dec in node.var_decs:
+            for name in var_dec.names:
+                self.symbol_table.define(name, var_dec.type, Kind.VAR)
+
+        if self.debug:
+            self.writeLocation(node)
         self.vm_writer.writeFunction(function_name, self.symbol_table.varCount(Kind.VAR))
-        if function_kind == "constructor":
+        if node.kind == "constructor":
             self.vm_writer.writePush("constant", self.symbol_table.varCount(Kind.FIELD))
             self.vm_writer.writeCall("Memory.alloc", 1)
             self.vm_writer.writePop("pointer", 0)
-        elif function_kind == "method":
+        elif node.kind == "method":
             #pop first argument into this pointer
             self.vm_writer.writePush("argument", 0)
             self.vm_writer.writePop("pointer", 0)
-        self.compileStatements()  
-        self.next()
-
-    def compileParameterList(self):
-        if self.tokenizer.symbol() == ")":
-            return;
-        t = self.tokenizer.token()
-        self.next()
-        self.symbol_table.define(self.tokenizer.identifier(), t, Kind.ARG)
-        self.next()
-
-        while self.tokenizer.symbol() != ")":
-            self.next()
-            if self.tokenizer.tokenType() == TokenType.KEYWORD:
-                t = self.tokenizer.keyword()
-            elif self.tokenizer.tokenType() == TokenType.IDENTIFIER:
-                t = self.tokenizer.identifier()
-            self.next()
-            self.symbol_table.define(self.tokenizer.identifier(), t, Kind.ARG)
-            self.next()
-
-    def compileVarDec(self):
-        self.next()
-        t = self.tokenizer.token()
-        self.next()
-        self.symbol_table.define(self.tokenizer.identifier(), t, Kind.VAR)
-        self.next()
-        while self.tokenizer.symbol() != ";":
-            if self.tokenizer.symbol() != ",":
-                self.symbol_table.define(self.tokenizer.identifier(), t, Kind.VAR)
-            self.next()
-        self.next()
-
-    def compileStatements(self):
-        while self.tokenizer.symbol() != "}":
-            if self.tokenizer.keyword() == "do":
-                self.compileDo()
-            elif self.tokenizer.keyword() == "let":
-                self.compileLet()
-            elif self.tokenizer.keyword() == "while":
-                self.compileWhile()
-            elif self.tokenizer.keyword() == "return":
-                self.compileReturn()
-            elif self.tokenizer.keyword() == "if":
-                self.compileIf()
-
-    def compileDo(self):
-        self.next()
-        self.compileCall("")
+        self.that = None
+        self.compileStatements(node.statements)
+
+    def variable(self, name):
+        """
+        Returns the segment and index of a declared variable
+        """
+        kind = self.symbol_table.kindOf(name)
+        if kind is None:
+            print("Undefined variable " + name + " in " + self.name)
+            exit()
+        return self.SEGMENTS[kind], self.symbol_table.indexOf(name)
+
+    def pointThat(self, var_segment, var_index):
+        """
+        Points that at the array in a variable, unless it already is
+        """
+        if self.that != (var_segment, var_index):
+            self.vm_writer.writePush(var_segment, var_index)
+            self.vm_writer.writePop("pointer", 1)
+            self.that = (var_segment, var_index)
+
+    def writeLocation(self, node):
+        """
+        Writes a //@ file:line function comment, the Jack line the code
+        after it comes from. vmtranslator2 --debug carries these through
+        to the assembly for the assembler's --map.
+        """
+        self.vm_writer.write("//@ " + self.name + ".jack:" + str(node.line) + " " + self.function_name)
+
+    def compileStatements(self, statements):
+        for statement in statements:
+            if self.debug:
+                self.writeLocation(statement)
+            self.compile(statement)
+
+    def compileDo(self, node):
+        self.compileCall(node.call)
         #return value is being ignored
         self.vm_writer.writePop("temp", 0)
-        self.next()
-        
-    def compileLet(self):
-        array_assignment = False
-        self.next()
-        var_name = self.tokenizer.token()
-        var_segment = self.SEGMENTS[self.symbol_table.kindOf(var_name)]
-        var_index = self.symbol_table.indexOf(var_name)
-        self.next()
-        if self.tokenizer.symbol() == "[":
-            array_assignment = True
-            self.next()
-            self.compileExpression()
+
+    def compileLet(self, node):
+        var_segment, var_index = self.variable(node.name)
+        if node.index is None:
+            self.compile(node.value)
+            self.vm_writer.writePop(var_segment, var_index)
+            if self.that == (var_segment, var_index):
+                self.that = None
+        #the base is read after the value here, which only matters if a call in the value can change it
+        elif self.optimize and node.index.__class__ is IntConstant and not (makesCalls(node.value) and var_segment in ("static", "this")):
+            self.compile(node.value)
+            self.pointThat(var_segment, var_index)
+            self.vm_writer.writePop("that", node.index.value)
+        elif self.optimize and not readsArrays(node.value):
+            #calls save and restore that, so only an array read in the value would move it
+            self.compile(node.index)
+            self.vm_writer.writePush(var_segment, var_index)
+            self.vm_writer.writeArithmetic("add")
+            self.vm_writer.writePop("pointer", 1)
+            self.compile(node.value)
+            self.vm_writer.writePop("that", 0)
+            self.that = None
+        else:
+            self.compile(node.index)
             self.vm_writer.writePush(var_segment, var_index)
             self.vm_writer.writeArithmetic("add")
-            self.next()
-        self.next()
-        self.compileExpression()
-        if array_assignment:
+            self.compile(node.value)
             self.vm_writer.writePop("temp", 0)
             self.vm_writer.writePop("pointer", 1)
             self.vm_writer.writePush("temp", 0)
             self.vm_writer.writePop("that", 0)
-        else:
-            self.vm_writer.writePop(var_segment, var_index)
-        self.next()
+            self.that = None
 
-    def compileWhile(self):
+    def compileWhile(self, node):
         myloops = self.loops
         self.loops += 1
-        self.next()
-        self.next()
+        #labels start a new block, nothing is known about that there
+        self.that = None
         self.vm_writer.writeLabel("WHILE_EXP" + str(myloops))
-        self.compileExpression()
-        self.vm_writer.writeArithmetic("not")
+        #a while loop only goes on while its condition is -1, as in the standard compiler
+        negated = negatedBoolean(node.condition)
+        if negated is not None:
+            self.compile(negated)
+        else:
+            self.compile(node.condition)
+            self.vm_writer.writeArithmetic("not")
         self.vm_writer.writeIf("WHILE_END" + str(myloops))
-        self.next()
-        self.next()
-        self.compileStatements()
-        self.next()
+        self.compileStatements(node.statements)
         self.vm_writer.writeGoto("WHILE_EXP" + str(myloops))
         self.vm_writer.writeLabel("WHILE_END" + str(myloops))
+        self.that = None
 
-    def compileReturn(self):
-        self.next()
-        if self.tokenizer.symbol() != ";":
-            self.compileExpression()
+    def compileReturn(self, node):
+        if node.value is not None:
+            self.compile(node.value)
         else:
             self.vm_writer.writePush("constant", 0)
-        self.next()
         self.vm_writer.writeReturn()
-    
-    def compileIf(self):
+
+    def compileIf(self, node):
         myifs = self.ifs
         self.ifs += 1
-        else_statement = False
-        self.next()
-        self.next()
-        self.compileExpression()
-        self.vm_writer.writeIf("IF_TRUE" + str(myifs))
-        self.vm_writer.writeGoto("IF_FALSE" + str(myifs))
-        self.vm_writer.writeLabel("IF_TRUE" + str(myifs))
-        self.next()
-        self.next()
-        self.compileStatements()
-        self.next()
-        if self.tokenizer.keyword() == "else":
-            else_statement = True
+        self.compileJumpIfFalse(node.condition, "IF_FALSE" + str(myifs))
+        self.compileStatements(node.then_statements)
+        if node.else_statements is not None:
             self.vm_writer.writeGoto("IF_END" + str(myifs))
             self.vm_writer.writeLabel("IF_FALSE" + str(myifs))
-            self.next()
-            self.next()
-            self.compileStatements()
-            self.next()
-        if else_statement:
+            self.that = None
+            self.compileStatements(node.else_statements)
             self.vm_writer.writeLabel("IF_END" + str(myifs))
         else:
             self.vm_writer.writeLabel("IF_FALSE" + str(myifs))
+        self.that = None
 
-    def compileExpressionList(self):
-        args = 0
-        if self.tokenizer.symbol() != ")":
-            self.compileExpression()
-            args += 1
-        
-        while self.tokenizer.symbol() == ",":
-            self.next()
-            self.compileExpression()
-            args += 1
-        
-        return args
-        
-    def compileExpression(self):
-        self.compileTerm()
-        while self.tokenizer.symbol() in self.OPERATORS:
-            operator = self.tokenizer.symbol()
-            self.next()
-            self.compileTerm()
-            if operator == "*":
-                self.vm_writer.writeCall("Math.multiply", 2)
-            elif operator == "/":
-                self.vm_writer.writeCall("Math.divide", 2)
-            else:
-                self.vm_writer.writeArithmetic(self.OPERATORS[operator])
-
-    def compileTerm(self):
-        if self.tokenizer.symbol() == "-" or self.tokenizer.symbol() == "~":
-            operator = self.tokenizer.symbol()
-            self.next()
-            self.compileTerm()
-            self.vm_writer.writeArithmetic(self.UNARY_OPERATORS[operator])
-        elif self.tokenizer.symbol() == "(":
-            self.next()
-            self.compileExpression()
-            self.next()
-        elif self.tokenizer.tokenType() == TokenType.INT_CONST:
-            self.vm_writer.writePush("constant", self.tokenizer.intVal())
-            self.next()
-        elif self.tokenizer.tokenType() == TokenType.STRING_CONST:
-            string_const = self.tokenizer.stringVal()
-            self.vm_writer.writePush("constant", len(string_const))
-            self.vm_writer.writeCall("String.new", 1)
-            for c in string_const:
-                self.vm_writer.writePush("constant", ord(c))
-                self.vm_writer.writeCall("String.appendChar", 2)
-            self.next()
-        elif self.tokenizer.tokenType() == TokenType.KEYWORD:
-            if self.tokenizer.keyword() == "this":
-                self.vm_writer.writePush("pointer", 0)
-            else:
-                self.vm_writer.writePush("constant", 0)
-                if self.tokenizer.keyword() == "true":
-                    self.vm_writer.writeArithmetic("not")
-            self.next()
+    def compileJumpIfFalse(self, condition, label):
+        """
+        Jumps to label unless condition is nonzero, with a single if-goto.
+        Booleans are negated with not, anything else is compared with 0 so
+        that every nonzero value counts as true.
+        """
+        negated = negatedBoolean(condition)
+        if negated is not None:
+            self.compile(negated)
+        elif isBoolean(condition):
+            self.compile(condition)
+            self.vm_writer.writeArithmetic("not")
+        else:
+            self.compile(condition)
+            self.vm_writer.writePush("constant", 0)
+            self.vm_writer.writeArithmetic("eq")
+        self.vm_writer.writeIf(label)
+
+    def compileBinaryOp(self, node):
+        if node.op == "*" and self.optimize and (self.multiplyByConstant(node.left, node.right) or self.multiplyByConstant(node.right, node.left)):
+            return
+        self.compile(node.left)
+        self.compile(node.right)
+        if node.op == "*":
+            self.vm_writer.writeCall("Math.multiply", 2)
+        elif node.op == "/":
+            #only multiplies are strength reduced: with no shift instruction and
+            #no way to know the dividend's sign, x / 2^k is no cheaper inline
+            self.vm_writer.writeCall("Math.divide", 2)
         else:
-            temp = self.tokenizer.token()
-            self.next()
-            if self.tokenizer.symbol() == "(" or self.tokenizer.symbol() == ".":
-                self.compileCall(temp)
+            self.vm_writer.writeArithmetic(self.OPERATORS[node.op])
+
+    def multiplyByConstant(self, node, factor_node):
+        """
+        Multiplies node by a constant factor with doublings and adds instead
+        of calling Math.multiply, when the factor is a power of two or at most
+        SHORT_MULTIPLY. Returns False if the factor doesn't qualify.
+        """
+        factor = constantValue(factor_node)
+        if factor is None or factor == -32768:
+            return False
+        negative = factor < 0
+        factor = abs(factor)
+        if factor < 2 or (factor > SHORT_MULTIPLY and factor & (factor - 1) != 0):
+            return False
+        self.compile(node)
+        if node.__class__ is Variable and node.index is None:
+            #the operand can simply be pushed again
+            push_operand = lambda: self.compile(node)
+        else:
+            self.vm_writer.writePop("temp", 2)
+            self.vm_writer.writePush("temp", 2)
+            push_operand = lambda: self.vm_writer.writePush("temp", 2)
+        for i, bit in enumerate(bin(factor)[3:]):
+            #the first doubling adds the operand to itself, later ones go through temp 1
+            if i == 0:
+                push_operand()
             else:
-                array_access = False
-                var_segment = self.SEGMENTS[self.symbol_table.kindOf(temp)]
-                var_index = self.symbol_table.indexOf(temp)
-                if self.tokenizer.symbol() == "[":
-                    array_access = True
-                    self.next()
-                    self.compileExpression()
-                    self.vm_writer.writePush(var_segment, var_index)
-                    self.vm_writer.writeArithmetic("add")
-                    self.next()
-                if array_access:
-                    self.vm_writer.writePop("pointer", 1)
-                    self.vm_writer.writePush("that", 0)
-                else:
-                    self.vm_writer.writePush(var_segment, var_index)
-
-    def compileCall(self, start_buffer):
-        temp_buffer = start_buffer
-        while self.tokenizer.symbol() != "(":
-            temp_buffer += self.tokenizer.token()
-            self.next()
-
-        subroutine_name = ""
-        before_dot = ""
-        func_name = ""
-        args = 0
-        if "." in temp_buffer:
-            before_dot = temp_buffer[0:temp_buffer.find(".")]
-            subroutine_name = temp_buffer[(temp_buffer.find(".") + 1):]
-            func_name = before_dot + "." + subroutine_name
-            if self.symbol_table.inTable(before_dot):
-                self.vm_writer.writePush(self.SEGMENTS[self.symbol_table.kindOf(before_dot)], self.symbol_table.indexOf(before_dot))
-                func_name = self.symbol_table.typeOf(before_dot) + "." + subroutine_name
-                args += 1
+                self.vm_writer.writePop("temp", 1)
+                self.vm_writer.writePush("temp", 1)
+                self.vm_writer.writePush("temp", 1)
+            self.vm_writer.writeArithmetic("add")
+            if bit == "1":
+                push_operand()
+                self.vm_writer.writeArithmetic("add")
+        if negative:
+            self.vm_writer.writeArithmetic("neg")
+        return True
+
+    def compileUnaryOp(self, node):
+        self.compile(node.operand)
+        self.vm_writer.writeArithmetic(self.UNARY_OPERATORS[node.op])
+
+    def compileGroup(self, node):
+        self.compile(node.expression)
+
+    def compileIntConstant(self, node):
+        self.vm_writer.writePush("constant", node.value)
+
+    def compileStringConstant(self, node):
+        """
+        With pool_strings each literal is built the first time it runs and
+        kept in a static slot after the class's own statics, so later runs
+        are a push static and every run gets the same String. Past
+        STRING_SLOTS literals they are built every time, as without pooling.
+        """
+        if not self.pool_strings or (node.value not in self.strings and len(self.strings) >= STRING_SLOTS):
+            self.buildString(node.value)
+            return
+        if node.value not in self.strings:
+            self.strings[node.value] = self.symbol_table.varCount(Kind.STATIC) + len(self.strings)
+        index = self.strings[node.value]
+        label = "STRING_READY" + str(self.string_uses)
+        self.string_uses += 1
+        #statics start out 0, a built string never is
+        self.vm_writer.writePush("static", index)
+        self.vm_writer.writeIf(label)
+        self.buildString(node.value)
+        self.vm_writer.writePop("static", index)
+        self.vm_writer.writeLabel(label)
+        self.vm_writer.writePush("static", index)
+
+    def buildString(self, value):
+        self.vm_writer.writePush("constant", len(value))
+        self.vm_writer.writeCall("String.new", 1)
+        for c in value:
+            self.vm_writer.writePush("constant", ord(c))
+            self.vm_writer.writeCall("String.appendChar", 2)
+
+    def compileKeywordConstant(self, node):
+        if node.value == "this":
+            self.vm_writer.writePush("pointer", 0)
         else:
-            subroutine_name = temp_buffer
-            func_name = self.name + "." + subroutine_name
+            self.vm_writer.writePush("constant", 0)
+            if node.value == "true":
+                self.vm_writer.writeArithmetic("not")
+
+    def compileVariable(self, node):
+        var_segment, var_index = self.variable(node.name)
+        if node.index is None:
+            self.vm_writer.writePush(var_segment, var_index)
+        elif self.optimize and node.index.__class__ is IntConstant:
+            self.pointThat(var_segment, var_index)
+            self.vm_writer.writePush("that", node.index.value)
+        else:
+            self.compile(node.index)
+            self.vm_writer.writePush(var_segment, var_index)
+            self.vm_writer.writeArithmetic("add")
+            self.vm_writer.writePop("pointer", 1)
+            self.vm_writer.writePush("that", 0)
+            self.that = None
+
+    def compileCall(self, node):
+        args = 0
+        if node.receiver is None:
+            func_name = self.name + "." + node.name
             self.vm_writer.writePush("pointer", 0)
             args += 1
-        self.next()
-        args += self.compileExpressionList()
-        self.next()
+        elif self.symbol_table.inTable(node.receiver):
+            self.vm_writer.writePush(self.SEGMENTS[self.symbol_table.kindOf(node.receiver)], self.symbol_table.indexOf(node.receiver))
+            func_name = self.symbol_table.typeOf(node.receiver) + "." + node.name
+            args += 1
+        else:
+            func_name = node.receiver + "." + node.name
+        for arg in node.args:
+            self.compile(arg)
+        args += len(node.args)
 
         self.vm_writer.writeCall(func_name, args)
+        #the callee restores that, but it may have changed a static or field it came from
+        if self.that is not None and self.that[0] in ("static", "this"):
+            self.that = None
 
 class SymbolTable:
     def __init__(self):
@@ -595,11 +629,25 @@ class SymbolTable:
         return (name in self.subroutine_scope or name in self.class_scope)
 
 class VMWriter:
-    def __init__(self, output_file_name):
-        self.output_file = open(output_file_name, "w")
+    def __init__(self, output_file, flush_threshold=4096):
+        """
+        Output lines are collected in a buffer and written to output_file
+        in chunks of flush_threshold lines.
+        """
+        self.output_file = output_file
+        self.flush_threshold = flush_threshold
+        self.buffer = []
 
     def write(self, line):
-        self.output_file.write(line + '\n')
+        self.buffer.append(line)
+        if len(self.buffer) >= self.flush_threshold:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append("")
+            self.output_file.write('\n'.join(self.buffer))
+            self.buffer = []
 
     def writePush(self, segment, index):
         self.write("push " + segment + " " + str(index))
@@ -628,27 +676,113 @@ class VMWriter:
     def writeReturn(self):
         self.write("return")
 
-    def close(self):
-        self.output_file.close()
-
-arg_parser = argparse.ArgumentParser()
-arg_parser.add_argument("source")
-args = arg_parser.parse_args()
+def compileFile(source, output_file, xml=False, optimize=True, debug=False, pool_strings=False):
+    """
+    Parses source once and writes its VM code to output_file, plus the
+    parse tree as XML next to the source when xml is set. With debug the
+    code of each statement is preceded by its Jack line. Returns the tree.
+    """
+    class_node = parseFile(source)
+    if xml:
+        jacksyntax.CompilationEngine(class_node, source[:-5] + "C.xml")
+    if optimize:
+        class_node = ConstantFolder().compile(class_node)
+    CompilationEngine(class_node, VMWriter(output_file), SymbolTable(), optimize, debug, pool_strings)
+    return class_node
+
+def catchErrors(function, *args):
+    """
+    Calls function(*args) and returns its result with None, or None with an
+    error message. Errors the parser prints before exiting become the message.
+    """
+    messages = io.StringIO()
+    try:
+        with redirect_stdout(messages):
+            return function(*args), None
+    except SystemExit:
+        return None, messages.getvalue().strip() or "compilation stopped"
+    except Exception as e:
+        return None, e.__class__.__name__ + ": " + str(e)
+
+def compileSource(source, xml=False, optimize=True, debug=False, pool_strings=False):
+    """
+    Compiles one .jack file, returning its VM code, an error message (None
+    if it compiled) and the seconds it took.
+    """
+    start = time.perf_counter()
+    output = io.StringIO()
+    class_node, error = catchErrors(compileFile, source, output, xml, optimize, debug, pool_strings)
+    return output.getvalue(), error, time.perf_counter() - start
+
+def compileAll(sources, jobs, xml=False, optimize=True, debug=False, pool_strings=False):
+    if jobs > 1 and len(sources) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(compileSource, sources, repeat(xml), repeat(optimize), repeat(debug), repeat(pool_strings)))
+    return [compileSource(s, xml, optimize, debug, pool_strings) for s in sources]
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("source")
+    arg_parser.add_argument("-o", "--output", help="write all classes to one file, or - for stdout")
+    arg_parser.add_argument("--xml", action="store_true", help="also write each class's parse tree as XML")
+    arg_parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="number of worker processes")
+    arg_parser.add_argument("--no-optimize", action="store_true", help="skip constant folding and inline multiplies")
+    arg_parser.add_argument("--pool-strings", action="store_true", help="keep up to " + str(STRING_SLOTS) + " string literals per class in static slots once built; every use of a literal then gets the same String, so the program must not dispose or change one, and the statics must still fit")
+    arg_parser.add_argument("-g", "--debug", action="store_true", help="mark the code of each statement with its Jack line, for vmtranslator2 --debug")
+    arg_parser.add_argument("--timings", action="store_true", help="print the compile time of each file")
+    arg_parser.add_argument("--profile", nargs="?", const="-", metavar="FILE", help="time each phase and count allocations, printing the report or writing it to FILE as JSON")
+    args = arg_parser.parse_args()
+
+    profiler = None
+    if args.profile is not None:
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "13"))
+        from instrument import Profiler
+        import jacktokenizer
+        import jackparser
+        profiler = Profiler()
+        profiler.wrap(jacktokenizer, "tokenize", "tokenize", "tokens", lambda result, args: len(result))
+        profiler.wrap(jackparser.JackParser, "parseClass", "parse")
+        profiler.wrap(ConstantFolder, "compileClass", "fold constants")
+        profiler.wrap(CompilationEngine, "compileClass", "code generation")
+        profiler.wrap(CompilationEngine, "variable", "symbol resolution")
+        profiler.wrap(SymbolTable, "define", "symbol resolution")
+        profiler.wrap(VMWriter, "flush", "write")
+        profiler.wrap(sys.modules[__name__], "compileFile", "compile", "VM commands", lambda result, args: args[1].getvalue().count("\n"))
+        #the wrapped methods only exist in this process
+        args.jobs = 1
+
+    sources = []
+    if os.path.isdir(args.source):
+        sources = sorted(os.path.join(args.source, f) for f in os.listdir(args.source) if os.path.isfile(os.path.join(args.source, f)) and f.endswith('.jack'))
+    else:
+        if args.source.endswith('.jack'):
+            sources.append(args.source)
+        else:
+            print("Wrong File Extension")
+            exit()
 
-output_file = ""
+    results = compileAll(sources, args.jobs, args.xml, not args.no_optimize, args.debug, args.pool_strings)
 
-sources = []
-if os.path.isdir(args.source):
-    sources = [os.path.join(args.source, f) for f in os.listdir(args.source) if os.path.isfile(os.path.join(args.source, f)) and f.endswith('.jack')]
-else:
-    if args.source.endswith('.jack'):
-        sources.append(args.source)
+    if args.output is not None:
+        with (nullcontext(sys.stdout) if args.output == "-" else open(args.output, "w")) as f:
+            for code, error, seconds in results:
+                if error is None:
+                    f.write(code)
     else:
-        print("Wrong File Extension")
-        exit()
-
-for s in sources:
-    tokenizer = JackTokenizer(s)
-    vm_writer = VMWriter(s[0:-5] + ".vm")
-    symbol_table = SymbolTable()
-    compilation_engine = CompilationEngine(tokenizer, vm_writer, symbol_table)
+        for s, (code, error, seconds) in zip(sources, results):
+            if error is None:
+                with open(s[0:-5] + ".vm", "w") as f:
+                    f.write(code)
+
+    failed = 0
+    for s, (code, error, seconds) in zip(sources, results):
+        if error is not None:
+            failed += 1
+            print(s + ": " + error, file=sys.stderr)
+        if args.timings:
+            print("%8.1f ms  %s" % (seconds * 1000, s), file=sys.stderr)
+    if profiler is not None:
+        profiler.write(args.profile)
+    if failed:
+        print(str(failed) + " of " + str(len(sources)) + " files failed to compile", file=sys.stderr)
+        exit(1)
@@ -0,0 +1,138 @@
+import argparse
+import heapq
+import itertools
+from emulator import RAM_SIZE, decode, readHack, signed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class BatchEmulator:
+    """
+    n Hack machines running one ROM, for sweeping a program over many
+    inputs. ram is an n x 32K array and pc, a, d and cycles hold one entry
+    per machine. Machines at the same pc form a group and execute each
+    instruction together as one NumPy operation; a jump some of them take
+    splits the group, and machines that reach the same pc again merge.
+    """
+    def __init__(self, words, n):
+        if np is None:
+            print("BatchEmulator needs numpy")
+            exit()
+        self.rom = [decode(word) for word in words]
+        self.n = n
+        self.ram = np.zeros((n, RAM_SIZE), dtype=np.uint16)
+        self.pc = np.zeros(n, dtype=np.int64)
+        self.a = np.zeros(n, dtype=np.int64)
+        self.d = np.zeros(n, dtype=np.int64)
+        self.cycles = np.zeros(n, dtype=np.int64)
+        #instructions executed by all the groups together, for throughput
+        self.steps = 0
+
+    def run(self, max_cycles, halt=None):
+        """
+        Runs every machine until it has executed max_cycles instructions,
+        its pc reaches halt or leaves the ROM. The group with the lowest pc
+        always goes next, so machines that took a loop fewer times wait
+        after it for the others and carry on together. Returns cycles.
+        """
+        rom = self.rom
+        ram = self.ram
+        size = len(rom)
+        groups = {}
+        for pc in np.unique(self.pc):
+            groups[int(pc)] = np.flatnonzero(self.pc == pc)
+        heap = list(groups)
+        heapq.heapify(heap)
+        while heap:
+            pc = heapq.heappop(heap)
+            members = groups.pop(pc)
+            if pc == halt or pc >= size:
+                continue
+            members = members[self.cycles[members] < max_cycles]
+            if len(members) == 0:
+                continue
+            self.cycles[members] += 1
+            self.steps += 1
+            instruction = rom[pc]
+            if instruction.__class__ is int:
+                self.a[members] = instruction
+                self.pc[members] = pc + 1
+                self.join(groups, heap, pc + 1, members)
+                continue
+            comp, reads_m, dest_a, dest_d, dest_m, jump = instruction
+            a = self.a[members]
+            m = ram[members, a & 0x7FFF] if reads_m else 0
+            value = np.broadcast_to(np.asarray(comp(a, self.d[members], m)) & 0xFFFF, members.shape)
+            if dest_m:
+                ram[members, a & 0x7FFF] = value
+            if dest_a:
+                a = value
+                self.a[members] = value
+            if dest_d:
+                self.d[members] = value
+            if not jump:
+                self.pc[members] = pc + 1
+                self.join(groups, heap, pc + 1, members)
+                continue
+            negative = (value & 0x8000) != 0
+            zero = value == 0
+            taken = np.zeros(members.shape, dtype=bool)
+            if jump & 4:
+                taken |= negative
+            if jump & 2:
+                taken |= zero
+            if jump & 1:
+                taken |= ~negative & ~zero
+            targets = np.where(taken, a & 0x7FFF, pc + 1)
+            self.pc[members] = targets
+            if targets.min() == targets.max():
+                self.join(groups, heap, int(targets[0]), members)
+            else:
+                for target in np.unique(targets):
+                    self.join(groups, heap, int(target), members[targets == target])
+        return self.cycles
+
+    def join(self, groups, heap, pc, members):
+        if pc in groups:
+            groups[pc] = np.concatenate((groups[pc], members))
+        else:
+            groups[pc] = members
+            heapq.heappush(heap, pc)
+
+def parseValues(values):
+    """
+    Reads a --sweep value list, e.g. 1,5,9 or 0:100 for 0 to 99
+    """
+    if ":" in values:
+        start, stop = values.split(":")
+        return list(range(int(start), int(stop)))
+    return [int(v) for v in values.split(",")]
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run a .hack program once for every combination of RAM inputs, all machines in lockstep")
+    arg_parser.add_argument("file", help=".hack file")
+    arg_parser.add_argument("--sweep", action="append", default=[], metavar="ADDRESS=VALUES", help="values to try for a RAM word, as 1,5,9 or 0:100; every combination gets a machine")
+    arg_parser.add_argument("-c", "--cycles", type=int, default=1000000, help="instructions each machine runs at most")
+    arg_parser.add_argument("--halt", type=int, help="stop a machine when its pc reaches this address")
+    arg_parser.add_argument("--show", action="append", default=[], metavar="ADDRESS", help="RAM word to print for each machine afterwards")
+    args = arg_parser.parse_args()
+
+    addresses = []
+    value_lists = []
+    for sweep in args.sweep:
+        address, values = sweep.split("=")
+        addresses.append(int(address))
+        value_lists.append(parseValues(values))
+    inputs = list(itertools.product(*value_lists))
+
+    emulator = BatchEmulator(readHack(args.file), len(inputs))
+    for i, values in enumerate(inputs):
+        for address, value in zip(addresses, values):
+            emulator.ram[i, address] = value & 0xFFFF
+    emulator.run(args.cycles, args.halt)
+    for i, values in enumerate(inputs):
+        print(" ".join("RAM[%d]=%d" % (address, value) for address, value in zip(addresses, values)) + "  ->  " +
+                " ".join("RAM[%s]=%d" % (show, signed(int(emulator.ram[i, int(show)]))) for show in args.show) + "  (%d cycles)" % emulator.cycles[i])
+    print("%d machines, %d cycles in all, %d group steps" % (len(inputs), int(emulator.cycles.sum()), emulator.steps))
@@ -0,0 +1,187 @@
+import argparse
+import datetime
+import gc
+import hashlib
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for tool in ("06", "08", "11", "13"):
+    sys.path.insert(0, os.path.join(TOOLS, tool))
+import assembler
+import vmtranslator2
+import jackcompiler
+from emulator import Emulator
+
+PROGRAMS = ["Average", "Seven", "ConvertToBin", "Square", "ComplexArrays", "Pong"]
+#RAM set before running, for programs that read their input from memory
+INPUTS = {"ConvertToBin": {8000: 23100}}
+#metrics that change from run to run, compared with the tolerance; the rest must not grow at all
+NOISY = frozenset(["seconds", "peak_bytes"])
+#time differences smaller than this are noise whatever the tolerance says
+MIN_SECONDS = 0.005
+
+def measure(repeat, function, *args):
+    """
+    Times function over repeat runs, keeping the fastest, then runs it
+    once more under tracemalloc for peak memory, which would skew the
+    time. Returns the result, the seconds and the peak bytes.
+    """
+    seconds = None
+    for i in range(repeat):
+        #a collection landing in one run but not another is most of the noise
+        gc.collect()
+        gc.disable()
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        gc.enable()
+        if seconds is None or elapsed < seconds:
+            seconds = elapsed
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, seconds, peak
+
+def compileStage(jack_files):
+    results = jackcompiler.compileAll(jack_files, 1)
+    for source, (code, error, seconds) in zip(jack_files, results):
+        if error is not None:
+            print(source + ": " + error)
+            exit(1)
+    return [code for code, error, seconds in results]
+
+def translateStage(vm_files):
+    """
+    Translates the files the way vmtranslator2 --shared-calls lays out a
+    directory, the only way ComplexArrays and Pong fit the ROM with the OS
+    """
+    chunks = vmtranslator2.translateAll(vm_files, 1, shared_calls=True)
+    asm = [chunk for chunk, report, uses_runtime in chunks]
+    if len(vm_files) > 1:
+        asm.insert(0, vmtranslator2.bootstrapCode(shared_calls=True))
+    if len(vm_files) > 1 or any(uses_runtime for chunk, report, uses_runtime in chunks):
+        asm.append(vmtranslator2.runtimeCode())
+    return ''.join(asm)
+
+def assembleStage(asm):
+    chunk = assembler.AsmChunk(asm.split('\n'))
+    return chunk, assembler.link([chunk])
+
+def benchmark(name, cycles, repeat):
+    """
+    Takes one program in 11/ through every stage, returning its metrics
+    """
+    program_dir = os.path.join(TOOLS, "11", name)
+    os_dir = os.path.join(TOOLS, "11", "OS")
+    jack_files = sorted(os.path.join(program_dir, f) for f in os.listdir(program_dir) if f.endswith(".jack"))
+    with tempfile.TemporaryDirectory() as build_dir:
+        vm_files = []
+        codes, compile_seconds, compile_peak = measure(repeat, compileStage, jack_files)
+        for source, code in zip(jack_files, codes):
+            vm_file = os.path.join(build_dir, os.path.basename(source)[:-5] + ".vm")
+            with open(vm_file, "w") as f:
+                f.write(code)
+            vm_files.append(vm_file)
+        classes = set(os.path.basename(f) for f in vm_files)
+        vm_files += [os.path.join(os_dir, f) for f in os.listdir(os_dir) if f.endswith(".vm") and f not in classes]
+        vm_files.sort(key=os.path.basename)
+        asm, translate_seconds, translate_peak = measure(repeat, translateStage, vm_files)
+    (chunk, words), assemble_seconds, assemble_peak = measure(repeat, assembleStage, asm)
+
+    emulator = Emulator(words)
+    for address, value in INPUTS.get(name, {}).items():
+        emulator.ram[address] = value
+    gc.collect()
+    gc.disable()
+    start = time.perf_counter()
+    ran = emulator.run(cycles, chunk.labels.get("Sys.halt"))
+    run_seconds = time.perf_counter() - start
+    gc.enable()
+
+    return {"compile": {"seconds": compile_seconds, "peak_bytes": compile_peak, "vm_bytes": sum(len(code) for code in codes)},
+            "translate": {"seconds": translate_seconds, "peak_bytes": translate_peak, "instructions": vmtranslator2.instructionCount([l for l in asm.split('\n') if l and not l.startswith("//")])},
+            "assemble": {"seconds": assemble_seconds, "peak_bytes": assemble_peak, "words": len(words)},
+            "run": {"seconds": run_seconds, "cycles": ran, "halted": emulator.pc == chunk.labels.get("Sys.halt"),
+                    "screen": hashlib.md5(str(emulator.screen()).encode()).hexdigest()}}
+
+def compare(results, baseline, tolerance):
+    """
+    Prints each metric next to the baseline and returns the regressions
+    """
+    regressions = []
+    for name, stages in results.items():
+        if name not in baseline:
+            continue
+        for stage, metrics in stages.items():
+            for metric, value in metrics.items():
+                old = baseline[name].get(stage, {}).get(metric)
+                if old is None:
+                    continue
+                label = name + " " + stage + " " + metric
+                if metric == "screen" or metric == "halted":
+                    if value != old:
+                        print("%-40s changed" % label)
+                        regressions.append(label + " changed")
+                    continue
+                change = (value - old) / old if old else 0.0
+                limit = tolerance if metric in NOISY else 0.0
+                flag = ""
+                if value > old * (1 + limit) and value > old and not (metric == "seconds" and value - old < MIN_SECONDS):
+                    flag = "  REGRESSION"
+                    regressions.append(label + " %+.1f%%" % (change * 100))
+                print("%-40s %14.4f %14.4f %+8.1f%%%s" % (label, old, value, change * 100, flag))
+    return regressions
+
+def readJSON(path, default):
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def writeJSON(path, value):
+    with open(path, "w") as f:
+        json.dump(value, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Time every stage of the sample programs in 11/ and run them, comparing against a baseline")
+    arg_parser.add_argument("programs", nargs="*", default=PROGRAMS, help="programs in 11/ to run, all of them by default")
+    arg_parser.add_argument("-c", "--cycles", type=int, default=5000000, help="instructions to run each program for, unless it halts first")
+    arg_parser.add_argument("-r", "--repeat", type=int, default=3, help="times each stage is run, the fastest counts")
+    arg_parser.add_argument("--history", default="benchmark_history.json", help="JSON file each run is appended to")
+    arg_parser.add_argument("--baseline", default="benchmark_baseline.json", help="JSON file of the results to compare against")
+    arg_parser.add_argument("--save-baseline", action="store_true", help="make this run the new baseline")
+    arg_parser.add_argument("-t", "--tolerance", type=float, default=0.10, help="allowed slowdown of times and memory, as a fraction")
+    args = arg_parser.parse_args()
+
+    results = {}
+    for name in args.programs:
+        results[name] = benchmark(name, args.cycles, args.repeat)
+        run = results[name]["run"]
+        print("%-14s %5d words  %9d cycles%s  %.2fs" % (name, results[name]["assemble"]["words"], run["cycles"], " (halted)" if run["halted"] else "",
+                sum(stage["seconds"] for stage in results[name].values())))
+
+    history = readJSON(args.history, [])
+    history.append({"date": datetime.datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(), "cycles": args.cycles, "results": results})
+    writeJSON(args.history, history)
+
+    baseline = readJSON(args.baseline, None)
+    if args.save_baseline or baseline is None:
+        writeJSON(args.baseline, {"cycles": args.cycles, "results": results})
+        print("Saved baseline to " + args.baseline)
+    elif baseline["cycles"] != args.cycles:
+        print("Baseline ran for " + str(baseline["cycles"]) + " cycles, not comparing")
+    else:
+        print()
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(str(len(regressions)) + " regressions: " + ", ".join(regressions))
+            exit(1)
+        print("No regressions")
@@ -0,0 +1,592 @@
+import argparse
+import gzip
+import hashlib
+import math
+import mmap
+import struct
+from array import array
+
+RAM_SIZE = 32768
+SCREEN = 16384
+SCREEN_SIZE = 8192
+KBD = 24576
+#snapshot header: magic, format, pc, a, d, cycles run, md5 of the ROM; the RAM follows as 16 bit words in the machine's byte order
+SNAPSHOT_HEADER = struct.Struct("<8sHHHHQ16s")
+SNAPSHOT_MAGIC = b"HACKSNAP"
+SNAPSHOT_FORMAT = 1
+#trace header: magic, format, instructions kept, cycles run when dumped, md5
+#of the ROM; gzipped together with the instructions, 4 ints each in the
+#machine's byte order
+TRACE_HEADER = struct.Struct("<8sHIQ16s")
+TRACE_MAGIC = b"HACKTRCE"
+TRACE_FORMAT = 1
+#the write field of an instruction that wrote no memory
+NO_WRITE = -1
+
+#comp bits (a c1..c6) -> value from A, D and M, before cutting it to 16 bits
+COMPS = {
+        "0101010": lambda a, d, m: 0,
+        "0111111": lambda a, d, m: 1,
+        "0111010": lambda a, d, m: -1,
+        "0001100": lambda a, d, m: d,
+        "0110000": lambda a, d, m: a,
+        "1110000": lambda a, d, m: m,
+        "0001101": lambda a, d, m: ~d,
+        "0110001": lambda a, d, m: ~a,
+        "1110001": lambda a, d, m: ~m,
+        "0001111": lambda a, d, m: -d,
+        "0110011": lambda a, d, m: -a,
+        "1110011": lambda a, d, m: -m,
+        "0011111": lambda a, d, m: d + 1,
+        "0110111": lambda a, d, m: a + 1,
+        "1110111": lambda a, d, m: m + 1,
+        "0001110": lambda a, d, m: d - 1,
+        "0110010": lambda a, d, m: a - 1,
+        "1110010": lambda a, d, m: m - 1,
+        "0000010": lambda a, d, m: d + a,
+        "1000010": lambda a, d, m: d + m,
+        "0010011": lambda a, d, m: d - a,
+        "1010011": lambda a, d, m: d - m,
+        "0000111": lambda a, d, m: a - d,
+        "1000111": lambda a, d, m: m - d,
+        "0000000": lambda a, d, m: d & a,
+        "1000000": lambda a, d, m: d & m,
+        "0010101": lambda a, d, m: d | a,
+        "1010101": lambda a, d, m: d | m
+        }
+
+def signed(word):
+    """
+    Reads a 16 bit word as a signed number
+    """
+    return word - 0x10000 if word & 0x8000 else word
+
+def decode(word):
+    """
+    Turns one line of a .hack file into what run() executes: the value for
+    an A-instruction, or (comp, reads M, dest A, dest D, dest M, jump bits)
+    """
+    if word[0] == '0':
+        return int(word, 2)
+    comp = word[3:10]
+    if comp not in COMPS:
+        print("Unknown instruction " + word)
+        exit()
+    return (COMPS[comp], word[3] == '1', word[10] == '1', word[11] == '1', word[12] == '1', int(word[13:], 2))
+
+def readHack(hack_file):
+    with open(hack_file) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def readMap(map_file):
+    """
+    Reads the assembler's --map output, returning the fields of each ROM
+    address: its .asm line, then the //@ fields such as VM line, function
+    and Jack line
+    """
+    with open(map_file) as f:
+        return [line.split()[1:] for line in f]
+
+def hotSpots(counts, rows):
+    """
+    Adds up the cycles spent at each address by source line and by
+    function. A line is the Jack one where the map has it, else the VM
+    one, else the .asm one. Returns both as (cycles, name) lists, the
+    hottest first.
+    """
+    lines = {}
+    functions = {}
+    for address, n in enumerate(counts):
+        if n == 0:
+            continue
+        fields = rows[address] if address < len(rows) else ["?"]
+        locations = [field for field in fields if ":" in field]
+        names = [field for field in fields if ":" not in field]
+        line = locations[0] if locations else "?"
+        for extension in (".vm:", ".jack:"):
+            line = next((l for l in locations if extension in l), line)
+        function = names[0] if names else "?"
+        lines[line] = lines.get(line, 0) + n
+        functions[function] = functions.get(function, 0) + n
+    return (sorted(((n, line) for line, n in lines.items()), reverse=True),
+            sorted(((n, function) for function, n in functions.items()), reverse=True))
+
+def readSymbols(symbols_file):
+    """
+    Reads the assembler's --symbols output into a dict of name -> address
+    """
+    symbols = {}
+    with open(symbols_file) as f:
+        for line in f:
+            name, address = line.split()
+            symbols[name] = int(address)
+    return symbols
+
+#native versions of the 11/OS functions, given RAM, the signed arguments
+#and the symbols; None means do what the ROM does, e.g. to report an error
+def mathMultiply(ram, args, symbols):
+    return args[0] * args[1]
+
+def mathDivide(ram, args, symbols):
+    x, y = args
+    #the OS takes Math.abs of both, which leaves -32768 negative
+    if y == 0 or x == -32768 or y == -32768:
+        return None
+    q = abs(x) // abs(y)
+    return -q if (x < 0) != (y < 0) else q
+
+def mathSqrt(ram, args, symbols):
+    if args[0] < 0:
+        return None
+    return math.isqrt(args[0])
+
+def mathAbs(ram, args, symbols):
+    return -args[0] if args[0] < 0 else args[0]
+
+def less(x, y):
+    """
+    The VM's lt, which tests the sign of the 16 bit difference and so is
+    wrong when it overflows; the OS's min and max inherit that
+    """
+    return signed((x - y) & 0xFFFF) < 0
+
+def mathMin(ram, args, symbols):
+    return args[0] if less(args[0], args[1]) else args[1]
+
+def mathMax(ram, args, symbols):
+    return args[1] if less(args[0], args[1]) else args[0]
+
+def memoryPeek(ram, args, symbols):
+    return ram[args[0] & 0x7FFF]
+
+def memoryPoke(ram, args, symbols):
+    ram[args[0] & 0x7FFF] = args[1] & 0xFFFF
+    return 0
+
+def sysWait(ram, args, symbols):
+    #only burns cycles
+    if args[0] < 0:
+        return None
+    return 0
+
+def screenClearScreen(ram, args, symbols):
+    ram[SCREEN:SCREEN + SCREEN_SIZE] = [0] * SCREEN_SIZE
+    return 0
+
+def screenDrawRectangle(ram, args, symbols):
+    x1, y1, x2, y2 = args
+    if x1 > x2 or y1 > y2 or x1 < 0 or x2 > 511 or y1 < 0 or y2 > 255 or "Screen.2" not in symbols:
+        return None
+    #Screen's static 2 is the color, nonzero for black
+    black = ram[symbols["Screen.2"]] != 0
+    for y in range(y1, y2 + 1):
+        row = SCREEN + 32 * y
+        for word in range(x1 // 16, x2 // 16 + 1):
+            low = max(x1, 16 * word) - 16 * word
+            high = min(x2, 16 * word + 15) - 16 * word
+            bits = ((1 << (high + 1)) - 1) & ~((1 << low) - 1)
+            if black:
+                ram[row + word] |= bits
+            else:
+                ram[row + word] &= ~bits & 0xFFFF
+    return 0
+
+#function -> (arguments, native version)
+INTRINSICS = {"Math.multiply": (2, mathMultiply),
+        "Math.divide": (2, mathDivide),
+        "Math.sqrt": (1, mathSqrt),
+        "Math.abs": (1, mathAbs),
+        "Math.min": (2, mathMin),
+        "Math.max": (2, mathMax),
+        "Memory.peek": (1, memoryPeek),
+        "Memory.poke": (2, memoryPoke),
+        "Sys.wait": (1, sysWait),
+        "Screen.clearScreen": (0, screenClearScreen),
+        "Screen.drawRectangle": (4, screenDrawRectangle)}
+
+def intrinsicHook(arguments, native, symbols):
+    """
+    Returns the hook run() calls on jumping to a function's entry: it runs
+    native on the arguments in the frame Runtime$call built, then returns
+    the way Runtime$return does and gives the return address, or None to
+    run the ROM's code after all
+    """
+    def hook(ram):
+        arg = ram[2]
+        result = native(ram, [signed(ram[(arg + i) & 0x7FFF]) for i in range(arguments)], symbols)
+        if result is None:
+            return None
+        lcl = ram[1]
+        ret = ram[lcl - 5]
+        ram[arg] = result & 0xFFFF
+        ram[0] = arg + 1
+        ram[4] = ram[lcl - 1]
+        ram[3] = ram[lcl - 2]
+        ram[2] = ram[lcl - 3]
+        ram[1] = ram[lcl - 4]
+        ram[14] = ret
+        return ret
+    return hook
+
+def entryAddress(rows, function):
+    """
+    Returns the first ROM address of function according to a --map, or
+    None if the map never mentions it
+    """
+    for address, fields in enumerate(rows):
+        if function in fields:
+            return address
+
+class Trace:
+    """
+    Ring buffer of the last size instructions executed, each stored as
+    four ints in one flat array: pc, A and D afterwards, and the memory
+    write as address << 16 | value, or NO_WRITE. Filled by
+    Emulator.runTraced().
+    """
+    def __init__(self, size):
+        self.size = size
+        self.entries = array("i", [0]) * (4 * size)
+        #slot the next instruction goes in
+        self.position = 0
+        #instructions recorded in all, kept or overwritten
+        self.recorded = 0
+
+    def last(self):
+        """
+        Returns the instructions kept as (pc, a, d, write) tuples, oldest first
+        """
+        kept = min(self.recorded, self.size)
+        entries = self.entries
+        tuples = []
+        for i in range(self.position - kept, self.position):
+            j = 4 * (i % self.size)
+            tuples.append((entries[j], entries[j + 1], entries[j + 2], entries[j + 3]))
+        return tuples
+
+    def dump(self, trace_file, emulator):
+        """
+        Writes the instructions kept, oldest first, to a gzipped file
+        """
+        kept = min(self.recorded, self.size)
+        start = 4 * ((self.position - kept) % self.size)
+        end = 4 * self.position
+        entries = self.entries[start:] + self.entries[:end] if kept and start >= end else self.entries[start:end]
+        with gzip.open(trace_file, "wb") as f:
+            f.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_FORMAT, kept, emulator.cycles, emulator.rom_hash))
+            f.write(entries.tobytes())
+
+def readTrace(trace_file):
+    """
+    Reads a file written by Trace.dump(), returning the cycles run when it
+    was dumped, the md5 of the ROM and the (pc, a, d, write) tuples
+    """
+    with gzip.open(trace_file, "rb") as f:
+        data = f.read()
+    if len(data) < TRACE_HEADER.size:
+        print("Not a trace: " + trace_file)
+        exit()
+    magic, version, kept, cycles, rom_hash = TRACE_HEADER.unpack_from(data)
+    if magic != TRACE_MAGIC or version != TRACE_FORMAT or len(data) != TRACE_HEADER.size + 16 * kept:
+        print("Not a trace: " + trace_file)
+        exit()
+    entries = array("i")
+    entries.frombytes(data[TRACE_HEADER.size:])
+    return cycles, rom_hash, [tuple(entries[i:i + 4]) for i in range(0, len(entries), 4)]
+
+class Emulator:
+    """
+    Hack CPU with 32K words of RAM. The screen and keyboard are the RAM
+    from SCREEN and at KBD, words are kept unsigned.
+    """
+    def __init__(self, words):
+        self.rom = [decode(word) for word in words]
+        self.rom_hash = hashlib.md5('\n'.join(words).encode()).digest()
+        self.ram = [0] * RAM_SIZE
+        self.pc = 0
+        self.a = 0
+        self.d = 0
+        self.cycles = 0
+        #function entry -> intrinsicHook() run instead of jumping there
+        self.hooks = {}
+        #address whose watchpoint stopped runTraced()
+        self.watched = None
+
+    def useIntrinsics(self, symbols, names=None):
+        """
+        Runs the OS functions in names, all of INTRINSICS by default, in
+        Python instead of Hack. Cycle counts and scratch memory then differ
+        from a real run. A function is skipped when the program lacks it or
+        another label shares its entry, since jumps there would be taken
+        for calls. Returns the names hooked.
+        """
+        labels = {}
+        for name, address in symbols.items():
+            labels[address] = labels.get(address, 0) + 1
+        hooked = []
+        for name in (names or INTRINSICS):
+            if name not in INTRINSICS:
+                print("No native version of " + name)
+                exit()
+            address = symbols.get(name)
+            if address is None or labels[address] > 1:
+                continue
+            arguments, native = INTRINSICS[name]
+            self.hooks[address] = intrinsicHook(arguments, native, symbols)
+            hooked.append(name)
+        return hooked
+
+    def run(self, max_cycles, halt=None, counts=None):
+        """
+        Executes up to max_cycles instructions, stopping early when the pc
+        reaches halt or leaves the ROM. Returns the number executed. counts,
+        a list as long as the ROM, gets the times each address ran added.
+        """
+        rom = self.rom
+        ram = self.ram
+        hooks = self.hooks
+        size = len(rom)
+        pc = self.pc
+        a = self.a
+        d = self.d
+        n = 0
+        while n < max_cycles and pc != halt and pc < size:
+            n += 1
+            if counts is not None:
+                counts[pc] += 1
+            instruction = rom[pc]
+            if instruction.__class__ is int:
+                a = instruction
+                pc += 1
+                continue
+            comp, reads_m, dest_a, dest_d, dest_m, jump = instruction
+            value = comp(a, d, ram[a & 0x7FFF] if reads_m else 0) & 0xFFFF
+            if dest_m:
+                ram[a & 0x7FFF] = value
+            if dest_a:
+                a = value
+            if dest_d:
+                d = value
+            #jump bits are less than zero, zero, greater than zero
+            if jump and ((jump & 4 and value & 0x8000) or (jump & 2 and value == 0) or (jump & 1 and value and not value & 0x8000)):
+                pc = a & 0x7FFF
+                if pc in hooks:
+                    ret = hooks[pc](ram)
+                    if ret is not None:
+                        pc = a = ret
+            else:
+                pc += 1
+        self.pc = pc
+        self.a = a
+        self.d = d
+        self.cycles += n
+        return n
+
+    def runTraced(self, max_cycles, trace, halt=None, watches=None):
+        """
+        run() recording every instruction in trace. It is a loop of its
+        own so that run() pays nothing for tracing. watches maps RAM
+        addresses to a value, or None for any; writing a watched address
+        stops the run and leaves the address in self.watched. Writes made
+        by intrinsics are not recorded.
+        """
+        rom = self.rom
+        ram = self.ram
+        hooks = self.hooks
+        watches = watches or {}
+        entries = trace.entries
+        end = 4 * trace.size
+        i = 4 * trace.position
+        size = len(rom)
+        pc = self.pc
+        a = self.a
+        d = self.d
+        n = 0
+        watched = None
+        try:
+            while n < max_cycles and pc != halt and pc < size:
+                entries[i] = pc
+                instruction = rom[pc]
+                if instruction.__class__ is int:
+                    a = instruction
+                    pc += 1
+                    entries[i + 1] = a
+                    entries[i + 2] = d
+                    entries[i + 3] = NO_WRITE
+                    i += 4
+                    if i == end:
+                        i = 0
+                    n += 1
+                    continue
+                comp, reads_m, dest_a, dest_d, dest_m, jump = instruction
+                value = comp(a, d, ram[a & 0x7FFF] if reads_m else 0) & 0xFFFF
+                write = NO_WRITE
+                if dest_m:
+                    address = a & 0x7FFF
+                    ram[address] = value
+                    write = address << 16 | value
+                    if address in watches and watches[address] in (None, value):
+                        watched = address
+                if dest_a:
+                    a = value
+                if dest_d:
+                    d = value
+                if jump and ((jump & 4 and value & 0x8000) or (jump & 2 and value == 0) or (jump & 1 and value and not value & 0x8000)):
+                    pc = a & 0x7FFF
+                    if pc in hooks:
+                        ret = hooks[pc](ram)
+                        if ret is not None:
+                            pc = a = ret
+                else:
+                    pc += 1
+                entries[i + 1] = a
+                entries[i + 2] = d
+                entries[i + 3] = write
+                i += 4
+                if i == end:
+                    i = 0
+                #counted once recorded, so an interrupted instruction is neither
+                n += 1
+                if watched is not None:
+                    break
+        finally:
+            #also reached on Ctrl-C, so the trace can still be dumped
+            self.pc = pc
+            self.a = a
+            self.d = d
+            self.cycles += n
+            self.watched = watched
+            trace.position = i // 4
+            trace.recorded += n
+        return n
+
+    def save(self, snapshot_file):
+        """
+        Writes RAM, pc, A and D to snapshot_file, 64K of RAM behind a short
+        header, so a run can later restart from here
+        """
+        with open(snapshot_file, "wb") as f:
+            f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_FORMAT, self.pc, self.a, self.d, self.cycles, self.rom_hash))
+            f.write(array("H", self.ram).tobytes())
+
+    def restore(self, snapshot_file):
+        """
+        Loads a snapshot written by save() for the same ROM. The file is
+        memory mapped and its RAM copied straight out of the mapping, so
+        tests can each start from a snapshot taken after Sys.init instead
+        of booting the OS.
+        """
+        with open(snapshot_file, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if len(m) != SNAPSHOT_HEADER.size + 2 * RAM_SIZE:
+                    print("Not a snapshot: " + snapshot_file)
+                    exit()
+                magic, version, pc, a, d, cycles, rom_hash = SNAPSHOT_HEADER.unpack_from(m)
+                if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_FORMAT:
+                    print("Not a snapshot: " + snapshot_file)
+                    exit()
+                if rom_hash != self.rom_hash:
+                    print("Snapshot " + snapshot_file + " was taken with a different program")
+                    exit()
+                view = memoryview(m)[SNAPSHOT_HEADER.size:].cast("H")
+                self.ram = view.tolist()
+                view.release()
+        self.pc = pc
+        self.a = a
+        self.d = d
+        self.cycles = cycles
+
+    def screen(self):
+        return self.ram[SCREEN:SCREEN + SCREEN_SIZE]
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run a .hack program and print RAM afterwards")
+    arg_parser.add_argument("file", help=".hack file")
+    arg_parser.add_argument("-c", "--cycles", type=int, default=1000000, help="instructions to run at most")
+    arg_parser.add_argument("--halt", type=int, help="stop when the pc reaches this address")
+    arg_parser.add_argument("--set", action="append", default=[], metavar="ADDRESS=VALUE", help="set a RAM word before running")
+    arg_parser.add_argument("--restore", metavar="SNAPSHOT", help="start from a snapshot saved by --save-at instead of from reset")
+    arg_parser.add_argument("--save-at", metavar="ADDRESS|FUNCTION", help="run until the pc reaches this address, or the entry of this function according to --map, and save a snapshot there")
+    arg_parser.add_argument("--snapshot", metavar="FILE", help="file --save-at writes, next to the .hack file by default")
+    arg_parser.add_argument("--intrinsics", nargs="?", const="", metavar="FUNCTIONS", help="run OS functions natively, all of " + ", ".join(INTRINSICS) + " by default or a comma separated list of them")
+    arg_parser.add_argument("--symbols", metavar="FILE", help="the assembler's --symbols output, for --intrinsics and --watch; next to the .hack file by default")
+    arg_parser.add_argument("--map", metavar="FILE", help="the assembler's --map output, for --save-at and --profile; next to the .hack file by default")
+    arg_parser.add_argument("--trace", type=int, metavar="N", help="keep the last N instructions, with A, D and the memory written, and dump them when the run ends, a watchpoint triggers or on Ctrl-C; replay with replay.py")
+    arg_parser.add_argument("--trace-file", metavar="FILE", help="file --trace dumps to, next to the .hack file by default")
+    arg_parser.add_argument("--watch", action="append", default=[], metavar="ADDRESS[=VALUE]", help="with --trace, stop when this RAM word, an address or a symbol from --symbols, is written, or written with VALUE")
+    arg_parser.add_argument("--profile", nargs="?", const="", metavar="MAP", help="report the hottest Jack lines and functions, using this map file or the one --map names")
+    arg_parser.add_argument("--top", type=int, default=10, help="lines and functions --profile lists")
+    arg_parser.add_argument("--show", action="append", default=[], metavar="ADDRESS[:COUNT]", help="RAM words to print afterwards")
+    args = arg_parser.parse_args()
+
+    map_file = args.map or args.file[:-5] + ".map"
+    emulator = Emulator(readHack(args.file))
+    if args.restore is not None:
+        emulator.restore(args.restore)
+    if args.intrinsics is not None:
+        emulator.useIntrinsics(readSymbols(args.symbols or args.file[:-5] + ".sym"), args.intrinsics.split(",") if args.intrinsics else None)
+    for assignment in args.set:
+        address, value = assignment.split("=")
+        emulator.ram[int(address)] = int(value) & 0xFFFF
+    counts = None
+    if args.profile is not None:
+        counts = [0] * len(emulator.rom)
+    trace = None
+    watches = {}
+    if args.trace is not None:
+        if counts is not None:
+            print("--trace and --profile can't be used together")
+            exit()
+        trace = Trace(args.trace)
+        for watch in args.watch:
+            address, value = (watch.split("=") + [None])[:2]
+            if not address.isdigit():
+                symbols = readSymbols(args.symbols or args.file[:-5] + ".sym")
+                if address not in symbols:
+                    print("No symbol " + address)
+                    exit()
+                address = symbols[address]
+            watches[int(address)] = None if value is None else int(value) & 0xFFFF
+    elif args.watch:
+        print("--watch needs --trace")
+        exit()
+
+    halt = args.halt
+    if args.save_at is not None:
+        if args.save_at.isdigit():
+            halt = int(args.save_at)
+        else:
+            halt = entryAddress(readMap(map_file), args.save_at)
+            if halt is None:
+                print("No function " + args.save_at + " in the map")
+                exit()
+    if trace is None:
+        emulator.run(args.cycles, halt, counts)
+    else:
+        try:
+            emulator.runTraced(args.cycles, trace, halt, watches)
+        except KeyboardInterrupt:
+            print("Interrupted")
+        trace_file = args.trace_file or args.file[:-5] + ".trace"
+        trace.dump(trace_file, emulator)
+        if emulator.watched is not None:
+            print("Watchpoint: RAM[" + str(emulator.watched) + "] = " + str(signed(emulator.ram[emulator.watched])))
+        print("Dumped the last " + str(min(trace.recorded, trace.size)) + " instructions to " + trace_file)
+    if args.save_at is not None:
+        if emulator.pc != halt:
+            print("Never reached " + args.save_at + " in " + str(args.cycles) + " cycles")
+            exit()
+        snapshot_file = args.snapshot or args.file[:-5] + ".snap"
+        emulator.save(snapshot_file)
+        print("Saved " + snapshot_file)
+    print("pc " + str(emulator.pc) + " after " + str(emulator.cycles) + " cycles")
+    if counts is not None:
+        hot_lines, hot_functions = hotSpots(counts, readMap(args.profile or map_file))
+        for title, hot in (("line", hot_lines), ("function", hot_functions)):
+            print("%10s %6s  %s" % ("cycles", "%", title))
+            for n, name in hot[:args.top]:
+                print("%10d %6.2f  %s" % (n, 100.0 * n / emulator.cycles, name))
+    for show in args.show:
+        address, count = (show.split(":") + ["1"])[:2]
+        for i in range(int(address), int(address) + int(count)):
+            print("RAM[" + str(i) + "] = " + str(signed(emulator.ram[i])))
@@ -0,0 +1,159 @@
+import argparse
+import random
+import sys
+from contextlib import nullcontext
+
+JACK_OPERATORS = ["+", "-", "*", "/", "&", "|"]
+JACK_COMPARISONS = ["<", ">", "="]
+JACK_VARIABLES = ["a", "b", "x", "y"]
+VM_ARITHMETIC = ["add", "sub", "neg", "eq", "gt", "lt", "and", "or", "not"]
+#segment -> indexes a generated function may use
+VM_SEGMENTS = {"local": 4, "argument": 2, "static": 16, "this": 4, "that": 4, "temp": 8, "pointer": 2}
+ASM_COMPUTATIONS = ["D=M", "D=A", "M=D", "M=M+1", "D=D+M", "AM=M-1", "MD=M-1", "D=D-A", "M=D|M", "A=M", "D=!D", "M=-1", "M=0"]
+ASM_JUMPS = ["D;JGT", "D;JEQ", "D;JLT", "D;JNE", "0;JMP"]
+#variables the assembler has to allocate, far fewer than the labels
+ASM_VARIABLES = 200
+
+def jackExpression(rng, depth):
+    """
+    Returns an expression nested depth parentheses deep, growing linearly
+    with depth. Divisors are never the constant 0.
+    """
+    if depth == 0:
+        choice = rng.randrange(4)
+        if choice == 0:
+            return str(rng.randrange(1, 1000))
+        elif choice == 1:
+            return "arr[" + rng.choice(JACK_VARIABLES) + "]"
+        elif choice == 2:
+            return rng.choice(["-", "~"]) + rng.choice(JACK_VARIABLES)
+        return rng.choice(JACK_VARIABLES)
+    operator = rng.choice(JACK_OPERATORS)
+    right = str(rng.randrange(1, 1000)) if operator == "/" else jackExpression(rng, 0)
+    return "(" + jackExpression(rng, depth - 1) + " " + operator + " " + right + ")"
+
+def jackStatement(rng, class_name, function, depth, string_length):
+    condition = jackExpression(rng, depth // 2) + " " + rng.choice(JACK_COMPARISONS) + " " + jackExpression(rng, 0)
+    choice = rng.randrange(6)
+    if choice == 0:
+        return ["let x = " + jackExpression(rng, depth) + ";"]
+    elif choice == 1:
+        return ["let arr[" + jackExpression(rng, depth // 2) + "] = " + jackExpression(rng, depth) + ";"]
+    elif choice == 2:
+        return ["if (" + condition + ") {", "    let y = " + jackExpression(rng, depth) + ";", "} else {", "    let x = y;", "}"]
+    elif choice == 3:
+        return ["while (" + condition + ") {", "    let x = x + 1;", "}"]
+    elif choice == 4:
+        text = ''.join(rng.choice("abcdefghijklmnopqrstuvwxyz ") for i in range(string_length))
+        return ["do Output.printString(\"" + text + "\");"]
+    #calls an earlier function, so the class compiles without forward references mattering
+    return ["let y = " + class_name + ".f" + str(rng.randrange(function + 1)) + "(" + jackExpression(rng, depth // 2) + ", y);"]
+
+def generateJack(functions, statements, depth, string_length, class_name="Big", seed=0):
+    """
+    Returns the source of one valid Jack class with functions functions of
+    statements statements each. Expressions nest up to depth deep, and
+    every printed string literal is string_length characters long.
+    """
+    rng = random.Random(seed)
+    lines = ["class " + class_name + " {", "    static int s;", ""]
+    for function in range(functions):
+        lines.append("    function int f" + str(function) + "(int a, int b) {")
+        lines.append("        var int x, y;")
+        lines.append("        var Array arr;")
+        lines.append("        let arr = Array.new(8);")
+        lines.append("        let x = a;")
+        lines.append("        let y = b;")
+        for i in range(statements):
+            lines += ["        " + line for line in jackStatement(rng, class_name, function, depth, string_length)]
+        lines.append("        return x;")
+        lines.append("    }")
+        lines.append("")
+    lines.append("}")
+    return '\n'.join(lines) + '\n'
+
+def generateVM(functions, commands, labels, class_name="Prog", seed=0, stack_only=False):
+    """
+    Returns a .vm file of functions functions, each with about commands
+    commands of which labels are label declarations with a branch to each.
+    With stack_only there are only push, pop and arithmetic commands, the
+    ones 07/vmtranslator.py translates, and no function, label or call.
+    """
+    rng = random.Random(seed)
+    lines = []
+    for function in range(functions):
+        name = class_name + ".f" + str(function)
+        if not stack_only:
+            lines.append("function " + name + " " + str(VM_SEGMENTS["local"]))
+        every = max(1, commands // max(1, labels))
+        label = 0
+        for i in range(commands):
+            if labels and not stack_only and i % every == 0 and label < labels:
+                lines.append("label L" + str(label))
+                lines.append(rng.choice(["if-goto", "goto"]) + " L" + str(rng.randrange(label + 1)))
+                label += 1
+                continue
+            choice = rng.randrange(4 if stack_only else 5)
+            if choice == 0:
+                lines.append("push constant " + str(rng.randrange(32768)))
+            elif choice == 1:
+                segment = rng.choice(list(VM_SEGMENTS))
+                lines.append("push " + segment + " " + str(rng.randrange(VM_SEGMENTS[segment])))
+            elif choice == 2:
+                segment = rng.choice(list(VM_SEGMENTS))
+                lines.append("pop " + segment + " " + str(rng.randrange(VM_SEGMENTS[segment])))
+            elif choice == 3:
+                lines.append(rng.choice(VM_ARITHMETIC))
+            else:
+                lines.append("call " + class_name + ".f" + str(rng.randrange(functions)) + " " + str(rng.randrange(3)))
+        if not stack_only:
+            lines.append("return")
+    return '\n'.join(lines) + '\n'
+
+def generateAsm(instructions, labels, seed=0):
+    """
+    Returns a .asm file of instructions instructions with labels labels,
+    each jumped to from somewhere in the file
+    """
+    rng = random.Random(seed)
+    lines = []
+    every = max(1, instructions // max(1, labels))
+    label = 0
+    for i in range(instructions):
+        if labels and i % every == 0 and label < labels:
+            lines.append("(L" + str(label) + ")")
+            label += 1
+        choice = rng.randrange(4)
+        if choice == 0:
+            lines.append("@" + str(rng.randrange(32768)))
+        elif choice == 1:
+            lines.append("@v" + str(rng.randrange(ASM_VARIABLES)))
+        elif choice == 2:
+            lines.append("@L" + str(rng.randrange(labels)) if labels else "@SP")
+            lines.append(rng.choice(ASM_JUMPS))
+        else:
+            lines.append(rng.choice(ASM_COMPUTATIONS))
+    return '\n'.join(lines) + '\n'
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Write a large valid .jack, .vm or .asm file for scaling tests; they are not meant to run")
+    arg_parser.add_argument("kind", choices=["jack", "vm", "asm"])
+    arg_parser.add_argument("-o", "--output", default="-", help="output file, or - for stdout")
+    arg_parser.add_argument("-f", "--functions", type=int, default=100, help="functions (jack, vm)")
+    arg_parser.add_argument("-s", "--statements", type=int, default=20, help="statements per function (jack), commands per function (vm) or instructions (asm)")
+    arg_parser.add_argument("-d", "--depth", type=int, default=8, help="expression nesting (jack)")
+    arg_parser.add_argument("--string-length", type=int, default=40, help="characters in each string literal (jack)")
+    arg_parser.add_argument("-l", "--labels", type=int, default=10, help="labels per function (vm) or in all (asm)")
+    arg_parser.add_argument("--name", help="class name (jack, vm)")
+    arg_parser.add_argument("--stack-only", action="store_true", help="only push, pop and arithmetic commands, for 07/vmtranslator.py (vm)")
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+
+    if args.kind == "jack":
+        text = generateJack(args.functions, args.statements, args.depth, args.string_length, args.name or "Big", args.seed)
+    elif args.kind == "vm":
+        text = generateVM(args.functions, args.statements, args.labels, args.name or "Prog", args.seed, args.stack_only)
+    else:
+        text = generateAsm(args.statements, args.labels, args.seed)
+    with (nullcontext(sys.stdout) if args.output == "-" else open(args.output, "w")) as f:
+        f.write(text)
@@ -0,0 +1,101 @@
+import json
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+class Profiler:
+    """
+    Per-phase timers, throughput counters and allocation counts behind the
+    tools' --profile flag. A tool only imports this when the flag is given
+    and then wraps the methods it wants timed, so without the flag nothing
+    is measured and nothing is slower. tracemalloc does slow everything
+    down while it runs, so compare profiled times with each other only.
+    """
+    def __init__(self):
+        #phase -> [calls, seconds, net blocks, net bytes]
+        self.phases = {}
+        #counter -> [count, phase it is a rate of]
+        self.counters = {}
+        #phase -> how deep it is in itself, so recursion is timed once
+        self.depth = {}
+        tracemalloc.start()
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        depth = self.depth.get(name, 0)
+        self.depth[name] = depth + 1
+        blocks = sys.getallocatedblocks()
+        memory = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.depth[name] = depth
+            if depth == 0:
+                stats = self.phases.setdefault(name, [0, 0.0, 0, 0])
+                stats[0] += 1
+                stats[1] += seconds
+                stats[2] += sys.getallocatedblocks() - blocks
+                stats[3] += tracemalloc.get_traced_memory()[0] - memory
+
+    def wrap(self, owner, name, phase=None, counter=None, count=None):
+        """
+        Replaces owner.name, a method of a class or a function of a module,
+        with one timed as phase. With a counter, count(result, args) is
+        added to it after each call.
+        """
+        function = getattr(owner, name)
+        if phase is None:
+            phase = owner.__name__ + "." + name
+        profiler = self
+        def timed(*args, **kwargs):
+            with profiler.phase(phase):
+                result = function(*args, **kwargs)
+            if counter is not None:
+                profiler.count(counter, count(result, args), phase)
+            return result
+        setattr(owner, name, timed)
+
+    def count(self, counter, n, phase=None):
+        stats = self.counters.setdefault(counter, [0, phase])
+        stats[0] += n
+
+    def report(self):
+        """
+        Returns the measurements as a dict, ready for JSON
+        """
+        phases = {}
+        for name, (calls, seconds, blocks, memory) in self.phases.items():
+            phases[name] = {"calls": calls, "seconds": seconds, "blocks": blocks, "bytes": memory}
+        counters = {}
+        for name, (n, phase) in self.counters.items():
+            counters[name] = {"count": n, "phase": phase}
+            if phase in self.phases and self.phases[phase][1] > 0:
+                counters[name]["per_second"] = n / self.phases[phase][1]
+        return {"seconds": time.perf_counter() - self.start, "peak_bytes": tracemalloc.get_traced_memory()[1], "phases": phases, "counters": counters}
+
+    def write(self, destination):
+        """
+        Prints the report as a table on stderr for -, otherwise writes it
+        to the file destination as JSON
+        """
+        report = self.report()
+        tracemalloc.stop()
+        if destination != "-":
+            with open(destination, "w") as f:
+                json.dump(report, f, indent=1, sort_keys=True)
+                f.write("\n")
+            return
+        output = sys.stderr
+        output.write("%-36s %8s %10s %10s %12s\n" % ("phase", "calls", "seconds", "blocks", "bytes"))
+        for name, stats in sorted(report["phases"].items(), key=lambda p: -p[1]["seconds"]):
+            output.write("%-36s %8d %10.4f %10d %12d\n" % (name, stats["calls"], stats["seconds"], stats["blocks"], stats["bytes"]))
+        for name, stats in sorted(report["counters"].items()):
+            output.write("%-36s %8d" % (name, stats["count"]))
+            if "per_second" in stats:
+                output.write("  %.0f/s in %s" % (stats["per_second"], stats["phase"]))
+            output.write("\n")
+        output.write("%.4f seconds in all, peak %d bytes traced\n" % (report["seconds"], report["peak_bytes"]))
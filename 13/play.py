@@ -0,0 +1,384 @@
+import argparse
+import asyncio
+import os
+import shutil
+import signal
+import sys
+import time
+from emulator import Emulator, KBD, SCREEN, SCREEN_SIZE, readHack, readSymbols
+
+#instructions per second the 11/OS Sys.wait is calibrated for: its inner
+#loop takes about 624 cycles a millisecond once translated by vmtranslator2
+HACK_CLOCK = 624000
+#longest an emulation slice should take, so frames and keys are not held up
+SLICE = 0.005
+#fewest instructions worth waking up for
+MIN_SLICE = 1000
+#how far the emulator may fall behind the clock before the debt is dropped,
+#so a slow host runs flat out instead of racing to catch up
+MAX_LAG = 0.1
+#a terminal key stays down this long after the first autorepeat
+REPEAT_HOLD = 0.1
+
+#Hack keyboard codes for the keys that are not characters
+HACK_KEYS = {"newline": 128, "backspace": 129, "left": 130, "up": 131, "right": 132, "down": 133,
+        "home": 134, "end": 135, "pageup": 136, "pagedown": 137, "insert": 138, "delete": 139, "escape": 140}
+for i in range(12):
+    HACK_KEYS["f" + str(i + 1)] = 141 + i
+
+#terminal input -> Hack key
+TERMINAL_KEYS = {"\r": "newline", "\n": "newline", "\x7f": "backspace", "\x08": "backspace",
+        "\x1b[D": "left", "\x1b[A": "up", "\x1b[C": "right", "\x1b[B": "down",
+        "\x1bOD": "left", "\x1bOA": "up", "\x1bOC": "right", "\x1bOB": "down",
+        "\x1b[H": "home", "\x1b[F": "end", "\x1b[1~": "home", "\x1b[4~": "end",
+        "\x1b[5~": "pageup", "\x1b[6~": "pagedown", "\x1b[2~": "insert", "\x1b[3~": "delete",
+        "\x1bOP": "f1", "\x1bOQ": "f2", "\x1bOR": "f3", "\x1bOS": "f4",
+        "\x1b[15~": "f5", "\x1b[17~": "f6", "\x1b[18~": "f7", "\x1b[19~": "f8",
+        "\x1b[20~": "f9", "\x1b[21~": "f10", "\x1b[23~": "f11", "\x1b[24~": "f12"}
+#Tk keysym -> Hack key
+WINDOW_KEYS = {"Return": "newline", "KP_Enter": "newline", "BackSpace": "backspace", "Left": "left", "Up": "up",
+        "Right": "right", "Down": "down", "Home": "home", "End": "end", "Prior": "pageup", "Next": "pagedown",
+        "Insert": "insert", "Delete": "delete", "Escape": "escape"}
+for i in range(12):
+    WINDOW_KEYS["F" + str(i + 1)] = "f" + str(i + 1)
+#control characters that drive the player instead of the program
+CONTROLS = {"\x06": "faster", "\x02": "slower", "\x14": "throttle", "\x10": "pause", "\x03": "quit"}
+CONTROL_HELP = "^F faster ^B slower ^T throttle ^P pause ^C quit"
+
+def parseKeys(data):
+    """
+    Splits what the terminal sent into Hack key codes and CONTROLS names.
+    An escape not starting a known sequence is the escape key.
+    """
+    keys = []
+    i = 0
+    while i < len(data):
+        if data[i] == "\x1b":
+            match = None
+            for sequence in TERMINAL_KEYS:
+                if data.startswith(sequence, i) and (match is None or len(sequence) > len(match)):
+                    match = sequence
+            if match is None:
+                keys.append(HACK_KEYS["escape"])
+                i += 1
+            else:
+                keys.append(HACK_KEYS[TERMINAL_KEYS[match]])
+                i += len(match)
+        elif data[i] in CONTROLS:
+            keys.append(CONTROLS[data[i]])
+            i += 1
+        elif data[i] in TERMINAL_KEYS:
+            keys.append(HACK_KEYS[TERMINAL_KEYS[data[i]]])
+            i += 1
+        else:
+            if " " <= data[i] <= "~":
+                keys.append(ord(data[i]))
+            i += 1
+    return keys
+
+class TerminalDisplay:
+    """
+    Draws the screen with half block characters, each covering scale
+    pixels across and two times scale down, and reads keys from the
+    terminal. Terminals report no key releases, so a key is held for
+    hold seconds after it is typed, or REPEAT_HOLD once it autorepeats.
+    """
+    CELLS = [" ", "▄", "▀", "█"]
+
+    def __init__(self, scale, hold):
+        if not sys.stdin.isatty() or not sys.stdout.isatty():
+            print("The terminal display needs a terminal, try --window")
+            exit()
+        if scale is None:
+            columns, lines = shutil.get_terminal_size()
+            scale = 1
+            while scale < 8 and (512 // scale > columns or 256 // (2 * scale) + 1 > lines):
+                scale *= 2
+        self.scale = scale
+        self.hold = hold
+        self.rows = []
+        self.status = None
+        self.attributes = None
+
+    def open(self, player, loop):
+        import termios
+        import tty
+        fd = sys.stdin.fileno()
+        self.attributes = termios.tcgetattr(fd)
+        tty.setcbreak(fd)
+        self.player = player
+        self.loop = loop
+        loop.add_reader(fd, self.read)
+        #black on white like the Hack screen, cursor hidden
+        sys.stdout.write("\x1b[30;47m\x1b[?25l\x1b[2J")
+
+    def read(self):
+        data = os.read(sys.stdin.fileno(), 64).decode(errors="ignore")
+        for key in parseKeys(data):
+            if isinstance(key, str):
+                self.player.control(key)
+                continue
+            now = time.perf_counter()
+            if key == self.player.key and now < self.player.key_until:
+                self.player.press(key, now + REPEAT_HOLD)
+            else:
+                self.player.press(key, now + self.hold)
+
+    def draw(self, screen, status):
+        scale = self.scale
+        mask = (1 << scale) - 1
+        rows = []
+        for top in range(0, 256, 2 * scale):
+            halves = []
+            for y in (top, top + scale):
+                #OR together the pixel rows one character half covers
+                words = [0] * 32
+                for r in range(y, min(y + scale, 256)):
+                    row = screen[32 * r:32 * r + 32]
+                    for i in range(32):
+                        words[i] |= row[i]
+                bits = 0
+                for i in range(31, -1, -1):
+                    bits = bits << 16 | words[i]
+                halves.append(bits)
+            upper, lower = halves
+            rows.append(''.join(self.CELLS[(upper >> x & mask != 0) * 2 + (lower >> x & mask != 0)] for x in range(0, 512, scale)))
+        output = []
+        for i, row in enumerate(rows):
+            if i >= len(self.rows) or row != self.rows[i]:
+                output.append("\x1b[%d;1H%s" % (i + 1, row))
+        if status != self.status:
+            output.append("\x1b[%d;1H\x1b[0m\x1b[K%s\x1b[30;47m" % (len(rows) + 1, status))
+        self.rows = rows
+        self.status = status
+        if output:
+            sys.stdout.write(''.join(output))
+            sys.stdout.flush()
+
+    def close(self):
+        import termios
+        if self.attributes is not None:
+            self.loop.remove_reader(sys.stdin.fileno())
+            termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, self.attributes)
+        sys.stdout.write("\x1b[0m\x1b[?25h\x1b[%d;1H\n" % (len(self.rows) + 2))
+        sys.stdout.flush()
+
+class WindowDisplay:
+    """
+    Draws the screen in a Tk window zoom times its size. Tk reports
+    releases, so a key is down exactly while it is held.
+    """
+    def __init__(self, zoom):
+        try:
+            import tkinter
+        except ImportError:
+            print("--window needs tkinter")
+            exit()
+        self.tkinter = tkinter
+        self.zoom = zoom
+        #screen byte -> its 8 pixels as PGM bytes, least significant bit leftmost
+        self.pixels = [bytes(0 if b >> i & 1 else 255 for i in range(8) for z in range(zoom)) for b in range(256)]
+        self.header = b"P5 %d %d 255\n" % (512 * zoom, 256 * zoom)
+        self.screen = None
+        self.status = None
+
+    def open(self, player, loop):
+        try:
+            self.root = self.tkinter.Tk()
+        except self.tkinter.TclError:
+            print("No display for --window")
+            exit()
+        self.player = player
+        self.image = self.tkinter.PhotoImage(width=512 * self.zoom, height=256 * self.zoom)
+        self.tkinter.Label(self.root, image=self.image, borderwidth=0).pack()
+        self.root.bind("<KeyPress>", self.keyPress)
+        self.root.bind("<KeyRelease>", self.keyRelease)
+        self.root.protocol("WM_DELETE_WINDOW", player.stop)
+
+    def hackKey(self, event):
+        if event.keysym in WINDOW_KEYS:
+            return HACK_KEYS[WINDOW_KEYS[event.keysym]]
+        if len(event.char) == 1 and " " <= event.char <= "~":
+            return ord(event.char)
+        return None
+
+    def keyPress(self, event):
+        #Control is bit 2 of the modifier state
+        if event.state & 4 and event.char in CONTROLS:
+            self.player.control(CONTROLS[event.char])
+            return
+        key = self.hackKey(event)
+        if key is not None:
+            self.player.press(key, float("inf"))
+
+    def keyRelease(self, event):
+        if self.hackKey(event) == self.player.key:
+            self.player.release()
+
+    def draw(self, screen, status):
+        if screen != self.screen:
+            pixels = self.pixels
+            rows = []
+            for y in range(256):
+                row = b"".join(pixels[word & 0xFF] + pixels[word >> 8] for word in screen[32 * y:32 * y + 32])
+                rows.append(row * self.zoom)
+            self.image.put(self.header + b"".join(rows))
+            self.screen = screen
+        if status != self.status:
+            self.root.title(status)
+            self.status = status
+        self.root.update()
+
+    def close(self):
+        self.root.destroy()
+
+class Player:
+    """
+    Runs an emulator in real time on an asyncio loop. One task executes
+    the program in slices paced to hz times speed instructions a second,
+    another draws the screen fps times a second, and the display's key
+    events set KBD in between. Slices are kept to SLICE seconds and every
+    task yields after each step, so neither starves the other.
+    """
+    def __init__(self, emulator, hz, speed, fps):
+        self.emulator = emulator
+        self.hz = hz
+        self.speed = speed
+        self.fps = fps
+        self.throttled = speed > 0
+        self.paused = False
+        self.running = True
+        self.key = 0
+        self.key_until = 0
+        #the clock the throttle keeps to: instructions run since start
+        self.start = time.perf_counter()
+        self.done = 0
+        #instructions a second actually run, for the status line
+        self.rate = 0.0
+
+    def press(self, key, until):
+        self.key = key
+        self.key_until = until
+        self.emulator.ram[KBD] = key
+
+    def release(self):
+        self.key = 0
+        self.emulator.ram[KBD] = 0
+
+    def control(self, action):
+        if action == "faster":
+            self.speed = self.speed * 2 if self.speed else 1
+        elif action == "slower":
+            self.speed = self.speed / 2 if self.speed else 1
+        elif action == "throttle":
+            self.throttled = not self.throttled
+        elif action == "pause":
+            self.paused = not self.paused
+        elif action == "quit":
+            self.stop()
+        self.resetClock()
+
+    def resetClock(self):
+        self.start = time.perf_counter()
+        self.done = 0
+
+    def stop(self):
+        self.running = False
+
+    def status(self):
+        emulator = self.emulator
+        if emulator.pc >= len(emulator.rom):
+            state = "halted"
+        elif self.paused:
+            state = "paused"
+        elif self.throttled:
+            state = "x%g of %d Hz" % (self.speed, self.hz)
+        else:
+            state = "unthrottled"
+        return "%s  %.0f Hz  %d cycles  KBD %d  %s" % (state, self.rate, emulator.cycles, emulator.ram[KBD], CONTROL_HELP)
+
+    async def emulate(self):
+        emulator = self.emulator
+        size = len(emulator.rom)
+        slice_cycles = MIN_SLICE
+        while self.running:
+            now = time.perf_counter()
+            if self.key and now >= self.key_until:
+                self.release()
+            if self.paused or emulator.pc >= size:
+                self.resetClock()
+                await asyncio.sleep(1 / self.fps)
+                continue
+            cycles = slice_cycles
+            if self.throttled:
+                rate = self.hz * self.speed
+                behind = (now - self.start) * rate - self.done
+                if behind > MAX_LAG * rate:
+                    self.start = now - MAX_LAG
+                    self.done = 0
+                    behind = MAX_LAG * rate
+                if behind < MIN_SLICE:
+                    await asyncio.sleep((MIN_SLICE - behind) / rate)
+                    continue
+                cycles = min(cycles, int(behind))
+            start = time.perf_counter()
+            n = emulator.run(cycles)
+            seconds = time.perf_counter() - start
+            self.done += n
+            if n >= MIN_SLICE and seconds > 0:
+                slice_cycles = max(MIN_SLICE, int(n / seconds * SLICE))
+            await asyncio.sleep(0)
+
+    async def render(self, display):
+        emulator = self.emulator
+        period = 1 / self.fps
+        due = time.perf_counter()
+        last_time = due
+        last_cycles = emulator.cycles
+        while self.running:
+            now = time.perf_counter()
+            if now - last_time >= 1:
+                self.rate = (emulator.cycles - last_cycles) / (now - last_time)
+                last_time = now
+                last_cycles = emulator.cycles
+            display.draw(emulator.ram[SCREEN:SCREEN + SCREEN_SIZE], self.status())
+            due += period
+            delay = due - time.perf_counter()
+            #a late frame is dropped rather than made up for
+            if delay < 0:
+                due = time.perf_counter()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    async def play(self, display):
+        loop = asyncio.get_running_loop()
+        display.open(self, loop)
+        try:
+            loop.add_signal_handler(signal.SIGINT, self.stop)
+            self.resetClock()
+            await asyncio.gather(self.emulate(), self.render(display))
+        finally:
+            display.close()
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Play a .hack program interactively, showing its screen and feeding it keys, e.g. 11/Pong or 04/fill")
+    arg_parser.add_argument("file", help=".hack file")
+    arg_parser.add_argument("--hz", type=int, default=HACK_CLOCK, help="instructions a second at speed 1, by default what the OS's Sys.wait assumes")
+    arg_parser.add_argument("-s", "--speed", type=float, default=1, help="multiple of --hz to run at, 0 for as fast as possible")
+    arg_parser.add_argument("--fps", type=int, default=30, help="screen refreshes a second")
+    arg_parser.add_argument("--window", action="store_true", help="draw in a Tk window instead of the terminal")
+    arg_parser.add_argument("--zoom", type=int, default=2, help="window pixels per Hack pixel")
+    arg_parser.add_argument("--scale", type=int, choices=[1, 2, 4, 8], help="Hack pixels per terminal column, fitted to the terminal by default")
+    arg_parser.add_argument("--hold", type=float, default=0.5, help="seconds a key typed in the terminal stays down")
+    arg_parser.add_argument("--restore", metavar="SNAPSHOT", help="start from a snapshot saved by emulator.py --save-at")
+    arg_parser.add_argument("--intrinsics", nargs="?", const="", metavar="FUNCTIONS", help="run OS functions natively as emulator.py does; a native Sys.wait no longer waits")
+    arg_parser.add_argument("--symbols", metavar="FILE", help="the assembler's --symbols output, for --intrinsics; next to the .hack file by default")
+    args = arg_parser.parse_args()
+
+    emulator = Emulator(readHack(args.file))
+    if args.restore is not None:
+        emulator.restore(args.restore)
+    if args.intrinsics is not None:
+        emulator.useIntrinsics(readSymbols(args.symbols or args.file[:-5] + ".sym"), args.intrinsics.split(",") if args.intrinsics else None)
+    display = WindowDisplay(args.zoom) if args.window else TerminalDisplay(args.scale, args.hold)
+    asyncio.run(Player(emulator, args.hz, args.speed, args.fps).play(display))
@@ -0,0 +1,71 @@
+import argparse
+import bisect
+import hashlib
+from emulator import KBD, NO_WRITE, SCREEN, SCREEN_SIZE, readHack, readMap, readSymbols, readTrace, signed
+
+#names of the RAM words below the statics, as the VM uses them
+REGISTERS = ["SP", "LCL", "ARG", "THIS", "THAT"] + ["R" + str(i) for i in range(5, 16)]
+
+def isStatic(symbol):
+    """
+    The .sym file mixes labels and variables; the compiled ones are the
+    Class.N statics
+    """
+    return "." in symbol and symbol.rsplit(".", 1)[1].isdigit()
+
+class Names:
+    """
+    Turns ROM addresses into label+offset and RAM addresses into the
+    register, static or I/O word they are
+    """
+    def __init__(self, symbols):
+        labels = sorted((address, symbol) for symbol, address in symbols.items() if not isStatic(symbol))
+        self.addresses = [address for address, symbol in labels]
+        self.labels = [symbol for address, symbol in labels]
+        self.statics = dict((address, symbol) for symbol, address in symbols.items() if isStatic(symbol))
+
+    def rom(self, pc):
+        i = bisect.bisect_right(self.addresses, pc) - 1
+        if i < 0:
+            return str(pc)
+        offset = pc - self.addresses[i]
+        return self.labels[i] + ("+" + str(offset) if offset else "")
+
+    def ram(self, address):
+        if address < len(REGISTERS):
+            return REGISTERS[address]
+        if address in self.statics:
+            return self.statics[address]
+        if SCREEN <= address < SCREEN + SCREEN_SIZE:
+            return "SCREEN+" + str(address - SCREEN)
+        if address == KBD:
+            return "KBD"
+        return str(address)
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Print the instructions in a trace dumped by emulator.py --trace")
+    arg_parser.add_argument("file", help=".trace file")
+    arg_parser.add_argument("-n", "--last", type=int, default=50, help="instructions to print, the latest ones")
+    arg_parser.add_argument("--symbols", metavar="FILE", help="the assembler's --symbols output, to name addresses")
+    arg_parser.add_argument("--map", metavar="FILE", help="the assembler's --map output, to show the source line of each instruction")
+    arg_parser.add_argument("--hack", metavar="FILE", help="the .hack file, to check the trace was made with it")
+    args = arg_parser.parse_args()
+
+    cycles, rom_hash, entries = readTrace(args.file)
+    if args.hack is not None and hashlib.md5('\n'.join(readHack(args.hack)).encode()).digest() != rom_hash:
+        print("Trace " + args.file + " was made with a different program")
+        exit()
+    names = Names(readSymbols(args.symbols) if args.symbols is not None else {})
+    rows = readMap(args.map) if args.map is not None else []
+
+    first = len(entries) - min(args.last, len(entries))
+    for i in range(first, len(entries)):
+        pc, a, d, write = entries[i]
+        line = "%10d %6d %-32s A=%-6d D=%-6d" % (cycles - len(entries) + i + 1, pc, names.rom(pc), signed(a), signed(d))
+        if write != NO_WRITE:
+            line += " %s = %d" % (names.ram(write >> 16), signed(write & 0xFFFF))
+        if pc < len(rows):
+            locations = [field for field in rows[pc][1:] if ":" in field]
+            if locations:
+                line = "%-100s %s" % (line, locations[-1])
+        print(line)
@@ -0,0 +1,177 @@
+import argparse
+import io
+import json
+import math
+import os
+import runpy
+import sys
+import tempfile
+
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for tool in ("06", "08", "10", "11", "13"):
+    sys.path.insert(0, os.path.join(TOOLS, tool))
+import assembler
+import vmtranslator2
+import jackcompiler
+import jacksyntax
+import jacktokenizer
+from jackparser import parseFile
+from benchmark import measure
+from generate import generateJack, generateVM, generateAsm
+
+#shape of the inputs at size 1, --grow picks the one multiplied by the size
+SHAPE = {"functions": 10, "statements": 20, "depth": 8, "strings": 40, "labels": 10}
+#time per input byte growing by more than this power of the size is flagged
+SUPERLINEAR = 1.25
+
+def tokenizerStage(path):
+    with open(path) as f:
+        return jacktokenizer.tokenize(f.read())
+
+def jacksyntaxStage(path):
+    jacksyntax.CompilationEngine(parseFile(path), path[:-5] + "C.xml")
+
+def jackcompilerStage(path):
+    output = io.StringIO()
+    jackcompiler.compileFile(path, output)
+    return output.getvalue()
+
+def vmtranslatorStage(path):
+    """
+    07/vmtranslator.py is a plain script, so it is run as one. It skips
+    function, call and branch commands, so it gets a file without them.
+    """
+    argv = sys.argv
+    sys.argv = ["vmtranslator.py", path]
+    try:
+        runpy.run_path(os.path.join(TOOLS, "07", "vmtranslator.py"), run_name="__main__")
+    finally:
+        sys.argv = argv
+
+def vmtranslator2Stage(path):
+    return vmtranslator2.translateFile(path)
+
+def assemblerStage(path):
+    with open(path) as f:
+        return assembler.link([assembler.AsmChunk(f.read().split('\n'))])
+
+#stage -> (function, kind of input it reads)
+STAGES = {"tokenizer": (tokenizerStage, "jack"),
+        "jacksyntax": (jacksyntaxStage, "jack"),
+        "jackcompiler": (jackcompilerStage, "jack"),
+        "vmtranslator": (vmtranslatorStage, "stack vm"),
+        "vmtranslator2": (vmtranslator2Stage, "vm"),
+        "assembler": (assemblerStage, "asm")}
+
+def writeInputs(directory, shape):
+    """
+    Generates one input of each kind with the given shape, returning
+    kind -> (path, bytes)
+    """
+    texts = {"jack": generateJack(shape["functions"], shape["statements"], shape["depth"], shape["strings"]),
+            "vm": generateVM(shape["functions"], shape["statements"] * 4, shape["labels"]),
+            "stack vm": generateVM(shape["functions"], shape["statements"] * 4, shape["labels"], "Stack", stack_only=True),
+            "asm": generateAsm(shape["functions"] * shape["statements"] * 40, shape["functions"] * shape["labels"])}
+    names = {"jack": "Big.jack", "vm": "Prog.vm", "stack vm": "Stack.vm", "asm": "Code.asm"}
+    inputs = {}
+    for kind, text in texts.items():
+        path = os.path.join(directory, names[kind])
+        with open(path, "w") as f:
+            f.write(text)
+        inputs[kind] = (path, len(text))
+    return inputs
+
+def run(stage, path, repeat):
+    """
+    Measures one stage on one input, returning its metrics, or the error
+    when the stage fails on it
+    """
+    function = STAGES[stage][0]
+    try:
+        result, seconds, peak = measure(repeat, function, path)
+    except SystemExit:
+        return {"error": "exited"}
+    except Exception as e:
+        return {"error": e.__class__.__name__ + ": " + str(e).split('\n')[-1][:60]}
+    return {"seconds": seconds, "peak_bytes": peak}
+
+def growth(points):
+    """
+    Power of the input size the time grows with, from the smallest and
+    largest inputs that worked. 1 is linear. None when the input did not
+    at least double, as the noise would swamp it.
+    """
+    points = [(size, m["seconds"]) for size, m in points if "seconds" in m and m["seconds"] > 0]
+    if len(points) < 2 or points[-1][0] < 2 * points[0][0]:
+        return None
+    return math.log(points[-1][1] / points[0][1]) / math.log(points[-1][0] / points[0][0])
+
+def plot(results, stages, output_file):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("--plot needs matplotlib")
+        exit()
+    figure, (time_axes, memory_axes) = plt.subplots(1, 2, figsize=(12, 5))
+    for stage in stages:
+        points = [(r["bytes"][STAGES[stage][1]], r["stages"][stage]) for r in results if "seconds" in r["stages"][stage]]
+        time_axes.loglog([p[0] for p in points], [p[1]["seconds"] for p in points], marker="o", label=stage)
+        memory_axes.loglog([p[0] for p in points], [p[1]["peak_bytes"] for p in points], marker="o", label=stage)
+    time_axes.set_xlabel("input bytes")
+    time_axes.set_ylabel("seconds")
+    memory_axes.set_xlabel("input bytes")
+    memory_axes.set_ylabel("peak bytes")
+    time_axes.legend()
+    figure.savefig(output_file)
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run every stage on generated inputs of growing size and show how time and memory scale")
+    arg_parser.add_argument("stages", nargs="*", default=list(STAGES), help="stages to run, all of them by default: " + ", ".join(STAGES))
+    arg_parser.add_argument("-s", "--sizes", type=int, nargs="+", default=[1, 2, 4, 8], help="multiples of the base shape to generate")
+    arg_parser.add_argument("-g", "--grow", choices=list(SHAPE), default="functions", help="what the size multiplies")
+    arg_parser.add_argument("-r", "--repeat", type=int, default=3, help="times each stage is run, the fastest counts")
+    arg_parser.add_argument("--json", metavar="FILE", help="also write the results to FILE")
+    arg_parser.add_argument("--plot", metavar="FILE", help="draw time and memory against input size to FILE, needs matplotlib")
+    args = arg_parser.parse_args()
+
+    for stage in args.stages:
+        if stage not in STAGES:
+            print("Unknown stage " + stage)
+            exit()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in args.sizes:
+            shape = dict(SHAPE)
+            shape[args.grow] *= size
+            inputs = writeInputs(directory, shape)
+            stages = {}
+            for stage in args.stages:
+                stages[stage] = run(stage, inputs[STAGES[stage][1]][0], args.repeat)
+            results.append({"size": size, "shape": shape, "bytes": {kind: size for kind, (path, size) in inputs.items()}, "stages": stages})
+
+    print("%-14s %6s %10s %10s %10s %12s" % ("stage", "size", "bytes", "seconds", "ns/byte", "peak bytes"))
+    for stage in args.stages:
+        kind = STAGES[stage][1]
+        points = []
+        for result in results:
+            size = result["bytes"][kind]
+            metrics = result["stages"][stage]
+            points.append((size, metrics))
+            if "error" in metrics:
+                print("%-14s %6d %10d  %s" % (stage, result["size"], size, metrics["error"]))
+            else:
+                print("%-14s %6d %10d %10.4f %10.1f %12d" % (stage, result["size"], size, metrics["seconds"], metrics["seconds"] * 1e9 / size, metrics["peak_bytes"]))
+        power = growth(points)
+        if power is not None:
+            print("%-14s time grows as bytes^%.2f%s" % (stage, power, "  SUPERLINEAR" if power > SUPERLINEAR else ""))
+        print()
+
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({"grow": args.grow, "results": results}, f, indent=1, sort_keys=True)
+            f.write("\n")
+    if args.plot is not None:
+        plot(results, args.stages, args.plot)
@@ -0,0 +1,280 @@
+import argparse
+import io
+import os
+import sys
+import time
+
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+for tool in ("06", "08", "11"):
+    sys.path.insert(0, os.path.join(TOOLS, tool))
+import assembler
+import vmtranslator2
+import jackcompiler
+
+def stamp(path):
+    """
+    Cheap change check, the file is only read again when this changes
+    """
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_size)
+
+def readFile(path):
+    with open(path) as f:
+        return f.read()
+
+def calledFunctions(vm_code):
+    """
+    Returns (function name, nArgs) for every call in vm_code
+    """
+    calls = []
+    for line in vm_code.split('\n'):
+        if line.startswith("call "):
+            command = line.split()
+            calls.append((command[1], int(command[2])))
+    return calls
+
+class JackClass:
+    """
+    What the watcher keeps about one .jack file between builds
+    """
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)[:-5]
+        self.stamp = None
+        self.source = None
+        #subroutine name -> (kind, number of parameters)
+        self.interface = {}
+        self.calls = []
+        self.error = None
+
+    def compile(self):
+        """
+        Recompiles the class if its text changed, writing the .vm next to it.
+        Returns True if it was recompiled.
+        """
+        new_stamp = stamp(self.path)
+        if new_stamp == self.stamp:
+            return False
+        self.stamp = new_stamp
+        source = readFile(self.path)
+        if source == self.source:
+            return False
+        self.source = source
+        output = io.StringIO()
+        class_node, self.error = jackcompiler.catchErrors(jackcompiler.compileFile, self.path, output)
+        if self.error is not None:
+            return True
+        vm_code = output.getvalue()
+        self.interface = {}
+        for subroutine in class_node.subroutines:
+            self.interface[subroutine.name] = (subroutine.kind, len(subroutine.parameters))
+        self.calls = calledFunctions(vm_code)
+        with open(self.path[:-5] + ".vm", "w") as f:
+            f.write(vm_code)
+        return True
+
+class VMFile:
+    """
+    The Hack assembly of one .vm file, translated and pre-assembled on its own
+    """
+    def __init__(self, path, shared_calls=False):
+        self.path = path
+        self.shared_calls = shared_calls
+        self.stamp = None
+        self.source = None
+        self.functions = set()
+        self.uses_runtime = False
+        self.asm = ""
+        self.chunk = None
+
+    def translate(self):
+        """
+        Retranslates the file if its text changed. Returns True if it was.
+        """
+        new_stamp = stamp(self.path)
+        if new_stamp == self.stamp:
+            return False
+        self.stamp = new_stamp
+        source = readFile(self.path)
+        if source == self.source:
+            return False
+        self.source = source
+        self.functions = set(line.split()[1] for line in source.split('\n') if line.startswith("function "))
+        self.asm, report, self.uses_runtime = vmtranslator2.translateFile(self.path, shared_calls=self.shared_calls)
+        self.chunk = assembler.AsmChunk(self.asm.split('\n'))
+        return True
+
+class Project:
+    def __init__(self, directory, libraries=(), shared_calls=False):
+        self.directory = os.path.normpath(directory)
+        self.shared_calls = shared_calls
+        self.libraries = [os.path.normpath(l) for l in libraries]
+        self.name = os.path.basename(os.path.abspath(self.directory))
+        self.classes = {}
+        self.vm_files = {}
+        #set when the last build failed, so the next one links even if no VM changed
+        self.failed = True
+        self.bootstrap = vmtranslator2.bootstrapCode(shared_calls=shared_calls)
+        self.bootstrap_chunk = assembler.AsmChunk(self.bootstrap.split('\n'))
+        self.runtime = vmtranslator2.runtimeCode()
+        self.runtime_chunk = assembler.AsmChunk(self.runtime.split('\n'))
+
+    def scan(self, directory, extension):
+        return [os.path.join(directory, f) for f in os.listdir(directory) if f.endswith(extension) and os.path.isfile(os.path.join(directory, f))]
+
+    def compileClasses(self):
+        """
+        Recompiles changed classes and returns the names of those compiled
+        and of those whose interface changed or that went away
+        """
+        jack_files = self.scan(self.directory, ".jack")
+        for path in jack_files:
+            if path not in self.classes:
+                self.classes[path] = JackClass(path)
+        changed_interfaces = set()
+        for path in list(self.classes):
+            if path not in jack_files:
+                changed_interfaces.add(self.classes.pop(path).name)
+        compiled = []
+        for jack_class in self.classes.values():
+            old_interface = jack_class.interface
+            if jack_class.compile():
+                compiled.append(jack_class.name)
+                if jack_class.interface != old_interface:
+                    changed_interfaces.add(jack_class.name)
+        return compiled, changed_interfaces
+
+    def check(self, compiled, changed_interfaces):
+        """
+        Checks the calls made by the compiled classes and by every class
+        that calls into one whose interface changed. Returns warnings.
+        """
+        interfaces = {}
+        for jack_class in self.classes.values():
+            interfaces[jack_class.name] = jack_class.interface
+        vm_functions = set()
+        for vm_file in self.vm_files.values():
+            vm_functions |= vm_file.functions
+        warnings = []
+        for jack_class in self.classes.values():
+            if jack_class.error is not None:
+                continue
+            if jack_class.name not in compiled and not any(f.split('.')[0] in changed_interfaces for f, _ in jack_class.calls):
+                continue
+            for function_name, n_args in jack_class.calls:
+                class_name, subroutine = function_name.split('.', 1)
+                if class_name in interfaces:
+                    if subroutine not in interfaces[class_name]:
+                        warnings.append(jack_class.name + ": " + function_name + " is not defined")
+                    else:
+                        kind, n_parameters = interfaces[class_name][subroutine]
+                        #method calls pass this as an extra first argument
+                        if kind == "method":
+                            n_args -= 1
+                        if n_args != n_parameters:
+                            warnings.append(jack_class.name + ": " + function_name + " called with " + str(n_args) + " arguments, takes " + str(n_parameters))
+                elif function_name not in vm_functions:
+                    warnings.append(jack_class.name + ": " + function_name + " is not defined")
+        return sorted(set(warnings))
+
+    def translateFiles(self):
+        """
+        Retranslates changed .vm files and returns the names of the files
+        that were translated, added or dropped. A project class replaces
+        the library file of the same name.
+        """
+        vm_paths = self.scan(self.directory, ".vm")
+        classes = set(os.path.basename(path) for path in vm_paths)
+        for library in self.libraries:
+            vm_paths += [path for path in self.scan(library, ".vm") if os.path.basename(path) not in classes]
+        changed = []
+        for path in list(self.vm_files):
+            if path not in vm_paths:
+                del self.vm_files[path]
+                changed.append(os.path.basename(path))
+        for path in vm_paths:
+            if path not in self.vm_files:
+                self.vm_files[path] = VMFile(path, self.shared_calls)
+            if self.vm_files[path].translate():
+                changed.append(os.path.basename(path))
+        return changed
+
+    def link(self):
+        """
+        Writes the program's .asm and .hack from the cached chunks, laid out
+        the way vmtranslator2 lays out a directory
+        """
+        vm_files = sorted(self.vm_files.values(), key=lambda v: os.path.basename(v.path))
+        asm = [v.asm for v in vm_files]
+        chunks = [v.chunk for v in vm_files]
+        if len(vm_files) > 1:
+            asm.insert(0, self.bootstrap)
+            chunks.insert(0, self.bootstrap_chunk)
+        if (len(vm_files) > 1 and self.shared_calls) or any(v.uses_runtime for v in vm_files):
+            asm.append(self.runtime)
+            chunks.append(self.runtime_chunk)
+        output_file = os.path.join(self.directory, self.name)
+        with open(output_file + ".asm", "w") as f:
+            f.write(''.join(asm))
+        words = assembler.link(chunks)
+        with open(output_file + ".hack", "w") as f:
+            writer = assembler.HackWriter(f)
+            for word in words:
+                writer.write(word)
+            writer.flush()
+        return len(words)
+
+    def build(self):
+        """
+        Brings the .vm, .asm and .hack files up to date, doing only the work
+        the changed files need. Returns False if nothing changed.
+        """
+        start = time.perf_counter()
+        compiled, changed_interfaces = self.compileClasses()
+        errors = [c.path + ": " + c.error for c in self.classes.values() if c.error is not None]
+        translated = self.translateFiles()
+        if not compiled and not changed_interfaces and not translated:
+            return False
+        for warning in self.check(compiled, changed_interfaces):
+            print("warning: " + warning)
+        if errors:
+            for error in errors:
+                print(error)
+            print("Build failed")
+            self.failed = True
+            return True
+        summary = ""
+        if compiled:
+            summary += "compiled " + ", ".join(sorted(compiled)) + "; "
+        if not translated and not self.failed:
+            print(summary + "VM code unchanged")
+            return True
+        self.failed = False
+        words = self.link()
+        if translated:
+            summary += "translated " + ", ".join(sorted(translated))
+        else:
+            summary += "relinked"
+        print("Built " + self.name + ".hack (" + str(words) + " words) in %.3fs: " % (time.perf_counter() - start) + summary)
+        if words > vmtranslator2.ROM_SIZE:
+            print("warning: program is larger than the " + str(vmtranslator2.ROM_SIZE) + " word ROM" + ("" if self.shared_calls else ", try --shared-calls"))
+        return True
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Rebuild a Jack project's .vm, .asm and .hack files whenever its sources change")
+    arg_parser.add_argument("directory", help="project directory with .jack and .vm files")
+    arg_parser.add_argument("-l", "--lib", action="append", default=[], help="directory of extra .vm files to link in, e.g. the OS")
+    arg_parser.add_argument("-i", "--interval", type=float, default=0.25, help="seconds between polls")
+    arg_parser.add_argument("--once", action="store_true", help="build once and exit")
+    arg_parser.add_argument("--shared-calls", action="store_true", help="translate as vmtranslator2 --shared-calls, for programs that would not fit the ROM otherwise")
+    args = arg_parser.parse_args()
+
+    project = Project(args.directory, args.lib, args.shared_calls)
+    project.build()
+    if not args.once:
+        try:
+            while True:
+                time.sleep(args.interval)
+                project.build()
+        except KeyboardInterrupt:
+            pass